@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+'''Benchmark submission, status query and killing of tasks with PBS_TaskEngine
+against a fake PBS scheduler (fake_pbs/qsub, qstat and qdel), and report
+tasks/second, p50/p99 per-task latency and the number of commands executed.
+
+Results are appended to a JSON lines file (pbs_bench_results.jsonl under the
+current directory by default) and compared with the last result of the same
+benchmark, so that regressions can be spotted between releases.
+
+    python bench_pbs_engine.py --tasks 100 1000 --configs single bulk
+'''
+
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+
+JOB_TEMPLATE = '''\
+#!/bin/bash
+#PBS -N {job_name}
+#PBS -l nodes={nodes}:ppn={cores}
+cd {cur_dir}
+sos execute {task} -v {verbosity} -s {sig_mode}
+'''
+
+ARRAY_JOB_TEMPLATE = '''\
+#!/bin/bash
+#PBS -N {job_name}
+#PBS -J {array_first}-{array_last}
+cd {cur_dir}
+sos execute $(sed -n "$((PBS_ARRAY_INDEX + 1))p" {array_file}) -v {verbosity} -s {sig_mode}
+'''
+
+BUNDLE_JOB_TEMPLATE = '''\
+#!/bin/bash
+#PBS -N {job_name}
+#PBS -l nodes=1:ppn={cores}
+{commands}
+'''
+
+BULK = {
+    'bulk_status_cmd': 'qstat {job_ids}',
+    'bulk_kill_cmd': 'qdel {job_ids}',
+}
+
+# queue configurations to benchmark, on top of a configuration with
+# job_template, submit_cmd, status_cmd and kill_cmd
+CONFIGS = {
+    'single': {},
+    'workers': {'submit_workers': 8},
+    'bulk': dict(BULK, submit_workers=8),
+    'array': dict(BULK, array_job_template=ARRAY_JOB_TEMPLATE,
+        array_submit_cmd='qsub -J {array_first}-{array_last} {job_file}',
+        array_job_id='{job_id[:-len("[].fakepbs")]}[{index}].fakepbs'),
+    'bundle': dict(BULK, bundle_job_template=BUNDLE_JOB_TEMPLATE, bundle_cores=16),
+}
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def create_agent(config):
+    from sos.hosts import LocalHost
+
+    class BenchmarkAgent(LocalHost):
+        '''A local host that answers "sos status" and "sos kill" without running
+        sos, and counts the commands that are executed by the task engine'''
+
+        def __init__(self, config):
+            # LocalHost.__init__ requires a complete sos configuration
+            self.config = config
+            self.alias = config['alias']
+            self.address = 'localhost'
+            self.port = 22
+            self.calls = collections.Counter()
+            self._lock = threading.Lock()
+
+        def _count(self, name):
+            with self._lock:
+                self.calls[name] += 1
+
+        def prepare_task(self, task_id):
+            return True
+
+        def send_task_file(self, task_file):
+            self._count('send_task_file')
+
+        def check_output(self, cmd, *args, **kwargs):
+            words = cmd.split()
+            if words[:2] == ['sos', 'status']:
+                self._count('sos status')
+                tasks = words[2:words.index('-v')]
+                return ''.join(f'{x}\tsubmitted\n' for x in tasks)
+            if words[:2] == ['sos', 'kill']:
+                self._count('sos kill')
+                tasks = [x for x in words[2:] if not x.startswith('-')]
+                return ''.join(f'{x}\tkilled\n' for x in tasks)
+            # commands are counted by their programs, e.g. "if (qsub ...)" as qsub
+            self._count((words[1] if words[0] == 'if' else words[0]).lstrip('('))
+            return subprocess.check_output(cmd, shell=True, stderr=subprocess.DEVNULL).decode()
+
+    return BenchmarkAgent(config)
+
+
+def create_tasks(num_tasks):
+    from sos.tasks import TaskFile, TaskParams
+
+    task_ids = []
+    for i in range(num_tasks):
+        task_id = f'bench{i:08d}'
+        runtime = {'cur_dir': '/tmp', 'home_dir': os.path.expanduser('~'), 'verbosity': 1,
+            'sig_mode': 'default', 'run_mode': 'run', 'walltime': '00:10:00', 'cores': 1, 'mem': 1000000000}
+        TaskFile(task_id).save(TaskParams(task_id, '', 'pass', {'_runtime': runtime}, set()))
+        task_ids.append(task_id)
+    return task_ids
+
+
+def run_phase(func, task_ids, batch_size, latency):
+    # call func with batches of tasks and return elapsed time. The latency
+    # of tasks are the time to process its batch, unless func records them
+    start = time.time()
+    for i in range(0, len(task_ids), batch_size):
+        batch = task_ids[i:i + batch_size]
+        batch_start = time.time()
+        func(batch, batch_start)
+        for task_id in batch:
+            latency.setdefault(task_id, time.time() - batch_start)
+    return time.time() - start
+
+
+def benchmark(config_name, num_tasks, args):
+    from sos_pbs.tasks import PBS_TaskEngine
+
+    config = {'alias': f'bench_{config_name}', 'queue_type': 'pbs', 'job_template': JOB_TEMPLATE,
+        'submit_cmd': 'qsub {job_file}', 'status_cmd': 'qstat {job_id}', 'kill_cmd': 'qdel {job_id}',
+        'submit_retry_interval': 0, 'status_check_interval': args.status_check_interval}
+    config.update(CONFIGS[config_name])
+    agent = create_agent(config)
+    engine = PBS_TaskEngine(agent)
+    engine.engine_ready.set()
+
+    task_ids = create_tasks(num_tasks)
+    results = {}
+
+    # submission, with tasks timed when their job ids are saved
+    submitted = {}
+    write_job_id = engine._write_job_id
+
+    def timed_write_job_id(task_id, job_id):
+        submitted[task_id] = time.time()
+        return write_job_id(task_id, job_id)
+
+    engine._write_job_id = timed_write_job_id
+    latency = {}
+
+    def submit(batch, batch_start):
+        engine.execute_tasks(batch)
+        for task_id in batch:
+            if task_id in submitted:
+                latency[task_id] = submitted[task_id] - batch_start
+
+    agent.calls.clear()
+    elapsed = run_phase(submit, task_ids, engine.batch_size, latency)
+    results['submit'] = (elapsed, [latency[x] for x in task_ids if x in submitted],
+        num_tasks - len(submitted), dict(agent.calls))
+
+    # status of submitted tasks, which are checked against the status of jobs
+    latency = {}
+    failed = []
+
+    def query(batch, batch_start):
+        output = engine.query_tasks(tasks=batch, verbosity=1)
+        failed.extend(line.split('\t')[0] for line in output.splitlines() if line.endswith('\tfailed'))
+
+    agent.calls.clear()
+    elapsed = run_phase(query, task_ids, args.status_batch_size, latency)
+    results['status'] = (elapsed, list(latency.values()), len(failed), dict(agent.calls))
+
+    # killing of tasks and their jobs
+    latency = {}
+    agent.calls.clear()
+    elapsed = run_phase(lambda batch, batch_start: engine.kill_tasks(batch), task_ids,
+        args.kill_batch_size, latency)
+    results['kill'] = (elapsed, list(latency.values()), 0, dict(agent.calls))
+    return results
+
+
+def load_results(filename):
+    if not os.path.isfile(filename):
+        return []
+    with open(filename) as res:
+        return [json.loads(line) for line in res if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', nargs='+', type=int, default=[100, 1000, 10000],
+        help='Numbers of tasks to benchmark')
+    parser.add_argument('--configs', nargs='+', choices=list(CONFIGS.keys()), default=list(CONFIGS.keys()),
+        help='Queue configurations to benchmark')
+    parser.add_argument('--latency', type=float, default=0,
+        help='Seconds of latency of each command of the fake scheduler')
+    parser.add_argument('--failure-rate', type=float, default=0,
+        help='Fraction of submissions that fail')
+    parser.add_argument('--status-batch-size', type=int, default=100,
+        help='Number of tasks in each status query')
+    parser.add_argument('--kill-batch-size', type=int, default=100,
+        help='Number of tasks in each kill request')
+    parser.add_argument('--status-check-interval', type=int, default=10,
+        help='Status check interval of the queue, which is also the lifetime of cached job status')
+    parser.add_argument('--output', default='pbs_bench_results.jsonl',
+        help='File to which results are appended, which is pbs_bench_results.jsonl under the current directory by default')
+    parser.add_argument('--keep', action='store_true',
+        help='Keep the temporary home directory with task files and fake scheduler state')
+    args = parser.parse_args(argv)
+    args.output = os.path.abspath(os.path.expanduser(args.output))
+
+    # tasks and job ids are saved under a temporary home directory
+    home_dir = tempfile.mkdtemp(prefix='sos_pbs_bench_')
+    os.environ['HOME'] = home_dir
+    os.environ['PATH'] = os.path.join(bench_dir, 'fake_pbs') + os.pathsep + os.environ['PATH']
+    os.environ['FAKE_PBS_LATENCY'] = str(args.latency) if args.latency else ''
+    os.environ['FAKE_PBS_FAILURE_RATE'] = str(args.failure_rate) if args.failure_rate else ''
+    os.makedirs(os.path.join(home_dir, '.sos', 'tasks'))
+
+    sys.path.insert(0, os.path.join(os.path.dirname(bench_dir), 'src'))
+    from sos.utils import env
+    from sos import __version__ as sos_version
+    from sos_pbs._version import __version__
+
+    env.verbosity = 0
+    previous = load_results(args.output)
+    records = []
+    print(f'{"config":<8} {"tasks":>6} {"phase":<7} {"tasks/s":>9} {"p50 (s)":>9} {"p99 (s)":>9} {"failed":>6} {"change":>7}  calls')
+    try:
+        for config_name in args.configs:
+            for num_tasks in args.tasks:
+                os.environ['FAKE_PBS_DIR'] = os.path.join(home_dir, f'fake_pbs_{config_name}_{num_tasks}')
+                results = benchmark(config_name, num_tasks, args)
+                for phase, (elapsed, latency, failed, calls) in results.items():
+                    record = {'version': __version__, 'sos_version': sos_version,
+                        'python': platform.python_version(), 'host': platform.node(),
+                        'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'config': config_name, 'tasks': num_tasks,
+                        'phase': phase, 'latency': args.latency, 'failure_rate': args.failure_rate,
+                        'elapsed': elapsed, 'tasks_per_second': num_tasks / elapsed if elapsed else None,
+                        'p50': percentile(latency, 50), 'p99': percentile(latency, 99),
+                        'failed': failed, 'calls': calls}
+                    # compare with the last result of the same benchmark
+                    last = [x for x in previous if all(x.get(k) == record[k] for k in
+                        ('config', 'tasks', 'phase', 'latency', 'failure_rate'))]
+                    change = ''
+                    if last and last[-1]['tasks_per_second'] and record['tasks_per_second']:
+                        change = f'{record["tasks_per_second"] / last[-1]["tasks_per_second"] - 1:+.0%}'
+                    print(f'{config_name:<8} {num_tasks:>6} {phase:<7} {record["tasks_per_second"] or 0:>9.1f} '
+                        f'{record["p50"] or 0:>9.4f} {record["p99"] or 0:>9.4f} {failed:>6} {change:>7}  '
+                        + ', '.join(f'{x}: {y}' for x, y in sorted(calls.items())))
+                    records.append(record)
+    finally:
+        if records:
+            with open(args.output, 'a') as res:
+                for record in records:
+                    res.write(json.dumps(record) + '\n')
+        if args.keep:
+            print(f'Task files and scheduler state are kept in {home_dir}')
+        else:
+            shutil.rmtree(home_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+'''Replay calls to PBS_TaskEngine recorded with option trace_file of a task
+queue, with commands answered from the trace so that no cluster is involved.
+
+By default the recorded latency of commands is not replayed, so the elapsed
+time is the Python overhead of the engine, which can be profiled with
+--profile. Use --latency to sleep for the recorded latency of each command.
+
+    python replay_trace.py ~/.sos/pbs_trace_12345.jsonl --profile replay.prof
+'''
+
+import argparse
+import cProfile
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('trace_file', help='Trace file recorded by PBS_TaskEngine')
+    parser.add_argument('--latency', action='store_true',
+        help='Sleep for the recorded latency of each command')
+    parser.add_argument('--profile', metavar='FILE',
+        help='Profile the replay and save the statistics to FILE')
+    parser.add_argument('--keep', action='store_true',
+        help='Keep the temporary home directory with task and job files')
+    args = parser.parse_args(argv)
+
+    trace_file = os.path.abspath(os.path.expanduser(args.trace_file))
+    # task files and job scripts are written under a temporary home directory
+    home_dir = tempfile.mkdtemp(prefix='sos_pbs_replay_')
+    os.environ['HOME'] = home_dir
+    task_dir = os.path.join(home_dir, '.sos', 'tasks')
+    os.makedirs(task_dir)
+
+    sys.path.insert(0, os.path.join(os.path.dirname(bench_dir), 'src'))
+    from sos.utils import env
+    from sos_pbs.tasks import PBS_TaskEngine
+    from sos_pbs.trace import ReplayAgent, read_trace, write_task_file
+
+    env.verbosity = 0
+    header, calls, tasks, interactions = read_trace(trace_file)
+    for task_id, task in tasks.items():
+        write_task_file(task_id, task)
+
+    agent = ReplayAgent(header, interactions, latency=args.latency)
+    agent.config = dict({x: y for x, y in header['config'].items() if x != 'trace_file'}, timing_file=None)
+    # the engine talks to the agent as it did to the recorded host
+    engine = PBS_TaskEngine(agent, local_host=header['local'], run_local=agent.check_call)
+    engine.mark_ready()
+
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        for call in calls:
+            getattr(engine, call['method'])(*call['args'], **call['kwargs'])
+    finally:
+        if profiler:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+        if not args.keep:
+            shutil.rmtree(home_dir, ignore_errors=True)
+
+    print(f'Replayed {len(calls)} calls of {len(tasks)} tasks on {header["alias"]} in {elapsed:.3f} seconds')
+    print(f'Recorded latency of replayed commands: {agent.replayed_latency:.3f} seconds')
+    engine_time = max(elapsed - agent.replayed_latency, 0) if args.latency else elapsed
+    print(f'Time spent in the engine: {engine_time:.3f} seconds')
+    if agent.missing:
+        print(f'{len(agent.missing)} interactions are not found in the trace, starting with:')
+        for method, key in agent.missing[:5]:
+            print(f'    {method}: {key}')
+    if args.keep:
+        print(f'Task and job files are kept in {home_dir}')
+    if profiler:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+
+if __name__ == '__main__':
+    main()
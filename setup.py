@@ -39,9 +39,11 @@ setup(name = "sos-pbs",
     package_dir = {'': 'src'},
     install_requires=[
           'sos>=0.17.0',
+          'fasteners',
       ],
     entry_points= '''
 [sos_taskengines]
 pbs = sos_pbs.tasks:PBS_TaskEngine
+multi_pbs = sos_pbs.clusters:MultiPBS_TaskEngine
 '''
 )
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import hashlib
+import os
+
+from sos.utils import env
+
+
+# job ids of array elements and index of the first element of job arrays of
+# schedulers, e.g. 1234[5].server (PBS Pro and Torque), 1234_5 (Slurm), 1234[5]
+# (LSF) and 1234.5 (SGE, whose qstat lists the index in column ja-task-ID, so
+# bulk_status_cmd should print job ids as job-ID.ja-task-ID). Elements are
+# listed by qstat -t of PBS and squeue -r of Slurm, without which qstat lists
+# only the array (1234[].server) and squeue lists pending elements as ranges
+# (1234_[5-10]). Elements that are not listed take the status of their arrays
+# or ranges in these cases
+ARRAY_JOB_IDS = {
+    'pbs': ('{array_base}[{index}]{array_suffix}', 0),
+    'slurm': ('{job_id}_{index}', 0),
+    'lsf': ('{job_id}[{index}]', 1),
+    'sge': ('{job_id}.{index}', 1),
+}
+
+
+def in_index_range(index, indexes):
+    '''Test if index is in indexes of array elements in the format of Slurm,
+    e.g. 5-10, 1,3,5-7, 0-15:4, with an optional %N limit of running elements'''
+    for part in indexes.partition('%')[0].split(','):
+        part, _, step = part.partition(':')
+        first, _, last = part.partition('-')
+        try:
+            first, last, step = int(first), int(last or first), int(step or 1)
+        except ValueError:
+            continue
+        if first <= index <= last and (index - first) % step == 0:
+            return True
+    return False
+
+
+class ArrayMixin(object):
+    '''Mixin of PBS_TaskEngine that submits tasks with the same runtime options
+    as job arrays'''
+
+    def _init_arrays(self):
+        # tasks with the same runtime options could be submitted as job arrays
+        # (PBS -J, Slurm --array, SGE -t) with array_submit_cmd and array_job_template
+        if 'array_submit_cmd' in self.config:
+            self.array_submit_cmd = self.config['array_submit_cmd']
+            if 'array_job_template' in self.config:
+                self.array_job_template = self.config['array_job_template'].replace('\r\n', '\n')
+            else:
+                raise ValueError(f'An array_job_template is required for array_submit_cmd of queue {self.alias}')
+            if 'array_submit_cmd_output' in self.config:
+                self.array_submit_cmd_output = self.config['array_submit_cmd_output']
+            else:
+                self.array_submit_cmd_output = self.submit_cmd_output
+            if not '{job_id}' in self.array_submit_cmd_output:
+                raise ValueError(
+                    f'Option array_submit_cmd_output should have at least a pattern for job_id, "{self.array_submit_cmd_output}" specified.')
+            # job id of array element {index} of array {job_id}, which should match job ids
+            # listed by bulk_status_cmd, with {array_base} and {array_suffix} being the parts
+            # of job_id before and after "[]" (e.g. 1234 and .server of 1234[].server).
+            # Defaults are provided for schedulers pbs, slurm, lsf and sge
+            if 'array_job_id' in self.config:
+                self.array_job_id = self.config['array_job_id']
+            elif self.scheduler in ARRAY_JOB_IDS:
+                self.array_job_id = ARRAY_JOB_IDS[self.scheduler][0]
+            else:
+                raise ValueError(f'Option array_job_id or scheduler is required for array_submit_cmd of queue {self.alias}')
+            # index of the first array element
+            if 'array_index_base' in self.config:
+                self.array_index_base = int(self.config['array_index_base'])
+            elif self.scheduler in ARRAY_JOB_IDS:
+                self.array_index_base = ARRAY_JOB_IDS[self.scheduler][1]
+            else:
+                self.array_index_base = 0
+        else:
+            self.array_submit_cmd = None
+
+    def _array_status(self, job_status, job_ids):
+        # add status of jobs (job_ids) of array elements that are not listed in job_status
+        # (job_id -> status) but whose arrays or ranges of elements are listed
+        if not self.array_submit_cmd:
+            return job_status
+        unlisted = set(job_ids) - set(job_status)
+        task_ids = [x for x, y in self._known_jobs.items() if y in unlisted]
+        if not task_ids:
+            return job_status
+        ranges = {}
+        for job_id, status in job_status.items():
+            array_job_id, sep, indexes = job_id.partition('_[')
+            if sep and indexes.endswith(']'):
+                ranges.setdefault(array_job_id, []).append((indexes[:-1], status))
+        for job_id in self._get_job_ids(task_ids).values():
+            if job_id['job_id'] in job_status or 'array_job_id' not in job_id:
+                continue
+            if job_id['array_job_id'] in job_status:
+                job_status[job_id['job_id']] = job_status[job_id['array_job_id']]
+                continue
+            for indexes, status in ranges.get(job_id['array_job_id'], []):
+                if in_index_range(int(job_id['array_index']), indexes):
+                    job_status[job_id['job_id']] = status
+                    break
+        return job_status
+
+    def _prepare_arrays(self, task_ids):
+        # group tasks with the same runtime options so that each group
+        # can be submitted as a single job array
+        arrays = {}
+        single_tasks = []
+        for task_id, runtime in zip(task_ids, self._get_runtimes(task_ids)):
+            if runtime['run_mode'] == 'dryrun':
+                single_tasks.append(task_id)
+                continue
+            key = tuple(repr(runtime.get(x, None)) for x in self.runtime_keys) + (runtime['depend'],)
+            if key in arrays:
+                arrays[key][1].append(task_id)
+            else:
+                arrays[key] = (runtime, [task_id])
+        for runtime, array_tasks in arrays.values():
+            if len(array_tasks) == 1:
+                single_tasks.extend(array_tasks)
+            elif not self._prepare_array(array_tasks, runtime):
+                return False
+        if len(single_tasks) == 1:
+            return self._prepare_script(single_tasks[0])
+        elif single_tasks:
+            return self._prepare_scripts(single_tasks)
+        return True
+
+    def _prepare_array(self, task_ids, runtime):
+        with self._timer.tasks(task_ids):
+            return self._submit_array(task_ids, runtime)
+
+    def _submit_array(self, task_ids, runtime):
+        # the array is named after the tasks it contains
+        array_id = 'array_' + hashlib.md5(' '.join(task_ids).encode()).hexdigest()[:16]
+        first = self.array_index_base
+        # task with index first + i is listed on line i + 1 of array_file
+        task_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', array_id + '.tasks')
+        with open(task_file, 'w', newline='') as tasks:
+            tasks.write('\n'.join(task_ids) + '\n')
+        runtime.update({
+            'task': array_id,
+            'job_name': array_id,
+            'job_file': f'~/.sos/tasks/{array_id}.sh',
+            'array_file': f'~/.sos/tasks/{array_id}.tasks',
+            'array_tasks': ' '.join(task_ids),
+            'array_size': len(task_ids),
+            'array_first': first,
+            'array_last': first + len(task_ids) - 1,
+        })
+        try:
+            with self._timer.phase('interpolate'):
+                job_text = self._templates['array_job_template'].render(runtime)
+        except Exception as e:
+            raise ValueError(f'Failed to generate array job file for tasks {", ".join(task_ids)}: {e}')
+
+        job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', array_id + '.sh')
+        with self._timer.phase('write_job_file'):
+            with open(job_file, 'w', newline='') as job:
+                job.write(job_text)
+
+        self._send_task_files([task_file, job_file])
+
+        try:
+            cmd = self._templates['array_submit_cmd'].render(runtime)
+        except Exception as e:
+            raise ValueError(f'Failed to generate array submission command from template "{self.array_submit_cmd}": {e}')
+        env.logger.debug(f'submit {len(task_ids)} tasks as {array_id}: {cmd}')
+        try:
+            # the array takes a slot of max_queued_jobs for each task
+            array_job = self._submit_job(cmd, array_id, 'array_submit_cmd_output', len(task_ids))
+        except Exception as e:
+            raise RuntimeError(f'Failed to submit tasks {", ".join(task_ids)} as job array: {e}')
+        job_id_files = []
+        for idx, task_id in enumerate(task_ids, start=first):
+            job_id = dict(array_job)
+            job_id['job_id'] = self._array_element_id(array_job, idx)
+            job_id['array_job_id'] = array_job['job_id']
+            job_id['array_index'] = idx
+            job_id_files.append(self._write_job_id(task_id, job_id))
+            env.logger.info(f'{task_id} ``submitted`` to {self.alias} with job id {job_id["job_id"]}')
+        self._send_task_files(job_id_files)
+        return True
+
+    def _array_element_id(self, array_job, index):
+        # job id of element index of a job array with variables extracted from
+        # the output of array_submit_cmd
+        base, _, suffix = array_job['job_id'].partition('[]')
+        try:
+            return self._templates['array_job_id'].render(dict({'array_base': base, 'array_suffix': suffix},
+                **array_job, index=index))
+        except Exception as e:
+            raise ValueError(f'Failed to generate job id of array element from template "{self.array_job_id}": {e}')
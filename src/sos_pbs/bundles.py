@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import hashlib
+import os
+
+from sos.utils import env, expand_size, expand_time, format_HHMMSS
+
+
+def pack_tasks(resources, max_cores, max_mem=None, max_walltime=None):
+    '''Pack tasks with resources (task_id -> (cores, mem, walltime in seconds)) into
+    bundles that can be executed in parallel on a node with max_cores and max_mem, using
+    a first-fit decreasing algorithm. Return bundles and tasks that cannot be bundled.'''
+    bundles = []
+    single_tasks = []
+    # tasks are sorted by walltime so that tasks with similar walltime are bundled together
+    for task_id, (cores, mem, walltime) in sorted(resources.items(), key=lambda x: (-x[1][2], -x[1][0], -x[1][1])):
+        if cores > max_cores or (max_mem and mem > max_mem) or (max_walltime and walltime > max_walltime):
+            single_tasks.append(task_id)
+            continue
+        for bundle in bundles:
+            if bundle[0] + cores <= max_cores and (not max_mem or bundle[1] + mem <= max_mem):
+                bundle[0] += cores
+                bundle[1] += mem
+                bundle[2].append(task_id)
+                break
+        else:
+            bundles.append([cores, mem, [task_id]])
+    return [x[2] for x in bundles], single_tasks
+
+
+class BundleMixin(object):
+    '''Mixin of PBS_TaskEngine that submits small tasks in bundles, which are jobs
+    that execute several tasks in parallel on a node'''
+
+    def _init_bundles(self):
+        # small tasks could be packed into bundles that run in parallel in a single
+        # job on a node with bundle_cores, bundle_mem and bundle_walltime
+        if 'bundle_job_template' in self.config:
+            if self.array_submit_cmd:
+                raise ValueError(f'Options array_submit_cmd and bundle_job_template cannot be used together for queue {self.alias}')
+            self.bundle_job_template = self.config['bundle_job_template'].replace('\r\n', '\n')
+            # command to execute each task in the bundle
+            if 'bundle_task_cmd' in self.config:
+                self.bundle_task_cmd = self.config['bundle_task_cmd']
+            else:
+                self.bundle_task_cmd = 'cd {cur_dir} && sos execute {task} -v {verbosity} -s {sig_mode}'
+            if 'bundle_cores' in self.config:
+                self.bundle_cores = int(self.config['bundle_cores'])
+            elif 'max_cores' in self.config:
+                self.bundle_cores = int(self.config['max_cores'])
+            else:
+                raise ValueError(f'Option bundle_cores or max_cores is required for bundle_job_template of queue {self.alias}')
+            if 'bundle_mem' in self.config:
+                self.bundle_mem = expand_size(self.config['bundle_mem'])
+            elif 'max_mem' in self.config:
+                self.bundle_mem = expand_size(self.config['max_mem'])
+            else:
+                self.bundle_mem = None
+            if 'bundle_walltime' in self.config:
+                self.bundle_walltime = expand_time(self.config['bundle_walltime'])
+            elif 'max_walltime' in self.config:
+                self.bundle_walltime = expand_time(self.config['max_walltime'])
+            else:
+                self.bundle_walltime = None
+        else:
+            self.bundle_job_template = None
+
+    def _prepare_bundles(self, task_ids):
+        # pack tasks into bundles that can be executed in parallel on a node
+        runtimes = {}
+        resources = {}
+        single_tasks = []
+        for task_id, runtime in zip(task_ids, self._get_runtimes(task_ids)):
+            if runtime['run_mode'] == 'dryrun' or int(runtime['nodes']) > 1:
+                single_tasks.append(task_id)
+                continue
+            runtimes[task_id] = runtime
+            resources[task_id] = (int(runtime['cores']), expand_size(runtime.get('mem', None) or 0),
+                expand_time(runtime['walltime']) if runtime.get('walltime', None) else 0)
+        bundles, unpacked = pack_tasks(resources, self.bundle_cores, self.bundle_mem, self.bundle_walltime)
+        single_tasks.extend(unpacked)
+        single_tasks.extend(x[0] for x in bundles if len(x) == 1)
+        bundles = [x for x in bundles if len(x) > 1]
+
+        # write and send scripts of all bundles
+        bundle_runtimes = []
+        job_files = []
+        for bundle in bundles:
+            with self._timer.tasks(bundle):
+                runtime, job_file = self._write_bundle_script(bundle, [runtimes[x] for x in bundle])
+            bundle_runtimes.append(runtime)
+            job_files.append(job_file)
+        self._send_task_files(job_files)
+
+        job_id_files = []
+        try:
+            for bundle, runtime in zip(bundles, bundle_runtimes):
+                with self._timer.tasks(bundle):
+                    job_id_files.extend(self._submit_bundle_script(bundle, runtime))
+        finally:
+            self._send_task_files(job_id_files)
+
+        if len(single_tasks) == 1:
+            return self._prepare_script(single_tasks[0])
+        elif single_tasks:
+            return self._prepare_scripts(single_tasks)
+        return True
+
+    def _write_bundle_script(self, task_ids, runtimes):
+        bundle_id = 'bundle_' + hashlib.md5(' '.join(task_ids).encode()).hexdigest()[:16]
+        try:
+            with self._timer.phase('interpolate'):
+                commands = self._templates['bundle_task_cmd'].render_many(runtimes)
+        except Exception as e:
+            raise ValueError(f'Failed to generate command to execute bundled task: {e}')
+        # the bundle uses resources of all tasks, which are executed in parallel
+        runtime = dict(runtimes[0])
+        walltimes = [expand_time(x['walltime']) for x in runtimes if x.get('walltime', None)]
+        mems = [expand_size(x['mem']) for x in runtimes if x.get('mem', None)]
+        runtime.update({
+            'task': bundle_id,
+            'job_name': bundle_id,
+            'job_file': f'~/.sos/tasks/{bundle_id}.sh',
+            'nodes': 1,
+            'cores': sum(int(x['cores']) for x in runtimes),
+            'depend': self._depend_option(task_ids),
+            'bundle_tasks': ' '.join(task_ids),
+            'bundle_size': len(task_ids),
+            'commands': '\n'.join(f'({x}) &' for x in commands) + '\nwait',
+        })
+        if walltimes:
+            runtime['walltime'] = format_HHMMSS(max(walltimes))
+        if mems:
+            runtime['mem'] = sum(mems)
+        try:
+            with self._timer.phase('interpolate'):
+                job_text = self._templates['bundle_job_template'].render(runtime)
+        except Exception as e:
+            raise ValueError(f'Failed to generate job file for bundle of tasks {", ".join(task_ids)}: {e}')
+
+        job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', bundle_id + '.sh')
+        with self._timer.phase('write_job_file'):
+            with open(job_file, 'w', newline='') as job:
+                job.write(job_text)
+        return runtime, job_file
+
+    def _submit_bundle_script(self, task_ids, runtime):
+        # submit the bundle with submit_cmd and return the job_id files of its tasks
+        try:
+            cmd = self._templates['submit_cmd'].render(runtime)
+        except Exception as e:
+            raise ValueError(f'Failed to generate job submission command from template "{self.submit_cmd}": {e}')
+        env.logger.debug(f'submit {len(task_ids)} tasks as {runtime["task"]}: {cmd}')
+        try:
+            bundle_job = self._submit_job(cmd, runtime['job_name'])
+        except Exception as e:
+            raise RuntimeError(f'Failed to submit bundle of tasks {", ".join(task_ids)}: {e}')
+        job_id_files = []
+        for task_id in task_ids:
+            job_id = dict(bundle_job, bundle=runtime['task'], bundle_size=len(task_ids))
+            job_id_files.append(self._write_job_id(task_id, job_id))
+            env.logger.info(f'{task_id} ``submitted`` to {self.alias} with job id {job_id["job_id"]}')
+        return job_id_files
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+import os
+import threading
+import time
+
+import fasteners
+from sos.utils import env
+
+# thread locks of cache files
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+class StatusCache:
+    '''Status of jobs shared by processes that query the same queue, such as a
+    workflow, Jupyter and "sos status" commands, saved to a JSON file as
+    section -> {job_id: [time, status]}.
+
+    Status that is older than ttl seconds is refreshed by one process at a time
+    under a file lock, so that processes waiting for the lock use the status
+    refreshed by the process that holds the lock. Status that is older than ttl
+    but younger than ttl + stale seconds is returned immediately, and refreshed
+    in the background (stale-while-revalidate).'''
+
+    def __init__(self, filename, ttl, stale=0, lock_timeout=60):
+        self.filename = filename
+        self.ttl = ttl
+        self.stale = stale
+        self.lock_timeout = lock_timeout
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # file locks are held by processes, so threads of a process are serialized
+        # with a thread lock of the file
+        self._lock = fasteners.InterProcessLock(filename + '.lock')
+        with _thread_locks_lock:
+            self._thread_lock = _thread_locks.setdefault(filename, threading.Lock())
+        self._revalidating = set()
+        self._revalidate_lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.filename) as cache:
+                return json.load(cache)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            env.logger.debug(f'Ignoring invalid status cache {self.filename}: {e}')
+            return {}
+
+    def _write(self, section, values, query_time):
+        content = self._read()
+        entries = content.setdefault(section, {})
+        entries.update({x: [query_time, y] for x, y in values.items()})
+        # status of jobs that are no longer queried are removed
+        expire = query_time - max(3600, self.ttl + self.stale)
+        content[section] = {x: y for x, y in entries.items() if y[0] > expire}
+        tmp_file = f'{self.filename}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as cache:
+            json.dump(content, cache)
+        os.replace(tmp_file, self.filename)
+
+    def _cached(self, section, keys):
+        # return time of the oldest entry and status of keys, or None if any key
+        # is not in the cache
+        entries = self._read().get(section, {})
+        if not all(x in entries for x in keys):
+            return None
+        return min((entries[x][0] for x in keys), default=time.time()), \
+            {x: entries[x][1] for x in keys if entries[x][1] is not None}
+
+    def lookup(self, section, keys, query):
+        '''Return the time of status and key -> status for keys, from the cache
+        or by calling query(keys), which should return key -> status for keys
+        with known status'''
+        cached = self._cached(section, keys)
+        if cached is not None:
+            age = time.time() - cached[0]
+            if age < self.ttl:
+                return cached
+            if age < self.ttl + self.stale:
+                self._revalidate(section, keys, query)
+                return cached
+        return self._refresh(section, keys, query)
+
+    def _acquire(self, blocking):
+        if not self._thread_lock.acquire(blocking, self.lock_timeout if blocking else -1):
+            return False
+        if self._lock.acquire(blocking=blocking, timeout=self.lock_timeout if blocking else None):
+            return True
+        self._thread_lock.release()
+        return False
+
+    def _release(self):
+        self._lock.release()
+        self._thread_lock.release()
+
+    def _refresh(self, section, keys, query, blocking=True):
+        locked = self._acquire(blocking)
+        if not locked and not blocking:
+            # another process is refreshing the cache
+            return None
+        try:
+            if locked:
+                # the cache might have been refreshed while we wait for the lock
+                cached = self._cached(section, keys)
+                if cached is not None and time.time() - cached[0] < self.ttl:
+                    return cached
+            else:
+                env.logger.debug(f'Failed to lock status cache {self.filename} in {self.lock_timeout} seconds')
+            query_time = time.time()
+            values = query(keys)
+            if locked:
+                try:
+                    self._write(section, {x: values.get(x, None) for x in keys}, query_time)
+                except Exception as e:
+                    env.logger.debug(f'Failed to write status cache {self.filename}: {e}')
+            return query_time, {x: y for x, y in values.items() if y is not None}
+        finally:
+            if locked:
+                self._release()
+
+    def _revalidate(self, section, keys, query):
+        # refresh the cache in a thread that keeps the process alive until
+        # the cache is refreshed, unless another process is refreshing it
+        with self._revalidate_lock:
+            if section in self._revalidating:
+                return
+            self._revalidating.add(section)
+
+        def refresh():
+            try:
+                self._refresh(section, keys, query, blocking=False)
+            except Exception as e:
+                env.logger.debug(f'Failed to refresh status cache {self.filename}: {e}')
+            finally:
+                with self._revalidate_lock:
+                    self._revalidating.discard(section)
+
+        threading.Thread(target=refresh).start()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import time
+
+from sos.hosts import LocalHost
+from sos.task_engines import TaskEngine
+from sos.utils import env
+
+from .jobs import JobIdStore
+from .tasks import PBS_TaskEngine
+
+
+class ClusterAgent(object):
+    '''Agent of a cluster of a queue, which runs commands with the agent of
+    the queue but has its own configuration'''
+
+    def __init__(self, agent, config):
+        self._agent = agent
+        self.config = config
+        self.alias = config['alias']
+
+    def __getattr__(self, name):
+        return getattr(self._agent, name)
+
+
+class MultiPBS_TaskEngine(TaskEngine):
+    '''Task engine that submits tasks to several clusters, each defined under
+    option clusters with its own job_template, submit_cmd, status_cmd etc.
+    Options of the queue are shared by all clusters, for example
+
+        clusters:
+          short:
+            submit_cmd: qsub -q short@server1 {job_file}
+            queued_count_cmd: qstat -q short@server1 | tail -1
+          other:
+            submit_cmd: ssh cluster2 qsub {job_file}
+            status_cmd: ssh cluster2 qstat {job_id}
+
+    Each task is sent to the cluster with the lowest expected start time, which
+    is the number of jobs ahead of it times the recently observed wait per job
+    of the cluster. The cluster is saved with the job id so that status and kill
+    commands are sent to the cluster that runs the task. Commands are executed
+    on the host of the queue, so clusters have to be reachable from the host
+    and share its ~/.sos/tasks directory. Tasks with upstream tasks are sent to
+    the cluster of their upstream tasks.'''
+
+    # weight of the latest observation in the wait per job of a cluster
+    wait_weight = 0.3
+    # minimal wait per job, so that a cluster that has been starting jobs
+    # immediately does not receive all tasks before its wait is observed again
+    min_wait = 1.0
+
+    def __init__(self, agent):
+        super(MultiPBS_TaskEngine, self).__init__(agent)
+        if 'clusters' not in self.config or not self.config['clusters']:
+            raise ValueError(f'Option clusters is required for queue {self.alias}')
+        if not isinstance(self.config['clusters'], dict) or \
+            not all(isinstance(x, dict) for x in self.config['clusters'].values()):
+            raise ValueError(f'Option clusters of queue {self.alias} should be a dictionary of cluster definitions')
+
+        # status of jobs that have started running, in addition to finished_status
+        if 'running_status' in self.config:
+            self.running_status = self.config['running_status']
+            if isinstance(self.running_status, str):
+                self.running_status = [self.running_status]
+        else:
+            self.running_status = ['R', 'r', 'RUN', 'RUNNING', 'E', 'EXITING', 'COMPLETING']
+
+        self._job_ids = JobIdStore()
+        self._clusters = {}
+        for name, definition in self.config['clusters'].items():
+            config = {x: y for x, y in self.config.items() if x != 'clusters'}
+            config.update(definition)
+            config.update({'alias': f'{self.alias}.{name}', 'cluster': name})
+            # clusters share the job id store so that a task can be found on any cluster
+            engine = PBS_TaskEngine(ClusterAgent(self.agent, config), job_ids=self._job_ids,
+                local_host=isinstance(self.agent, LocalHost))
+            if not (engine.queued_count_cmd or engine.bulk_status_cmd or engine.events_cmd):
+                raise ValueError(f'Cluster {name} of queue {self.alias} requires queued_count_cmd, bulk_status_cmd or events_cmd to count queued jobs')
+            engine.mark_ready()
+            self._clusters[name] = engine
+
+        if 'batch_size' in self.config:
+            self.batch_size = self.config['batch_size']
+        else:
+            self.batch_size = max(x.batch_size for x in self._clusters.values())
+
+        # cluster of tasks submitted by the engine
+        self._task_clusters = {}
+        # upstream tasks and priority of tasks that are not yet submitted
+        self._depends = {}
+        self._priorities = {}
+        # jobs that are submitted, but not yet seen running, with their time of
+        # submission and number of jobs ahead of them, for each cluster
+        self._waiting = {x: {} for x in self._clusters}
+        # observed wait per job of each cluster
+        self._wait = {x: None for x in self._clusters}
+        # number of jobs submitted to each cluster after its last count of queued jobs
+        self._submitted = {x: 0 for x in self._clusters}
+        self._count_time = {x: None for x in self._clusters}
+
+    def _queue_depth(self, name):
+        # return the number of jobs ahead of a new job on a cluster, and whether
+        # the jobs on the cluster could be counted
+        engine = self._clusters[name]
+        depth, count_time = engine.count_queued_jobs()
+        if count_time is None:
+            return depth + self._submitted[name], False
+        if count_time != self._count_time[name]:
+            # jobs submitted before the count are included in the count
+            self._count_time[name] = count_time
+            self._submitted[name] = 0
+        if engine.max_queued_jobs:
+            # submitted jobs are already added to the count by the cluster
+            return depth, True
+        return depth + self._submitted[name], True
+
+    def _observe_waits(self, name):
+        # jobs are seen running from the status of jobs queried by the cluster
+        engine = self._clusters[name]
+        now = time.time()
+        job_status = engine.last_job_status(list(self._waiting[name]))
+        for job_id, (submit_time, ahead) in list(self._waiting[name].items()):
+            if job_id not in job_status:
+                continue
+            # a job with status None has finished
+            status = job_status[job_id]
+            if status is not None and status not in self.running_status and status not in engine.finished_status:
+                continue
+            self._waiting[name].pop(job_id)
+            wait = max(now - submit_time, 0) / (ahead + 1)
+            if self._wait[name] is None:
+                self._wait[name] = wait
+            else:
+                self._wait[name] = (1 - self.wait_weight) * self._wait[name] + self.wait_weight * wait
+            env.logger.debug(f'Job {job_id} started on cluster {name} of {self.alias} after {now - submit_time:.0f} seconds')
+
+    def _wait_per_job(self):
+        # clusters without observed wait are assumed to be as fast as the others
+        observed = [x for x in self._wait.values() if x is not None]
+        default = sum(observed) / len(observed) if observed else self.min_wait
+        return {x: max(default if y is None else y, self.min_wait) for x, y in self._wait.items()}
+
+    def _assign_clusters(self, task_ids):
+        # return cluster -> [(task_id, number of jobs ahead of the task)], with each task
+        # assigned to the cluster with the lowest expected start time
+        depth = {}
+        unreachable = set()
+        for name in self._clusters:
+            self._observe_waits(name)
+            depth[name], counted = self._queue_depth(name)
+            if not counted:
+                unreachable.add(name)
+        # clusters that cannot be reached are only used if no other cluster can be
+        if unreachable:
+            env.logger.warning(f'Jobs on clusters {", ".join(sorted(unreachable))} of {self.alias} cannot be counted')
+        wait = self._wait_per_job()
+        env.logger.debug(f'Queued jobs and wait per job of clusters of {self.alias}: ' +
+            ', '.join(f'{x}: {depth[x]} x {wait[x]:.1f}s' for x in self._clusters))
+        # jobs can only wait for jobs on the same cluster
+        batch = set(task_ids)
+        upstream = sorted(set(x for task_id in task_ids for x in self._depends.get(task_id, ()) if x not in batch))
+        clusters = {x: name for name, group in self._group_tasks(upstream).items() for x in group} if upstream else {}
+        # and tasks of an interrupted submission are sent to the same clusters
+        resumed = {x: y['queue'][len(self.alias) + 1:] for x, y in self._job_ids.get_journal(task_ids).items()
+            if y['queue'].startswith(self.alias + '.') and y['state'] != 'failed'}
+        res = {}
+        for task_id in task_ids:
+            pinned = [clusters[x] for x in self._depends.get(task_id, ()) if x in clusters]
+            if resumed.get(task_id, None) in self._clusters:
+                name = resumed[task_id]
+            elif pinned:
+                name = pinned[0]
+            else:
+                name = min(self._clusters, key=lambda x: (x in unreachable, (depth[x] + 1) * wait[x]))
+            res.setdefault(name, []).append((task_id, depth[name]))
+            clusters[task_id] = name
+            depth[name] += 1
+        return res
+
+    def _group_tasks(self, task_ids):
+        # return cluster -> task_ids for tasks submitted to each cluster, with tasks
+        # that are not yet submitted assigned to the first cluster
+        unknown = [x for x in task_ids if x not in self._task_clusters]
+        job_ids = self._job_ids.get_many(unknown) if unknown else {}
+        default = next(iter(self._clusters))
+        res = {}
+        for task_id in task_ids:
+            if task_id in self._task_clusters:
+                name = self._task_clusters[task_id]
+            else:
+                name = job_ids.get(task_id, {}).get('cluster', default)
+                if name not in self._clusters:
+                    env.logger.warning(f'Task {task_id} was submitted to unknown cluster {name} of {self.alias}')
+                    name = default
+            res.setdefault(name, []).append(task_id)
+        return res
+
+    def add_dependencies(self, depends):
+        '''Hold jobs of tasks until the jobs of their upstream tasks complete
+        successfully, see PBS_TaskEngine.add_dependencies'''
+        self._depends.update({x: [y] if isinstance(y, str) else list(y) for x, y in depends.items() if y})
+
+    def set_priorities(self, priorities):
+        '''Set priority of tasks, see PBS_TaskEngine.set_priorities'''
+        self._priorities.update(priorities)
+
+    def execute_tasks(self, task_ids, depends=None, priorities=None):
+        if depends:
+            self.add_dependencies(depends)
+        if priorities:
+            self.set_priorities(priorities)
+        if not super(MultiPBS_TaskEngine, self).execute_tasks(task_ids):
+            return False
+        success = True
+        assigned = self._assign_clusters(task_ids)
+        depends = {x: self._depends.pop(x) for x in task_ids if x in self._depends}
+        priorities = {x: self._priorities.pop(x) for x in task_ids if x in self._priorities}
+        for name, tasks in assigned.items():
+            engine = self._clusters[name]
+            engine.add_dependencies({x[0]: depends[x[0]] for x in tasks if x[0] in depends})
+            engine.set_priorities({x[0]: priorities[x[0]] for x in tasks if x[0] in priorities})
+            env.logger.debug(f'Submitting {len(tasks)} tasks to cluster {name} of {self.alias}')
+            submit_time = time.time()
+            if not engine.submit_tasks([x[0] for x in tasks]):
+                success = False
+            job_ids = self._job_ids.get_many([x[0] for x in tasks])
+            for task_id, ahead in tasks:
+                self._task_clusters[task_id] = name
+                if task_id in job_ids:
+                    self._waiting[name][job_ids[task_id]['job_id']] = (submit_time, ahead)
+            self._submitted[name] += len(tasks)
+        return success
+
+    def query_tasks(self, tasks=None, verbosity=1, html=False, **kwargs):
+        if verbosity == 0:
+            return super(MultiPBS_TaskEngine, self).query_tasks(tasks=tasks, verbosity=verbosity, html=html, **kwargs)
+        if tasks is None:
+            output = super(MultiPBS_TaskEngine, self).query_tasks(tasks=None, verbosity=1, **kwargs)
+            tasks = [line.split('\t')[0] for line in output.split('\n') if line.strip()]
+            if not tasks:
+                return output
+        # status of tasks are checked against the status of jobs on their clusters
+        return ''.join(self._clusters[name].query_tasks(tasks=group, verbosity=verbosity, html=html, **kwargs)
+            for name, group in self._group_tasks(tasks).items())
+
+    def kill_tasks(self, tasks, **kwargs):
+        output = super(MultiPBS_TaskEngine, self).kill_tasks(tasks, **kwargs)
+        env.logger.trace(f'Output of local kill: {output}')
+        lines = {line.split('\t')[0]: line for line in output.split('\n') if line.strip()}
+        # jobs are killed on the clusters of tasks
+        for name, group in self._group_tasks(list(lines.keys())).items():
+            killed = self._clusters[name].kill_jobs('\n'.join(lines[x] for x in group))
+            lines.update({line.split('\t')[0]: line for line in killed.split('\n') if line.strip()})
+        return ''.join(x + '\n' for x in lines.values())
+
+    def tail_tasks(self, task_ids, streams=('stdout', 'stderr')):
+        '''Return new output of jobs of tasks, see PBS_TaskEngine.tail_tasks'''
+        res = {}
+        for name, group in self._group_tasks(task_ids).items():
+            res.update(self._clusters[name].tail_tasks(group, streams))
+        return res
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+from sos.utils import env
+
+
+# options of submit commands of schedulers that hold a job until jobs {job_ids}
+# complete successfully, and the separator of job ids. PBS deletes jobs whose
+# dependencies can no longer be satisfied, which Slurm does with --kill-on-invalid-dep
+DEPENDENCY_OPTIONS = {
+    'pbs': ('-W depend=afterok:{job_ids}', ':'),
+    'slurm': ('--kill-on-invalid-dep=yes --dependency=afterok:{job_ids}', ':'),
+    'sge': ('-hold_jid {job_ids}', ','),
+}
+
+
+class DependencyMixin(object):
+    '''Mixin of PBS_TaskEngine that holds jobs of tasks in the queue until the jobs
+    of their upstream tasks complete'''
+
+    def _init_dependencies(self):
+        # option of submit_cmd that holds a job until the jobs of its upstream tasks
+        # complete successfully, which is passed to templates as {depend}, with
+        # {job_ids} separated by dependency_separator. Defaults are provided for
+        # schedulers pbs, slurm and sge
+        if 'dependency_option' in self.config:
+            self.dependency_option = self.config['dependency_option']
+            if '{job_ids}' not in self.dependency_option:
+                raise ValueError(
+                    f'Option dependency_option should have a pattern for job_ids, "{self.dependency_option}" specified.')
+        elif self.scheduler in DEPENDENCY_OPTIONS:
+            self.dependency_option = DEPENDENCY_OPTIONS[self.scheduler][0]
+        else:
+            self.dependency_option = None
+
+        if 'dependency_separator' in self.config:
+            self.dependency_separator = self.config['dependency_separator']
+        elif self.scheduler in DEPENDENCY_OPTIONS:
+            self.dependency_separator = DEPENDENCY_OPTIONS[self.scheduler][1]
+        else:
+            self.dependency_separator = ':'
+
+        # upstream tasks of tasks that are not yet submitted
+        self._depends = {}
+        # downstream tasks of submitted tasks, which are killed if the upstream
+        # tasks fail because their jobs would otherwise be held forever
+        self._downstream = {}
+
+    def add_dependencies(self, depends):
+        '''Hold jobs of tasks in the queue until the jobs of their upstream tasks
+        complete successfully, with depends being a dictionary of task_id -> ids
+        of upstream tasks, which should be submitted before or with the tasks'''
+        for task_id, upstream in depends.items():
+            if isinstance(upstream, str):
+                upstream = [upstream]
+            if upstream:
+                self._depends[task_id] = list(upstream)
+
+    def _dependency_groups(self, task_ids):
+        # split tasks into groups that are submitted in turn, so that the job ids
+        # of upstream tasks are known when their downstream tasks are submitted
+        if not any(x in self._depends for x in task_ids):
+            return [task_ids]
+        remaining = list(task_ids)
+        res = []
+        while remaining:
+            pending = set(remaining)
+            group = [x for x in remaining if not any(y in pending for y in self._depends.get(x, ()))]
+            if not group:
+                raise ValueError(f'Circular dependencies between tasks {", ".join(remaining)}')
+            res.append(group)
+            submitted = set(group)
+            remaining = [x for x in remaining if x not in submitted]
+        return res
+
+    def _upstream_jobs(self, task_ids):
+        # return ids of jobs of the upstream tasks of tasks
+        upstream = sorted(set(x for task_id in task_ids for x in self._depends.get(task_id, ())))
+        if not upstream:
+            return []
+        job_ids = self._get_job_ids(upstream)
+        missing = [x for x in upstream if x not in job_ids]
+        if missing:
+            raise RuntimeError(f'Failed to obtain job ids of upstream tasks {", ".join(missing)} on {self.alias}')
+        other = [x for x, y in job_ids.items() if y.get('cluster', None) != self.cluster]
+        if other:
+            raise RuntimeError(f'Upstream tasks {", ".join(other)} are not submitted to {self.alias}')
+        jobs = sorted(set(x['job_id'] for x in job_ids.values()))
+        if self.bulk_status_cmd:
+            # schedulers do not accept dependencies on jobs that they no longer
+            # know, so jobs that have left the queue are not depended on if their
+            # tasks have completed
+            try:
+                job_status = self._get_job_status(upstream)
+            except Exception as e:
+                env.logger.debug(f'Failed to query status of upstream jobs on {self.alias}: {e}')
+                return jobs
+            gone = [x for x, y in job_ids.items() if y['job_id'] not in job_status]
+            if gone:
+                status = self._sos_status(gone)
+                failed = [f'{x} ({status.get(x, "unknown")})' for x in gone if status.get(x, None) != 'completed']
+                if failed:
+                    raise RuntimeError(f'Upstream tasks {", ".join(failed)} have not completed and their jobs '
+                        f'are no longer in the queue of {self.alias}')
+                jobs = [x for x in jobs if x in job_status]
+        return jobs
+
+    def _depend_option(self, task_ids):
+        # option of submit_cmd that holds the job of tasks until their upstream jobs complete
+        jobs = self._upstream_jobs(task_ids)
+        if not jobs:
+            return ''
+        if not self.dependency_option:
+            raise ValueError(f'Option dependency_option or scheduler is required for dependencies of tasks on {self.alias}')
+        for task_id in task_ids:
+            for upstream in self._depends.get(task_id, ()):
+                self._downstream.setdefault(upstream, set()).add(task_id)
+        return self._templates['dependency_option'].render({'job_ids': self.dependency_separator.join(jobs)})
+
+    def _failed_dependents(self, status):
+        # return downstream tasks of tasks that have failed according to status (task_id
+        # -> status), and the downstream tasks of these tasks, whose jobs can no longer run
+        for task_id in [x for x, y in status.items() if y == 'completed']:
+            self._downstream.pop(task_id, None)
+        failed = [x for x, y in status.items() if y in ('failed', 'aborted', 'killed') and x in self._downstream]
+        res = []
+        while failed:
+            for task_id in sorted(self._downstream.pop(failed.pop(), ())):
+                if task_id not in res:
+                    res.append(task_id)
+                    if task_id in self._downstream:
+                        failed.append(task_id)
+        return res
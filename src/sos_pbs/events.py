@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import datetime
+import time
+
+from sos.utils import env
+
+
+class EventMixin(object):
+    '''Mixin of PBS_TaskEngine that queries status changes of jobs since the last
+    query with events_cmd'''
+
+    def _init_events(self):
+        # optional command that lists status changes of jobs since a time, such as
+        # "sacct -X -n -o JobID,State -S {since_time}", so that the cost of a status
+        # check does not grow with the number of jobs. The time of the last query is
+        # saved so that another process continues from where the last one left off.
+        # Times are given by the clock and in the timezone of the host of the queue
+        if 'events_cmd' in self.config:
+            self.events_cmd = self.config['events_cmd']
+        else:
+            self.events_cmd = None
+
+        if 'events_cmd_output' in self.config:
+            self.events_cmd_output = self.config['events_cmd_output']
+        else:
+            self.events_cmd_output = '{job_id,[^ ]+} {status}'
+        if '{job_id' not in self.events_cmd_output or '{status' not in self.events_cmd_output:
+            raise ValueError(
+                f'Option events_cmd_output should have patterns for job_id and status, "{self.events_cmd_output}" specified.')
+
+        self._events_cursor = None
+        # time of the last check of the clock of the host, and the difference between
+        # the clock of the host and the local clock, and the timezone of the host
+        self._host_clock = None
+
+    def _get_job_events(self, task_ids):
+        # update status of jobs with status changes reported by events_cmd since
+        # the last query, cached for status_cache_ttl seconds
+        unseen = sorted(set(self._known_jobs[x] for x in task_ids
+            if x in self._known_jobs and self._known_jobs[x] not in self._queried_jobs))
+        if unseen:
+            # status saved by previous queries, possibly by another process
+            self._job_status.update(self._job_ids.get_status_many(unseen))
+            self._queried_jobs.update(unseen)
+        if self._job_status_time is not None and time.time() - self._job_status_time < self.status_cache_ttl:
+            return self._job_status
+        # the cursor is kept in the time of the host
+        offset, timezone = self._get_host_clock()
+        if self._events_cursor is None:
+            self._events_cursor = self._job_ids.get_cursor(self.alias)
+        if self._events_cursor is None:
+            # jobs are submitted by an earlier version or by another queue configuration
+            self._events_cursor = time.time() + offset - 86400
+        query_time = time.time() + offset
+        cmd = self._templates['events_cmd'].render({'since': int(self._events_cursor),
+            'since_time': datetime.datetime.fromtimestamp(int(self._events_cursor), timezone).strftime('%Y-%m-%dT%H:%M:%S')})
+        env.logger.debug(f'Query status changes of jobs: {cmd}')
+        self._timer.count('events_cmd')
+        output = self.agent.check_output(cmd)
+        lines = [' '.join(line.split()) for line in output.splitlines() if line.strip()]
+        res = self._parsers['events_cmd_output'].extract(lines)
+        # later events of the same job override earlier ones
+        events = {job_id: status for job_id, status in zip(res['job_id'], res['status'])
+            if job_id is not None}
+        if events:
+            self._job_status.update(events)
+            self._job_ids.set_status_many(events)
+        self._events_cursor = query_time
+        self._job_ids.set_cursor(self.alias, query_time)
+        self._job_status_time = time.time()
+        return self._job_status
+
+    def _get_host_clock(self):
+        # return the difference between the clock of the host of the queue and the local
+        # clock, and the timezone of the host, which are checked again every hour in case
+        # the timezone changes for daylight saving time. The time of the host is rounded
+        # down so that no event is missed because of the difference
+        if self._host_clock is None or time.time() - self._host_clock[0] > 3600:
+            start_time = time.time()
+            output = self.agent.check_output('date +%s_%z').strip()
+            end_time = time.time()
+            try:
+                host_time, utc_offset = output.split('_')
+                minutes = int(utc_offset[1:3]) * 60 + int(utc_offset[3:5])
+                timezone = datetime.timezone(datetime.timedelta(minutes=-minutes if utc_offset[0] == '-' else minutes))
+                offset = int(host_time) - (start_time + end_time) / 2
+            except (ValueError, IndexError):
+                raise RuntimeError(f'Unrecognized time "{output}" of the host of {self.alias}')
+            self._host_clock = (end_time, offset, timezone)
+        return self._host_clock[1:]
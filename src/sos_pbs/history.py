@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+from sos.utils import env
+from sos.tasks import TaskFile
+
+
+class HistoryMixin(object):
+    '''Mixin of PBS_TaskEngine that saves runtime and peak memory of completed tasks
+    of each step of workflows'''
+
+    def _init_history(self):
+        # completed tasks that are saved to the history of resource usage, and
+        # the steps and start time of those without known peak memory
+        self._history_tasks = set()
+        self._pending_history = {}
+
+    def _save_history(self, lines):
+        # save runtime of completed tasks from status lines with numeric duration
+        # before status, with the steps of tasks saved with their job ids
+        completed = {}
+        for fields in lines:
+            if len(fields) < 4 or fields[-1].strip() != 'completed' or fields[0] in self._history_tasks:
+                continue
+            try:
+                runtime = float(fields[-2])
+                start_time = float(fields[3]) if len(fields) == 6 else 0
+            except ValueError:
+                continue
+            if runtime > 0:
+                completed[fields[0]] = (runtime, start_time)
+        if completed:
+            # tasks saved by this or another engine keep their records and time
+            self._history_tasks.update(self._job_ids.get_history_tasks(self.alias, list(completed)))
+            completed = {x: y for x, y in completed.items() if x not in self._history_tasks}
+        if not completed:
+            return
+        job_ids = self._get_job_ids(list(completed))
+        records = {}
+        for task_id, (runtime, start_time) in completed.items():
+            step = job_ids.get(task_id, {}).get('step', None)
+            if not step:
+                continue
+            peak_mem = self._peak_mem(task_id, start_time)
+            if peak_mem is None:
+                # results of tasks on remote hosts are retrieved later
+                self._pending_history[task_id] = (step, runtime, start_time)
+            records[task_id] = (step, runtime, peak_mem)
+        self._history_tasks.update(completed)
+        if records:
+            self._job_ids.add_history_many(self.alias, records)
+
+    def _peak_mem(self, task_id, start_time=0):
+        # peak memory in the local result of a task that started at start_time
+        try:
+            task_file = TaskFile(task_id)
+            if not task_file.has_result():
+                return None
+            result = task_file.result
+            if result.get('end_time', 0) < start_time:
+                return None
+            return result.get('peak_mem', None) or None
+        except Exception as e:
+            env.logger.debug(f'Failed to read peak memory of task {task_id}: {e}')
+            return None
+
+    def _update_history(self):
+        # save peak memory of completed tasks with results that have been retrieved
+        records = {}
+        for task_id, (step, runtime, start_time) in list(self._pending_history.items()):
+            peak_mem = self._peak_mem(task_id, start_time)
+            if peak_mem is not None:
+                records[task_id] = (step, runtime, peak_mem)
+                self._pending_history.pop(task_id)
+        if records:
+            self._job_ids.add_history_many(self.alias, records)
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from sos.utils import env
+
+
+def job_id_file(task_id):
+    return os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.job_id')
+
+
+def read_job_id_file(filename):
+    '''Read a .job_id file with lines of "key: value"'''
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as job:
+        result = {}
+        for line in job:
+            if not line.strip():
+                continue
+            k, v = line.split(':', 1)
+            result[k.strip()] = v.strip()
+        return result
+
+
+def write_job_id_file(filename, job_id):
+    with open(filename, 'w') as job:
+        for k, v in job_id.items():
+            job.write(f'{k}: {v}\n')
+
+
+class JobIdStore:
+    '''Indexed store of job ids of tasks, with task_id -> job_id lookup,
+    reverse lookup of task from job_id, and import/export of .job_id files'''
+
+    _db_structure = '''CREATE TABLE IF NOT EXISTS jobs (
+        task_id text PRIMARY KEY,
+        job_id text,
+        queue text,
+        info BLOB
+    )'''
+    _db_index = 'CREATE INDEX IF NOT EXISTS jobs_job_id ON jobs (job_id)'
+    _write_query = 'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)'
+    # last known status of jobs and the cursor of the last status query, which
+    # allow incremental status queries to be continued by another process
+    _status_structure = '''CREATE TABLE IF NOT EXISTS job_status (
+        job_id text PRIMARY KEY,
+        status text
+    )'''
+    _cursor_structure = '''CREATE TABLE IF NOT EXISTS cursors (
+        queue text PRIMARY KEY,
+        cursor real
+    )'''
+    # write-ahead journal of submissions, with tasks that are being submitted and
+    # job ids of the submitted ones, which is cleared after the submission so that
+    # tasks in the journal are those of submissions that have been interrupted, and
+    # tasks that failed to be submitted, which are kept until they are submitted again
+    _journal_structure = '''CREATE TABLE IF NOT EXISTS journal (
+        task_id text PRIMARY KEY,
+        queue text,
+        state text,
+        job_id text,
+        time real
+    )'''
+    # resources used by recently completed tasks of steps of workflows on each queue,
+    # with at most history_size tasks of each step
+    _history_structure = '''CREATE TABLE IF NOT EXISTS history (
+        queue text,
+        step text,
+        task_id text,
+        runtime real,
+        peak_mem real,
+        time real,
+        PRIMARY KEY (queue, step, task_id)
+    )'''
+    history_size = 50
+
+    def __init__(self, db_file=None):
+        if db_file is None:
+            db_file = os.path.join(os.path.expanduser('~'), '.sos', 'pbs_jobs.db')
+        self.db_file = db_file
+        self._conn = None
+        self._lock = threading.Lock()
+        # in-memory index of records that have been read or written
+        self._jobs = {}
+        self._tasks = {}
+
+    def _get_conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_file, timeout=60, check_same_thread=False)
+            self._conn.execute(self._db_structure)
+            self._conn.execute(self._db_index)
+            self._conn.execute(self._status_structure)
+            self._conn.execute(self._cursor_structure)
+            self._conn.execute(self._journal_structure)
+            self._conn.execute(self._history_structure)
+            self._conn.commit()
+        return self._conn
+
+    conn = property(_get_conn)
+
+    def _index(self, task_id, job_id):
+        self._jobs[task_id] = job_id
+        self._tasks[job_id['job_id']] = task_id
+
+    def set(self, task_id, job_id, queue=''):
+        self.set_many({task_id: job_id}, queue)
+
+    def set_many(self, job_ids, queue=''):
+        '''Save job ids of tasks as a dictionary of task_id -> job_id'''
+        with self._lock:
+            for task_id, job_id in job_ids.items():
+                self._index(task_id, dict(job_id))
+            try:
+                self.conn.executemany(self._write_query,
+                    [(task_id, job_id['job_id'], queue, pickle.dumps(job_id)) for task_id, job_id in job_ids.items()])
+                # tasks being submitted are marked submitted in the same transaction
+                self.conn.executemany("UPDATE journal SET state='submitted', job_id=? WHERE task_id=?",
+                    [(job_id['job_id'], task_id) for task_id, job_id in job_ids.items()])
+                self.conn.commit()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to save job ids of {len(job_ids)} tasks: {e}')
+
+    def get(self, task_id):
+        return self.get_many([task_id]).get(task_id, {})
+
+    def get_many(self, task_ids):
+        '''Return a dictionary of task_id -> job_id for tasks with known job ids'''
+        res = {x: dict(self._jobs[x]) for x in task_ids if x in self._jobs}
+        missing = [x for x in task_ids if x not in res]
+        if not missing:
+            return res
+        with self._lock:
+            try:
+                cur = self.conn.cursor()
+                # query in chunks to stay below the limit of sqlite variables
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    cur.execute(f'SELECT task_id, info FROM jobs WHERE task_id IN ({",".join("?" * len(chunk))})', chunk)
+                    for task_id, info in cur.fetchall():
+                        self._index(task_id, pickle.loads(info))
+                        res[task_id] = dict(self._jobs[task_id])
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to get job ids of {len(missing)} tasks: {e}')
+        # import from .job_id files of tasks that are not in the store
+        imported = {}
+        for task_id in missing:
+            if task_id not in res:
+                job_id = read_job_id_file(job_id_file(task_id))
+                if job_id:
+                    imported[task_id] = job_id
+        if imported:
+            self.set_many(imported)
+            res.update({x: dict(y) for x, y in imported.items()})
+        return res
+
+    def task_of(self, job_id):
+        '''Return the task with specified job_id, or None if the job is unknown'''
+        if job_id in self._tasks:
+            return self._tasks[job_id]
+        with self._lock:
+            try:
+                cur = self.conn.cursor()
+                cur.execute('SELECT task_id, info FROM jobs WHERE job_id=?', (job_id,))
+                res = cur.fetchone()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to get task of job {job_id}: {e}')
+                return None
+            if not res:
+                return None
+            self._index(res[0], pickle.loads(res[1]))
+            return res[0]
+
+    def set_status_many(self, job_status):
+        '''Save status of jobs as a dictionary of job_id -> status'''
+        with self._lock:
+            try:
+                self.conn.executemany('INSERT OR REPLACE INTO job_status VALUES (?, ?)', list(job_status.items()))
+                self.conn.commit()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to save status of {len(job_status)} jobs: {e}')
+
+    def get_status_many(self, job_ids):
+        '''Return a dictionary of job_id -> status for jobs with saved status'''
+        res = {}
+        with self._lock:
+            try:
+                cur = self.conn.cursor()
+                for i in range(0, len(job_ids), 500):
+                    chunk = job_ids[i:i + 500]
+                    cur.execute(f'SELECT job_id, status FROM job_status WHERE job_id IN ({",".join("?" * len(chunk))})', chunk)
+                    res.update(cur.fetchall())
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to get status of {len(job_ids)} jobs: {e}')
+        return res
+
+    def get_cursor(self, queue):
+        '''Return the time of the last status query of queue, or None if unknown'''
+        with self._lock:
+            try:
+                cur = self.conn.cursor()
+                cur.execute('SELECT cursor FROM cursors WHERE queue=?', (queue,))
+                res = cur.fetchone()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to get status cursor of queue {queue}: {e}')
+                return None
+            return res[0] if res else None
+
+    def set_cursor(self, queue, cursor):
+        with self._lock:
+            try:
+                self.conn.execute('INSERT OR REPLACE INTO cursors VALUES (?, ?)', (queue, cursor))
+                self.conn.commit()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to save status cursor of queue {queue}: {e}')
+
+    def begin_submission(self, task_ids, queue=''):
+        '''Record in the journal that tasks are being submitted to queue'''
+        with self._lock:
+            try:
+                now = time.time()
+                self.conn.executemany("INSERT OR REPLACE INTO journal VALUES (?, ?, 'submitting', NULL, ?)",
+                    [(x, queue, now) for x in task_ids])
+                self.conn.commit()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to record submission of {len(task_ids)} tasks: {e}')
+
+    def fail_submission(self, task_ids):
+        '''Record in the journal that tasks failed to be submitted'''
+        with self._lock:
+            try:
+                self.conn.executemany("UPDATE journal SET state='failed', job_id=NULL WHERE task_id=?", [(x,) for x in task_ids])
+                self.conn.commit()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to record failed submission of {len(task_ids)} tasks: {e}')
+
+    def end_submission(self, task_ids):
+        '''Remove tasks from the journal after their submission, except for those
+        that failed to be submitted'''
+        with self._lock:
+            try:
+                self.conn.executemany("DELETE FROM journal WHERE task_id=? AND state!='failed'", [(x,) for x in task_ids])
+                self.conn.commit()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to record end of submission of {len(task_ids)} tasks: {e}')
+
+    def get_journal(self, task_ids):
+        '''Return a dictionary of task_id -> {queue, state, job_id, time} for tasks in
+        the journal, with state "submitting", "submitted" or "failed"'''
+        res = {}
+        with self._lock:
+            try:
+                cur = self.conn.cursor()
+                for i in range(0, len(task_ids), 500):
+                    chunk = task_ids[i:i + 500]
+                    cur.execute(f'SELECT task_id, queue, state, job_id, time FROM journal WHERE task_id IN ({",".join("?" * len(chunk))})', chunk)
+                    for task_id, queue, state, job_id, submit_time in cur.fetchall():
+                        res[task_id] = {'queue': queue, 'state': state, 'job_id': job_id, 'time': submit_time}
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to read submission journal of {len(task_ids)} tasks: {e}')
+        return res
+
+    def add_history_many(self, queue, records):
+        '''Save resources used by completed tasks as a dictionary of task_id ->
+        (step, runtime, peak_mem), with None for unknown runtime or peak_mem. Tasks
+        that have been saved keep their records and time, except that their unknown
+        peak_mem is filled in'''
+        with self._lock:
+            try:
+                now = time.time()
+                self.conn.executemany('INSERT OR IGNORE INTO history VALUES (?, ?, ?, ?, ?, ?)',
+                    [(queue, step, task_id, runtime, peak_mem, now) for task_id, (step, runtime, peak_mem) in records.items()])
+                self.conn.executemany('UPDATE history SET peak_mem=? WHERE queue=? AND step=? AND task_id=? AND peak_mem IS NULL',
+                    [(peak_mem, queue, step, task_id) for task_id, (step, runtime, peak_mem) in records.items() if peak_mem is not None])
+                # only the latest records of each step are kept
+                self.conn.executemany('''DELETE FROM history WHERE queue=? AND step=? AND task_id NOT IN
+                    (SELECT task_id FROM history WHERE queue=? AND step=? ORDER BY time DESC LIMIT ?)''',
+                    [(queue, x, queue, x, self.history_size) for x in set(y[0] for y in records.values())])
+                self.conn.commit()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to save resources used by {len(records)} tasks: {e}')
+
+    def get_history_tasks(self, queue, task_ids):
+        '''Return the set of tasks with saved resources on queue'''
+        res = set()
+        with self._lock:
+            try:
+                cur = self.conn.cursor()
+                for i in range(0, len(task_ids), 500):
+                    chunk = task_ids[i:i + 500]
+                    cur.execute(f'SELECT task_id FROM history WHERE queue=? AND task_id IN ({",".join("?" * len(chunk))})',
+                        [queue] + chunk)
+                    res.update(x[0] for x in cur.fetchall())
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to get saved resources of {len(task_ids)} tasks: {e}')
+        return res
+
+    def get_history_many(self, queue, steps):
+        '''Return a dictionary of step -> [(runtime, peak_mem)] of recently completed
+        tasks of steps on queue'''
+        res = {}
+        with self._lock:
+            try:
+                cur = self.conn.cursor()
+                for i in range(0, len(steps), 500):
+                    chunk = steps[i:i + 500]
+                    cur.execute(f'SELECT step, runtime, peak_mem FROM history WHERE queue=? AND step IN ({",".join("?" * len(chunk))})',
+                        [queue] + chunk)
+                    for step, runtime, peak_mem in cur.fetchall():
+                        res.setdefault(step, []).append((runtime, peak_mem))
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to get resources used by tasks of {len(steps)} steps: {e}')
+        return res
+
+    def import_file(self, task_id, filename=None):
+        job_id = read_job_id_file(filename if filename else job_id_file(task_id))
+        if job_id:
+            self.set(task_id, job_id)
+        return job_id
+
+    def export_file(self, task_id, filename=None):
+        '''Write job id of task to a .job_id file and return the filename'''
+        job_id = self.get(task_id)
+        if not job_id:
+            raise ValueError(f'No job id is available for task {task_id}')
+        filename = filename if filename else job_id_file(task_id)
+        write_job_id_file(filename, job_id)
+        return filename
+
+    def remove_many(self, task_ids):
+        with self._lock:
+            for task_id in task_ids:
+                job_id = self._jobs.pop(task_id, None)
+                if job_id:
+                    self._tasks.pop(job_id['job_id'], None)
+            try:
+                self.conn.executemany('DELETE FROM jobs WHERE task_id=?', [(x,) for x in task_ids])
+                self.conn.commit()
+            except sqlite3.DatabaseError as e:
+                env.logger.warning(f'Failed to remove job ids of {len(task_ids)} tasks: {e}')
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import base64
+import codecs
+import hashlib
+import os
+
+_MARKER = '@@SOS_TAIL@@'
+# a script on the remote host that prints the size of files and their content from
+# an offset, or from the start if a file is smaller, with at most max_bytes bytes
+# encoded in base64 so that the content is not changed by the decoding of command
+# output. Names of files are also encoded in base64 so that the command has no
+# character that is interpolated or quoted by execute_cmd of the remote host.
+# Usage: tail.sh max_bytes name1 offset1 name2 offset2 ...
+TAIL_SCRIPT = '''#!/bin/bash
+max_bytes=$1
+shift
+index=0
+while [ $# -ge 2 ]; do
+    file=$(echo "$1" | base64 -d)
+    case "$file" in
+        "~/"*) file="$HOME/${file#\\~/}" ;;
+    esac
+    offset=$2
+    shift 2
+    if [ -f "$file" ]; then
+        size=$(wc -c < "$file")
+        size=$((size))
+    else
+        size=-1
+    fi
+    [ $size -lt $offset ] && offset=0
+    printf '\\n''' + _MARKER + ''' %s %s %s\\n' $index $size $offset
+    [ $size -gt $offset ] && tail -c +$((offset + 1)) "$file" | head -c $max_bytes | base64
+    index=$((index + 1))
+done
+true
+'''
+
+
+class OutputTail:
+    '''Content of files, such as stdout and stderr of jobs, that is read
+    incrementally with an offset of each file, either directly or on a remote
+    host with commands that read multiple files at a time.
+
+    Files are identified by keys, so that the same key is used for the same
+    file in successive reads. At most max_bytes of each file are read at a time,
+    and a file that becomes smaller than its offset is read again from the start.'''
+
+    def __init__(self, max_bytes=65536):
+        self.max_bytes = max_bytes
+        # key -> [offset, decoder of content]
+        self._files = {}
+        # the script is named after its content so that an outdated copy on the
+        # remote host is never used
+        self.script_name = 'tail_' + hashlib.md5(TAIL_SCRIPT.encode()).hexdigest()[:16] + '.sh'
+
+    def _state(self, key):
+        if key not in self._files:
+            self._files[key] = [0, codecs.getincrementaldecoder('utf-8')(errors='replace')]
+        return self._files[key]
+
+    def _update(self, key, start, data):
+        state = self._state(key)
+        if start < state[0]:
+            # the file has been truncated or written again
+            state[1].reset()
+        state[0] = start + len(data)
+        return state[1].decode(data)
+
+    def read(self, files):
+        '''Return key -> new content of local files given as key -> filename'''
+        res = {}
+        for key, filename in files.items():
+            offset = self._state(key)[0]
+            try:
+                with open(os.path.expanduser(filename), 'rb') as fh:
+                    start = offset if os.fstat(fh.fileno()).st_size >= offset else 0
+                    fh.seek(start)
+                    data = fh.read(self.max_bytes)
+            except FileNotFoundError:
+                continue
+            res[key] = self._update(key, start, data)
+        return res
+
+    def write_script(self, task_dir):
+        '''Write TAIL_SCRIPT to task_dir and return its path'''
+        script = os.path.join(task_dir, self.script_name)
+        with open(script, 'w', newline='') as tail:
+            tail.write(TAIL_SCRIPT)
+        return script
+
+    def commands(self, files, max_length=65536):
+        '''Yield keys and commands that print new content of files given as
+        key -> filename with the script under ~/.sos/tasks of the remote host,
+        with each command no longer than max_length'''
+        head = f'bash ~/.sos/tasks/{self.script_name} {self.max_bytes}'
+        keys = []
+        cmd = head
+        for key, filename in files.items():
+            arg = f' {base64.b64encode(filename.encode()).decode()} {self._state(key)[0]}'
+            if keys and len(cmd) + len(arg) > max_length:
+                yield keys, cmd
+                keys = []
+                cmd = head
+            keys.append(key)
+            cmd += arg
+        if keys:
+            yield keys, cmd
+
+    def parse(self, keys, output):
+        '''Return key -> new content of files from the output of a command
+        generated for keys by commands()'''
+        res = {}
+        for block in output.split('\n' + _MARKER + ' ')[1:]:
+            header, _, data = block.partition('\n')
+            index, size, start = (int(x) for x in header.split())
+            if size < 0:
+                # the file does not exist yet
+                continue
+            res[keys[index]] = self._update(keys[index], start, base64.b64decode(''.join(data.split())))
+        return res
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import functools
+import os
+import re
+
+from sos.pattern import regex
+from sos.syntax import SOS_WILDCARD
+
+
+class OutputPattern(object):
+    '''A pattern such as "{job_id} {status}" that is compiled once and matched
+    against lines of command output, with the same result as
+    sos.pattern.extract_pattern'''
+
+    def __init__(self, text):
+        self.text = text
+        # extract_pattern matches normalized patterns to the whole line
+        pattern = os.path.normpath(text)
+        self.names = list(dict.fromkeys(x.group('name') for x in SOS_WILDCARD.finditer(pattern)))
+        self._regex = re.compile(regex(pattern))
+
+    def parse(self, output):
+        '''Return a dictionary of variables extracted from output, or None if
+        output does not match the pattern'''
+        match = self._regex.match(output.replace('\\', '/'))
+        return match.groupdict() if match else None
+
+    def extract(self, lines):
+        '''Return a dictionary of lists of variables extracted from lines, with
+        None for lines that do not match the pattern'''
+        res = {x: [] for x in self.names}
+        for line in lines:
+            match = self.parse(line)
+            for name in self.names:
+                res[name].append(match[name] if match else None)
+        return res
+
+
+class SchedulerOutput(object):
+    '''Parser of the output of the submission command of a scheduler, which
+    looks for job_id and other variables anywhere in the output'''
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        self._regex = re.compile(text, re.MULTILINE)
+
+    def parse(self, output):
+        match = self._regex.search(output)
+        return match.groupdict() if match else None
+
+
+# output of submission commands of common schedulers
+SCHEDULER_OUTPUTS = {
+    # 1234.server
+    'pbs': r'^(?P<job_id>[^\s]+)\s*\Z',
+    # Submitted batch job 1234 [on cluster name]
+    'slurm': r'Submitted batch job (?P<job_id>\d+)',
+    # Job <1234> is submitted to queue <normal>.
+    'lsf': r'Job <(?P<job_id>\d+)> is submitted(?: to (?:default )?queue <(?P<queue>[^>]+)>)?',
+    # Your job 1234 ("name") has been submitted, or
+    # Your job-array 1234.1-10:1 ("name") has been submitted
+    'sge': r'Your job(?:-array)? (?P<job_id>\d+)[^\s]* \("(?P<job_name>[^"]*)"\) has been submitted',
+}
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(text):
+    return OutputPattern(text)
+
+
+def scheduler_output(scheduler):
+    if scheduler not in SCHEDULER_OUTPUTS:
+        raise ValueError(f'Unsupported scheduler {scheduler}, which should be one of {", ".join(SCHEDULER_OUTPUTS.keys())}')
+    return SchedulerOutput(scheduler, SCHEDULER_OUTPUTS[scheduler])
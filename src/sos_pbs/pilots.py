@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import hashlib
+import os
+import re
+import shlex
+import time
+
+from sos.utils import env, expand_size, expand_time, format_HHMMSS
+
+
+# a pilot pulls tasks from its work queue, which is the directory of this script,
+# until there is no new task for idle_time seconds or there is not enough walltime
+# left for the next task, and skips tasks that need more cores or memory (in bytes)
+# than the pilot has. Usage: pilot.sh walltime idle_time pilot_id cores mem
+PILOT_SCRIPT = '''#!/bin/bash
+queue=$(cd $(dirname $0) && pwd)
+end_time=$(( $(date +%s) + $1 ))
+idle_time=$2
+pilot=$3
+pilot_cores=${4:-1}
+pilot_mem=${5:-0}
+mkdir -p $queue/running
+last_active=$(date +%s)
+while true; do
+    now=$(date +%s)
+    task=
+    for entry in $queue/*.run; do
+        [ -e "$entry" ] || break
+        walltime=$(sed -n 's/^walltime=//p' "$entry")
+        [ $(( now + ${walltime:-0} )) -gt $end_time ] && continue
+        cores=$(sed -n 's/^cores=//p' "$entry")
+        [ ${cores:-1} -gt $pilot_cores ] && continue
+        mem=$(sed -n 's/^mem=//p' "$entry")
+        [ ${mem:-0} -gt $pilot_mem ] && continue
+        name=$(basename "$entry" .run)
+        # claim the task by moving the entry, which is atomic
+        if mv "$entry" "$queue/running/$name.$pilot" 2>/dev/null; then
+            task=$name
+            break
+        fi
+    done
+    if [ -z "$task" ]; then
+        [ $(( now - last_active )) -ge $idle_time ] && break
+        [ $now -ge $end_time ] && break
+        sleep 2
+        continue
+    fi
+    . "$queue/running/$task.$pilot"
+    (cd "$cur_dir" && sos execute $task -v $verbosity -s $sig_mode)
+    rm -f "$queue/running/$task.$pilot"
+    last_active=$(date +%s)
+done
+'''
+
+
+class PilotMixin(object):
+    '''Mixin of PBS_TaskEngine that executes tasks with pilots, which are jobs that
+    pull tasks from a work queue on the remote host'''
+
+    def _init_pilots(self):
+        # in pilot mode, tasks are added to a work queue under ~/.sos/tasks and are
+        # executed by pilot jobs that pull tasks from the queue
+        if 'pilots' in self.config and int(self.config['pilots']) > 0:
+            self.pilots = int(self.config['pilots'])
+            if 'pilot_job_template' in self.config:
+                self.pilot_job_template = self.config['pilot_job_template'].replace('\r\n', '\n')
+            else:
+                raise ValueError(f'A pilot_job_template is required for pilots of queue {self.alias}')
+            if 'pilot_walltime' in self.config:
+                self.pilot_walltime = expand_time(self.config['pilot_walltime'])
+            elif 'max_walltime' in self.config:
+                self.pilot_walltime = expand_time(self.config['max_walltime'])
+            else:
+                raise ValueError(f'Option pilot_walltime or max_walltime is required for pilots of queue {self.alias}')
+            # pilots quit if there is no task for pilot_idle_time seconds
+            if 'pilot_idle_time' in self.config:
+                self.pilot_idle_time = expand_time(self.config['pilot_idle_time'])
+            else:
+                self.pilot_idle_time = 300
+        else:
+            self.pilots = 0
+            self.pilot_job_template = None
+        # pilot_id -> (cores, mem) of pilot jobs, and task_id -> (cores, mem) of
+        # tasks in the work queue that have not been started by pilots
+        self._pilot_jobs = {}
+        self._pilot_tasks = {}
+
+    def _pilot_dir(self, remote=False):
+        # directory of the work queue of pilots, with tasks in *.run
+        name = 'pilot_' + re.sub(r'\W', '_', self.alias)
+        if remote:
+            return f'~/.sos/tasks/{name}'
+        return os.path.join(os.path.expanduser('~'), '.sos', 'tasks', name)
+
+    def _enqueue_tasks(self, task_ids):
+        # add tasks to the work queue of pilots and make sure that there are
+        # enough pilots to execute them
+        if any(x in self._depends for x in task_ids):
+            raise ValueError(f'Dependencies of tasks are not supported by pilots of {self.alias}')
+        pilot_dir = self._pilot_dir()
+        os.makedirs(pilot_dir, exist_ok=True)
+        entries = []
+        queued = {}
+        # tasks that are executed in dryrun mode, or that would never be taken by pilots
+        # because they need more walltime than pilots have, are submitted as jobs
+        direct_tasks = []
+        for task_id, runtime in zip(task_ids, self._get_runtimes(task_ids)):
+            walltime = expand_time(runtime['walltime']) if runtime.get('walltime', None) else 0
+            if runtime['run_mode'] == 'dryrun' or walltime > self._pilot_task_walltime():
+                direct_tasks.append(task_id)
+                continue
+            queued[task_id] = (int(runtime['cores']), expand_size(runtime['mem']) if runtime.get('mem', None) else 0)
+            entry = os.path.join(pilot_dir, task_id + '.run')
+            # write to a temporary file so that pilots never see a partial entry
+            with open(entry + '.tmp', 'w', newline='') as run:
+                for key in ('cur_dir', 'verbosity', 'sig_mode'):
+                    run.write(f'{key}={shlex.quote(str(runtime[key]))}\n')
+                run.write(f'walltime={walltime}\ncores={queued[task_id][0]}\nmem={queued[task_id][1]}\n')
+            os.replace(entry + '.tmp', entry)
+            entries.append(entry)
+        if entries:
+            self._send_task_files(entries)
+            self._pilot_tasks.update(queued)
+            self._batch_submitted.update(queued)
+            env.logger.info(f'{len(entries)} tasks ``queued`` for pilots of {self.alias}')
+            self._start_pilots()
+        if not direct_tasks:
+            return True
+        return self._prepare_script(direct_tasks[0]) if len(direct_tasks) == 1 else self._prepare_scripts(direct_tasks)
+
+    def _pilot_task_walltime(self):
+        # pilots stop taking new tasks one minute before the end of their walltime
+        return max(self.pilot_walltime - 60, 0)
+
+    def _check_pilots(self, status):
+        # forget tasks (with status task_id -> status) that have been started by pilots,
+        # and start new pilots if pilots have quit while tasks are still in the queue
+        for task_id, task_status in status.items():
+            if task_status != 'pending':
+                self._pilot_tasks.pop(task_id, None)
+        if not self._pilot_tasks:
+            return
+        try:
+            self._start_pilots()
+        except Exception as e:
+            env.logger.warning(f'Failed to start pilots of {self.alias}: {e}')
+
+    def _start_pilots(self):
+        # submit pilot jobs so that there are self.pilots pilots in the queue, which are
+        # large enough for the largest task in the queue
+        for pilot_id in self._dead_tasks(list(self._pilot_jobs)):
+            env.logger.debug(f'Pilot {pilot_id} is no longer active')
+            self._pilot_jobs.pop(pilot_id)
+        cores = max([x[0] for x in self._pilot_tasks.values()] + [1])
+        mem = max([x[1] for x in self._pilot_tasks.values()] + [0])
+        num_pilots = self.pilots - len(self._pilot_jobs)
+        if num_pilots <= 0:
+            if all(x[0] < cores or x[1] < mem for x in self._pilot_jobs.values()):
+                # no pilot can execute the largest task
+                num_pilots = 1
+            else:
+                return
+        os.makedirs(self._pilot_dir(), exist_ok=True)
+        pilot_script = os.path.join(self._pilot_dir(), 'pilot.sh')
+        with open(pilot_script, 'w', newline='') as script:
+            script.write(PILOT_SCRIPT)
+        runtimes = []
+        job_files = [pilot_script]
+        for i in range(num_pilots):
+            pilot_id = f'pilot_{hashlib.md5(f"{self.alias} {time.time()} {i}".encode()).hexdigest()[:16]}'
+            runtime = dict(self.config)
+            runtime.update({
+                'task': pilot_id,
+                'job_name': pilot_id,
+                'job_file': f'~/.sos/tasks/{pilot_id}.sh',
+                'nodes': 1,
+                'cores': cores,
+                'walltime': format_HHMMSS(self.pilot_walltime),
+                'cur_dir': '~',
+                'pilot_cmd': f'bash {self._pilot_dir(remote=True)}/pilot.sh {self._pilot_task_walltime()} '
+                    f'{self.pilot_idle_time} {pilot_id} {cores} {mem}',
+            })
+            if mem:
+                runtime['mem'] = mem
+            runtimes.append(runtime)
+        try:
+            job_texts = self._templates['pilot_job_template'].render_many(runtimes)
+        except Exception as e:
+            raise ValueError(f'Failed to generate job file for pilots: {e}')
+        for runtime, job_text in zip(runtimes, job_texts):
+            job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', runtime['task'] + '.sh')
+            with open(job_file, 'w', newline='') as job:
+                job.write(job_text)
+            job_files.append(job_file)
+        self._send_task_files(job_files)
+        for runtime in runtimes:
+            try:
+                cmd = self._templates['submit_cmd'].render(runtime)
+            except Exception as e:
+                raise ValueError(f'Failed to generate job submission command from template "{self.submit_cmd}": {e}')
+            env.logger.debug(f'submit {runtime["task"]}: {cmd}')
+            try:
+                job_id = self._submit_job(cmd, runtime['job_name'])
+            except Exception as e:
+                raise RuntimeError(f'Failed to submit pilot {runtime["task"]}: {e}')
+            self._write_job_id(runtime['task'], job_id)
+            self._pilot_jobs[runtime['task']] = (runtime['cores'], runtime.get('mem', 0))
+            env.logger.info(f'Pilot {runtime["task"]} ``submitted`` to {self.alias} with job id {job_id["job_id"]}')
+
+    def _dequeue_tasks(self, task_ids):
+        # remove tasks from the work queue of pilots
+        entries = [f'{x}.run' for x in task_ids]
+        for chunk, cmd in self._bulk_commands('pilot_dequeue_cmd', entries, 'entries',
+            {'pilot_dir': self._pilot_dir(remote=True)}):
+            try:
+                self.agent.check_output(cmd)
+            except Exception as e:
+                env.logger.debug(f'Failed to remove {len(chunk)} tasks from the queue of pilots: {e}')
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+from sos.utils import expand_time
+
+
+# values of the priority of jobs (PBS -p, Slurm --nice, SGE -p) for the
+# tasks with the lowest and highest priority in a batch
+PRIORITY_RANGES = {
+    'pbs': (0, 1023),
+    'slurm': (100, 0),
+    'sge': (-100, 0),
+}
+
+
+class PriorityMixin(object):
+    '''Mixin of PBS_TaskEngine that submits tasks of a batch in the order of their
+    priority'''
+
+    def _init_priorities(self):
+        # tasks of a batch are submitted in the order of their priority, which is
+        # given by the caller of the engine, followed by the longest runtime of the
+        # tasks and their downstream tasks in the batch, estimated from the runtime
+        # of completed tasks of the same step or from walltime, and by cores. The
+        # priority is passed to templates as {priority}, e.g. #PBS -p {priority},
+        # with values in priority_range (lowest, highest). Without order_tasks, tasks are
+        # only ordered if the caller gives their priority, because the runtime of tasks
+        # is estimated from their task files
+        if 'order_tasks' in self.config:
+            self.order_tasks = bool(self.config['order_tasks'])
+        else:
+            self.order_tasks = False
+
+        if 'priority_range' in self.config:
+            self.priority_range = tuple(int(x) for x in self.config['priority_range'])
+            if len(self.priority_range) != 2:
+                raise ValueError(f'Option priority_range should be a pair of lowest and highest priority for queue {self.alias}')
+        elif self.scheduler in PRIORITY_RANGES:
+            self.priority_range = PRIORITY_RANGES[self.scheduler]
+        else:
+            self.priority_range = (0, 100)
+
+        # priority of jobs of tasks that are not ordered, which is in the middle of
+        # priority_range by default so that these jobs are not given the highest priority
+        if 'default_priority' in self.config:
+            self.default_priority = int(self.config['default_priority'])
+        else:
+            self.default_priority = round(sum(self.priority_range) / 2)
+
+        # priority of tasks given by the caller, and priority of tasks in the
+        # batch that is being submitted
+        self._priorities = {}
+        self._batch_priority = {}
+
+    def set_priorities(self, priorities):
+        '''Set priority of tasks as a dictionary of task_id -> number. Tasks
+        with higher priority are submitted first, and with higher priority of jobs'''
+        self._priorities.update({x: float(y) for x, y in priorities.items()})
+
+    def _expected_runtimes(self, task_ids, runtimes):
+        # runtime of tasks estimated from the median runtime of recently completed
+        # tasks of their steps, or from their walltime
+        steps = self._get_steps(task_ids)
+        history = self._job_ids.get_history_many(self.alias, sorted(set(steps.values())))
+        median = {}
+        for step, records in history.items():
+            used = sorted(x[0] for x in records if x[0])
+            if used:
+                median[step] = used[len(used) // 2]
+        res = []
+        for task_id, runtime in zip(task_ids, runtimes):
+            if steps.get(task_id, None) in median:
+                res.append(median[steps[task_id]])
+            elif runtime.get('walltime', None):
+                res.append(expand_time(runtime['walltime']))
+            else:
+                res.append(0)
+        return res
+
+    def _order_tasks(self, task_ids):
+        # return tasks in the order of their priority, and save the priority of their jobs
+        runtimes = self._read_runtimes(task_ids)
+        with self._timer.tasks(task_ids), self._timer.phase('order_tasks'):
+            expected = dict(zip(task_ids, self._expected_runtimes(task_ids, runtimes)))
+            # length of the longest path from each task through its downstream tasks
+            path = {}
+            downstream = {}
+            for task_id in task_ids:
+                for upstream in self._depends.get(task_id, ()):
+                    downstream.setdefault(upstream, []).append(task_id)
+            for group in reversed(self._dependency_groups(task_ids)):
+                for task_id in group:
+                    path[task_id] = expected[task_id] + max((path[x] for x in downstream.get(task_id, ())), default=0)
+            cores = {x: int(y.get('cores', 1) or 1) for x, y in zip(task_ids, runtimes)}
+            ordered = sorted(task_ids, key=lambda x: (-self._priorities.get(x, 0), -path[x], -cores[x]))
+            # jobs of the tasks are given priority values by their rank
+            low, high = self.priority_range
+            for rank, task_id in enumerate(reversed(ordered)):
+                self._batch_priority[task_id] = low + round((high - low) * rank / (len(ordered) - 1))
+        return ordered
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import re
+
+from sos.utils import env, expand_size, expand_time, format_HHMMSS
+
+
+# exit status of jobs that are killed by the scheduler for exceeding their walltime
+# or memory, such as states of Slurm and LSF jobs, exit codes of PBS Pro (-24 to
+# -29) and Torque (-11, and 271 for SIGTERM), and 137 for jobs killed by SIGKILL
+# when they exceed the memory limit of SGE or of their cgroups
+RESOURCE_EXIT_STATUS = r'TIMEOUT|TO|OUT_OF_MEMORY|OOM|TERM_RUNLIMIT|TERM_MEMLIMIT|-2[4-9]|-11|137|271'
+
+
+class RightsizeMixin(object):
+    '''Mixin of PBS_TaskEngine that reduces walltime and mem of tasks to what tasks
+    of the same step have used, and submits tasks that are killed for exceeding
+    the reduced resources again with requested resources'''
+
+    def _init_rightsize(self):
+        # walltime and mem of tasks are reduced to the rightsize_percentile percentile of
+        # the runtime and peak memory of recently completed tasks of the same step of the
+        # same workflow file, plus a fraction rightsize_margin, once rightsize_min_tasks
+        # tasks of the step have completed. Tasks with jobs that exit_status_cmd reports
+        # as killed for exceeding reduced resources, with an exit status (exit_code or
+        # other variables of exit_status_cmd_output, or job status) that matches
+        # resource_exit_status, are submitted again with the requested resources by the
+        # engine that has submitted them
+        if 'rightsize' in self.config:
+            self.rightsize = bool(self.config['rightsize'])
+        else:
+            self.rightsize = False
+
+        if 'rightsize_percentile' in self.config:
+            self.rightsize_percentile = float(self.config['rightsize_percentile'])
+            if not 0 < self.rightsize_percentile <= 100:
+                raise ValueError(f'Option rightsize_percentile should be between 0 and 100 for queue {self.alias}')
+        else:
+            self.rightsize_percentile = 95
+
+        if 'rightsize_margin' in self.config:
+            self.rightsize_margin = float(self.config['rightsize_margin'])
+        else:
+            self.rightsize_margin = 0.25
+
+        if 'rightsize_min_tasks' in self.config:
+            self.rightsize_min_tasks = max(int(self.config['rightsize_min_tasks']), 1)
+        else:
+            self.rightsize_min_tasks = 5
+
+        if 'resource_exit_status' in self.config:
+            self.resource_exit_status = self.config['resource_exit_status']
+        else:
+            self.resource_exit_status = RESOURCE_EXIT_STATUS
+        try:
+            self._resource_exit = re.compile(self.resource_exit_status, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f'Invalid resource_exit_status "{self.resource_exit_status}" for queue {self.alias}: {e}')
+        if self.rightsize and not self.exit_status_cmd:
+            env.logger.warning(f'Tasks that fail with reduced resources are not submitted again without exit_status_cmd for queue {self.alias}')
+
+        # requested and reduced resources of tasks in the batch that is being
+        # submitted, tasks that have been submitted with reduced resources and are
+        # not yet finished, and tasks that are submitted again with requested resources
+        self._rightsized = {}
+        self._reduced_tasks = set()
+        self._requested_resources = set()
+
+    def _percentile(self, values):
+        # the rightsize_percentile percentile of values, or None if there are too few values
+        values = sorted(x for x in values if x)
+        if len(values) < self.rightsize_min_tasks:
+            return None
+        return values[min(int(len(values) * self.rightsize_percentile / 100), len(values) - 1)]
+
+    def _rightsize(self, task_ids, runtimes):
+        # return runtimes of tasks with walltime and mem reduced to what completed tasks
+        # of the same steps have used
+        if not self.rightsize:
+            return runtimes
+        tasks = [x for x, y in zip(task_ids, runtimes) if x not in self._requested_resources and
+            (y.get('walltime', None) or y.get('mem', None))]
+        if not tasks:
+            return runtimes
+        self._update_history()
+        steps = self._get_steps(tasks)
+        history = self._job_ids.get_history_many(self.alias, sorted(set(steps.values())))
+        used = {x: (self._percentile(y[0] for y in records), self._percentile(y[1] for y in records))
+            for x, records in history.items()}
+        res = []
+        for task_id, runtime in zip(task_ids, runtimes):
+            walltime, mem = used.get(steps.get(task_id, None), (None, None)) if task_id in tasks else (None, None)
+            reduced = {}
+            if walltime and runtime.get('walltime', None):
+                walltime = max(int(walltime * (1 + self.rightsize_margin)) + 1, 60)
+                if walltime < expand_time(runtime['walltime']):
+                    reduced['walltime'] = format_HHMMSS(walltime)
+            if mem and runtime.get('mem', None):
+                mem = int(mem * (1 + self.rightsize_margin)) + 1
+                if mem < expand_size(runtime['mem']):
+                    reduced['mem'] = mem
+            if reduced:
+                env.logger.debug(f'Resources of task {task_id} reduced from ' +
+                    ', '.join(f'{x}={runtime[x]}' for x in reduced) + ' to ' + ', '.join(f'{x}={y}' for x, y in reduced.items()))
+                self._rightsized[task_id] = dict(reduced, **{f'requested_{x}': runtime[x] for x in reduced})
+                runtime = dict(runtime, **reduced)
+            res.append(runtime)
+        return res
+
+    def _retry_rightsized(self, status):
+        # tasks that this engine has submitted with reduced walltime or mem, and whose
+        # jobs are killed by the scheduler for exceeding them, are submitted again with
+        # the requested resources and reported as submitted until their jobs start or
+        # die, so commands that only query the status of tasks never submit them.
+        # Returns task_id -> status of tasks that are submitted again
+        stopped = [x for x, y in status.items() if y in ('failed', 'aborted')]
+        reduced = [x for x in stopped if x in self._reduced_tasks]
+        self._reduced_tasks.difference_update(x for x, y in status.items() if y in ('completed', 'failed', 'aborted'))
+        resubmitted = [x for x in stopped if x in self._requested_resources]
+        alive = set(resubmitted) - set(self._dead_tasks(resubmitted))
+        self._requested_resources.difference_update([x for x in resubmitted if x not in alive] +
+            [x for x, y in status.items() if y == 'completed'])
+        retry = self._killed_for_resources(reduced) if reduced else []
+        if retry:
+            env.logger.warning(f'Submitting {len(retry)} tasks that were killed for exceeding reduced walltime or mem '
+                f'again with requested resources: {", ".join(retry)}')
+            self._requested_resources.update(retry)
+            if self._submit_tasks(retry):
+                alive.update(retry)
+        return {x: 'submitted' for x in alive}
+
+    def _killed_for_resources(self, task_ids):
+        # return tasks with jobs that are not killed by users, and that exit_status_cmd
+        # reports as killed for exceeding their resources
+        if not self.exit_status_cmd:
+            return []
+        job_ids = {x: y for x, y in self._get_job_ids(task_ids).items() if not y.get('killed', False)}
+        exit_status = {}
+        unknown = sorted(set(y['job_id'] for y in job_ids.values() if 'exit_code' not in y))
+        if unknown:
+            try:
+                exit_status = self._query_exit_status(unknown)
+            except Exception as e:
+                env.logger.debug(f'Failed to query exit status of jobs on {self.alias}: {e}')
+        res = []
+        for task_id, job_id in job_ids.items():
+            values = dict({x: job_id[x] for x in ('job_status', 'exit_code') if x in job_id},
+                **exit_status.get(job_id['job_id'], {}))
+            values.setdefault('job_status', self._job_status.get(job_id['job_id'], None))
+            values.pop('stderr', None)
+            if any(self._resource_exit.fullmatch(str(x).strip()) for x in values.values() if x is not None):
+                res.append(task_id)
+            else:
+                env.logger.debug(f'Task {task_id} with reduced resources failed with exit status {values}')
+        return res
@@ -3,15 +3,114 @@
 # Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
 # Distributed under the terms of the 3-clause BSD License.
 
+import atexit
+import concurrent.futures
+import functools
+import hashlib
+import json
 import os
-from sos.utils import env
+import re
+import subprocess
+import tempfile
+import time
+import weakref
+from sos.utils import env, expand_size, expand_time, text_repr
 from sos.eval import cfg_interpolate
+from sos.hosts import LocalHost
 from sos.task_engines import TaskEngine
 from sos.tasks import TaskFile
-from sos.pattern import extract_pattern
 
-class PBS_TaskEngine(TaskEngine):
-    def __init__(self, agent):
+from .arrays import ArrayMixin
+from .bundles import BundleMixin
+from .cache import StatusCache
+from .dependencies import DependencyMixin
+from .events import EventMixin
+from .history import HistoryMixin
+from .jobs import JobIdStore
+from .output import OutputTail
+from .parsers import compile_pattern, scheduler_output
+from .pilots import PilotMixin
+from .priorities import PriorityMixin
+from .rightsize import RightsizeMixin
+from .throttle import ThrottleMixin
+from .timing import PhaseTimer
+from .trace import TraceRecorder
+
+class JobTemplate(object):
+    '''A template such as job_template and submit_cmd that is compiled once
+    and interpolated with the same rules as cfg_interpolate.'''
+    def __init__(self, text, name='template'):
+        self.text = text
+        self.name = name
+        try:
+            self._code = compile('f' + text_repr(text), f'<{name}>', 'eval')
+        except SyntaxError as e:
+            raise ValueError(f'Invalid {name} "{text}": {e}')
+
+    def _render(self, runtime, config):
+        res = eval(self._code, runtime, config)
+        # handle nested interpolation as cfg_interpolate does
+        if '{' in res or '}' in res:
+            return cfg_interpolate(res, runtime)
+        return res
+
+    def render(self, runtime):
+        try:
+            return self._render(runtime, env.sos_dict.get('CONFIG', {}))
+        except Exception as e:
+            raise ValueError(f'Failed to interpolate {self.name} "{self.text}": {e}')
+
+    def render_many(self, runtimes):
+        # interpolate the template with a list of runtime dictionaries
+        config = env.sos_dict.get('CONFIG', {})
+        res = []
+        for runtime in runtimes:
+            try:
+                res.append(self._render(runtime, config))
+            except Exception as e:
+                raise ValueError(f'Failed to interpolate {self.name} "{self.text}" for task {runtime.get("task", "")}: {e}')
+        return res
+
+
+@functools.lru_cache(maxsize=None)
+def compile_template(text, name='template'):
+    # templates are shared by all engines with the same configuration
+    return JobTemplate(text, name)
+
+
+def _save_timing(engine_ref):
+    # save timing of an engine at exit if it has not been garbage collected
+    engine = engine_ref()
+    if engine is not None:
+        engine._save_timing()
+
+
+# commands of schedulers that print the ids of queued and running jobs named {job_name},
+# e.g. 1234.server (PBS Pro and Torque), 1234 (Slurm, with the id of the job array for
+# elements of job arrays) and 1234 (LSF)
+FIND_JOB_CMDS = {
+    'pbs': 'qselect -N {job_name}',
+    'slurm': 'squeue -h -o %F -n {job_name}',
+    'lsf': 'bjobs -noheader -o jobid -J {job_name}',
+}
+
+# errors of submission commands that are worth retrying, such as limits on the
+# number of queued jobs and schedulers that cannot be reached
+TRANSIENT_ERROR_OUTPUT = (r'would exceed|too many jobs|job limit|maximum number of jobs|MaxSubmitJob|'
+    r'jobs are allowed|threshold reached|temporarily unavailable|try again|timed out|'
+    r'cannot connect to server|unable to contact|connection (refused|reset|closed)')
+
+
+class PBS_TaskEngine(ArrayMixin, BundleMixin, PilotMixin, ThrottleMixin, EventMixin, DependencyMixin, PriorityMixin,
+        HistoryMixin, RightsizeMixin, TaskEngine):
+    # runtime options that are passed from tasks to job templates
+    runtime_keys = ('nodes', 'cores', 'mem', 'walltime', 'cur_dir', 'home_dir', 'verbosity', 'sig_mode', 'run_mode')
+
+    def __init__(self, agent, job_ids=None, local_host=None, run_local=None):
+        # job_ids is a JobIdStore that could be shared by several engines,
+        # local_host tells if commands of agent are executed on the local host,
+        # which is the case if agent is a LocalHost, and run_local runs commands
+        # on the local host, such as the command to send task files
         super(PBS_TaskEngine, self).__init__(agent)
         # we have self.config for configurations
         #
@@ -40,33 +139,507 @@ class PBS_TaskEngine(TaskEngine):
         else:
             self.kill_cmd = self.config['kill_cmd']
 
-    def execute_tasks(self, task_ids):
+        self._init_status()
+        self._init_events()
+
+        # built-in parser of the output of submit_cmd of a scheduler (pbs, slurm, lsf
+        # or sge), which is used unless submit_cmd_output is specified
+        if 'scheduler' in self.config:
+            self.scheduler = self.config['scheduler']
+            scheduler_output(self.scheduler)
+        else:
+            self.scheduler = None
+
+        self._init_submission()
+        self._init_dependencies()
+        self._init_arrays()
+        self._init_bundles()
+        self._init_pilots()
+        self._init_throttle()
+        self._init_priorities()
+        self._init_rightsize()
+        self._init_recording()
+        self._init_output()
+
+        # allow the submission of multiple tasks in one call to execute_tasks
+        if 'batch_size' in self.config:
+            self.batch_size = self.config['batch_size']
+        elif self.array_submit_cmd or self.bundle_job_template or self.pilots or self.submit_workers > 1:
+            self.batch_size = 1000
+
+        # compile templates so that errors are reported before any task is submitted
+        self._templates = {x: compile_template(getattr(self, x), x) for x in ('job_template', 'submit_cmd',
+            'status_cmd', 'kill_cmd', 'bulk_status_cmd', 'events_cmd', 'exit_status_cmd', 'bulk_kill_cmd',
+            'array_job_template', 'array_submit_cmd', 'array_job_id', 'bundle_job_template', 'bundle_task_cmd', 'pilot_job_template',
+            'queued_count_cmd', 'find_job_cmd', 'send_task_files_cmd', 'dependency_option', 'stdout_file', 'stderr_file')
+            if getattr(self, x, None)}
+        self._templates['pilot_dequeue_cmd'] = compile_template('cd {pilot_dir} && rm -f {entries}', 'pilot_dequeue_cmd')
+        # and patterns to parse outputs of commands
+        self._parsers = {x: compile_pattern(getattr(self, x)) for x in ('submit_cmd_output', 'array_submit_cmd_output',
+            'bulk_status_cmd_output', 'events_cmd_output', 'exit_status_cmd_output') if getattr(self, x, None)}
+        if self.scheduler:
+            for x in ('submit_cmd_output', 'array_submit_cmd_output'):
+                if x in self._parsers and x not in self.config:
+                    self._parsers[x] = scheduler_output(self.scheduler)
+
+        self._job_ids = JobIdStore() if job_ids is None else job_ids
+        self._known_jobs = {}
+        self._job_status = {}
+        self._queried_jobs = set()
+        self._job_status_time = None
+        self._status_output = {}
+        if self.status_cache_file:
+            self._status_cache = StatusCache(os.path.expanduser(self.status_cache_file.format(
+                alias=re.sub(r'[^\w.-]', '_', self.alias))), self.status_cache_ttl, self.status_cache_stale)
+        else:
+            self._status_cache = None
+        # tasks in the batch that have been submitted, or added to the queue of pilots
+        self._batch_submitted = set()
+        # _runtime of tasks in the batch that is being submitted
+        self._task_runtimes = {}
+        # steps of tasks in the batch that is being submitted
+        self._task_steps = {}
+        self._init_history()
+        self._shared_scripts = set()
+        # offsets of stdout and stderr of tasks that have been read by tail_tasks
+        self._output_tail = OutputTail(self.max_tail_bytes)
+        self._tail_script_sent = False
+        self._local_agent = isinstance(self.agent, LocalHost) if local_host is None else local_host
+        self._local_cmd = functools.partial(subprocess.check_call, shell=True) if run_local is None else run_local
+        if self.trace_file:
+            self._trace = TraceRecorder(self.agent, self._trace_file(), self.config, self.trace_task_files)
+            self.agent = self._trace
+        else:
+            self._trace = None
+        # phases of tasks and batches are only kept if they are saved
+        self._timer = PhaseTimer(details=bool(self.timing_file))
+        self._timer_run_id = None
+        self._timer_save_time = 0
+        if self.timing_file:
+            # the exit handler does not keep the engine alive
+            atexit.register(_save_timing, weakref.ref(self))
+
+    def _init_status(self):
+        # optional command to query the status of all known jobs in one call, with
+        # {job_ids} separated by spaces (e.g. qstat {job_ids}) or {job_ids_csv}
+        # separated by commas (e.g. squeue -h -o '%i %T' -j {job_ids_csv}), and
+        # output parsed line by line with bulk_status_cmd_output
+        if 'bulk_status_cmd' in self.config:
+            self.bulk_status_cmd = self.config['bulk_status_cmd']
+        else:
+            self.bulk_status_cmd = None
+
+        if 'bulk_status_cmd_output' in self.config:
+            self.bulk_status_cmd_output = self.config['bulk_status_cmd_output']
+        else:
+            self.bulk_status_cmd_output = '{job_id,[^ ]+} {status}'
+        if '{job_id' not in self.bulk_status_cmd_output or '{status' not in self.bulk_status_cmd_output:
+            raise ValueError(
+                f'Option bulk_status_cmd_output should have patterns for job_id and status, "{self.bulk_status_cmd_output}" specified.')
+
+        # status of jobs that are no longer queued or running
+        if 'finished_status' in self.config:
+            self.finished_status = self.config['finished_status']
+            if isinstance(self.finished_status, str):
+                self.finished_status = [self.finished_status]
+        else:
+            self.finished_status = ['C', 'E', 'F', 'X', 'COMPLETED', 'FAILED', 'CANCELLED', 'TIMEOUT',
+                'NODE_FAIL', 'OUT_OF_MEMORY', 'BOOT_FAIL', 'DEADLINE', 'PREEMPTED']
+
+        # optional command to query the exit code and stderr file of finished jobs, such as
+        # "sacct -X -n -P -d ' ' -o JobID,ExitCode,StdErr -j {job_ids_csv}", which are reported
+        # for tasks with jobs that finished before the tasks were started
+        if 'exit_status_cmd' in self.config:
+            self.exit_status_cmd = self.config['exit_status_cmd']
+        else:
+            self.exit_status_cmd = None
+
+        if 'exit_status_cmd_output' in self.config:
+            self.exit_status_cmd_output = self.config['exit_status_cmd_output']
+        else:
+            self.exit_status_cmd_output = '{job_id,[^ ]+} {exit_code,[^ ]+} {stderr}'
+        if '{job_id' not in self.exit_status_cmd_output:
+            raise ValueError(
+                f'Option exit_status_cmd_output should have a pattern for job_id, "{self.exit_status_cmd_output}" specified.')
+
+        # output of status_cmd (with stderr) for jobs that are no longer known to the
+        # scheduler, so that a failed status_cmd is not taken for a dead job if the
+        # scheduler or the remote host cannot be reached
+        if 'unknown_job_output' in self.config:
+            self.unknown_job_output = self.config['unknown_job_output']
+        else:
+            self.unknown_job_output = r'Unknown Job Id|Invalid job id specified|do not exist|is not found'
+        try:
+            self._unknown_job = re.compile(self.unknown_job_output, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f'Invalid unknown_job_output "{self.unknown_job_output}" for queue {self.alias}: {e}')
+
+        # optional command to kill multiple jobs, with job_ids split into chunks
+        # so that the command is no longer than max_cmd_length
+        if 'bulk_kill_cmd' in self.config:
+            self.bulk_kill_cmd = self.config['bulk_kill_cmd']
+        else:
+            self.bulk_kill_cmd = None
+
+        if 'max_cmd_length' in self.config:
+            self.max_cmd_length = int(self.config['max_cmd_length'])
+        else:
+            self.max_cmd_length = 65536
+
+        # status of jobs are cached for status_cache_ttl seconds
+        if 'status_cache_ttl' in self.config:
+            self.status_cache_ttl = self.config['status_cache_ttl']
+        else:
+            self.status_cache_ttl = self.status_check_interval
+
+        # without bulk_status_cmd or events_cmd, jobs of submitted tasks are checked
+        # with status_cmd, one command per job, at every status check only if
+        # poll_status_cmd is set, because the cost grows with the number of jobs
+        if 'poll_status_cmd' in self.config:
+            self.poll_status_cmd = bool(self.config['poll_status_cmd'])
+        else:
+            self.poll_status_cmd = False
+
+        # status of jobs can be shared by processes that query the same queue through
+        # status_cache_file, such as ~/.sos/pbs_status/{alias}.json, and status younger
+        # than status_cache_ttl + status_cache_stale seconds is returned while it is
+        # refreshed in the background
+        if 'status_cache_file' in self.config:
+            self.status_cache_file = self.config['status_cache_file']
+        else:
+            self.status_cache_file = None
+
+        if 'status_cache_stale' in self.config:
+            self.status_cache_stale = expand_time(self.config['status_cache_stale'])
+        else:
+            self.status_cache_stale = 0
+
+    def _init_submission(self):
+        if 'submit_cmd_output' not in self.config:
+            self.submit_cmd_output = '{job_id}'
+        else:
+            self.submit_cmd_output = self.config['submit_cmd_output']
+        #
+        if not '{job_id}' in self.submit_cmd_output:
+            raise ValueError(
+                f'Option submit_cmd_output should have at least a pattern for job_id, "{self.submit_cmd_output}" specified.')
+
+        # number of tasks that are prepared and submitted concurrently
+        if 'submit_workers' in self.config:
+            self.submit_workers = max(int(self.config['submit_workers']), 1)
+        else:
+            self.submit_workers = 1
+
+        # failed submissions are retried submit_retries times, with an interval that
+        # starts at submit_retry_interval seconds and doubles after each retry
+        if 'submit_retries' in self.config:
+            self.submit_retries = int(self.config['submit_retries'])
+        else:
+            self.submit_retries = 3
+
+        if 'submit_retry_interval' in self.config:
+            self.submit_retry_interval = expand_time(self.config['submit_retry_interval'])
+        else:
+            self.submit_retry_interval = 10
+
+        # only transient errors are retried, that is, failures of the connection to the
+        # remote host (exit code 255 of ssh) and errors of submit_cmd (in its stderr)
+        # that match transient_error_output
+        if 'transient_error_output' in self.config:
+            self.transient_error_output = self.config['transient_error_output']
+        else:
+            self.transient_error_output = TRANSIENT_ERROR_OUTPUT
+        try:
+            self._transient_error = re.compile(self.transient_error_output, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f'Invalid transient_error_output "{self.transient_error_output}" for queue {self.alias}: {e}')
+
+        # a job that might have been submitted before the connection to the remote host
+        # was lost is looked up by its name with find_job_cmd, which prints the ids of
+        # queued and running jobs named {job_name}, before it is submitted again
+        if 'find_job_cmd' in self.config:
+            self.find_job_cmd = self.config['find_job_cmd']
+        elif self.scheduler in FIND_JOB_CMDS:
+            self.find_job_cmd = FIND_JOB_CMDS[self.scheduler]
+        else:
+            self.find_job_cmd = None
+
+        # tasks with the same runtime options share a job script named after its content,
+        # with task and job_name replaced by environment variable SOS_TASK, which should
+        # be passed to the job by submit_cmd (e.g. qsub -v SOS_TASK={task} -N {job_name}).
+        # Because schedulers do not expand variables in directives (e.g. #PBS -N), tasks
+        # are submitted with their own scripts if directives of job_template use task,
+        # job_name or job_file, which should be passed as options of submit_cmd instead
+        if 'shared_job_script' in self.config:
+            self.shared_job_script = bool(self.config['shared_job_script'])
+        else:
+            self.shared_job_script = False
+        if self.shared_job_script and 'SOS_TASK' not in self.submit_cmd:
+            raise ValueError(f'Option shared_job_script requires submit_cmd to pass {{task}} as environment variable SOS_TASK for queue {self.alias}')
+
+        # name of the cluster of a queue with multiple clusters, which is saved
+        # with job ids so that tasks can be traced back to the cluster
+        if 'cluster' in self.config:
+            self.cluster = self.config['cluster']
+        else:
+            self.cluster = None
+
+        # command to send multiple task files to the remote host in one transfer
+        if 'send_task_files_cmd' in self.config:
+            self.send_task_files_cmd = self.config['send_task_files_cmd']
+        else:
+            self.send_task_files_cmd = 'ssh -q {address} -p {port} "[ -d ~/.sos/tasks ] || mkdir -p ~/.sos/tasks" && ' + \
+                'rsync -a --no-g -e "ssh -p {port}" --files-from="{file_list}" "{task_dir}" {address}:.sos/tasks/'
+
+    def _init_recording(self):
+        # time spent in each phase of task submission is saved to timing_file, with
+        # {alias} and {run_id} replaced by the queue and the id of the workflow run,
+        # which is ~/.sos/pbs_timing/{alias}_{run_id}.json if timing_file is true.
+        # Timing is not saved by default because a file is written for every run
+        if 'timing_file' in self.config and self.config['timing_file']:
+            self.timing_file = self.config['timing_file']
+            if self.timing_file is True:
+                self.timing_file = os.path.join('~', '.sos', 'pbs_timing', '{alias}_{run_id}.json')
+        else:
+            self.timing_file = None
+
+        # calls to the engine and interactions with the remote host are recorded
+        # to trace_file, which can be replayed without the remote host, with {alias}
+        # and {pid} replaced by the queue and the id of the process. Each process
+        # writes its own trace, so _{pid} is added to trace_file if it has no {pid}
+        if 'trace_file' in self.config:
+            self.trace_file = self.config['trace_file']
+        else:
+            self.trace_file = None
+
+        # only the runtime options and steps of tasks are recorded to trace_file,
+        # unless trace_task_files is set, in which case complete task files, with
+        # the commands and variables of tasks, are recorded
+        if 'trace_task_files' in self.config:
+            self.trace_task_files = bool(self.config['trace_task_files'])
+        else:
+            self.trace_task_files = False
+
+    def _init_output(self):
+        # files with stdout and stderr of jobs on the remote host, which should match
+        # the files used by job_template (e.g. #PBS -o), interpolated with task and
+        # the job id of the task (e.g. {job_id}, or {bundle} for bundled tasks)
+        if 'stdout_file' in self.config:
+            self.stdout_file = self.config['stdout_file']
+        else:
+            self.stdout_file = '~/.sos/tasks/{task}.out'
+
+        if 'stderr_file' in self.config:
+            self.stderr_file = self.config['stderr_file']
+        else:
+            self.stderr_file = '~/.sos/tasks/{task}.err'
+
+        # maximum number of new bytes of each file that are read by tail_tasks at a time
+        if 'max_tail_bytes' in self.config:
+            self.max_tail_bytes = expand_size(self.config['max_tail_bytes'])
+        else:
+            self.max_tail_bytes = 65536
+
+    def execute_tasks(self, task_ids, depends=None, priorities=None):
         #
+        if self._trace:
+            self._trace.record_call('execute_tasks', task_ids, **({'depends': depends} if depends else {}),
+                **({'priorities': priorities} if priorities else {}))
+        if depends:
+            self.add_dependencies(depends)
+        if priorities:
+            self.set_priorities(priorities)
         if not super(PBS_TaskEngine, self).execute_tasks(task_ids):
             return False
+        return self._submit_tasks(task_ids)
+
+    def submit_tasks(self, task_ids):
+        '''Submit tasks that have been prepared by the agent, for engines that
+        prepare tasks and submit them with PBS_TaskEngine'''
+        return self._submit_tasks(task_ids)
 
+    def mark_ready(self):
+        '''Mark the engine as ready without starting its thread, which checks the
+        status of all tasks, for engines that are used by other engines or by
+        benchmark/replay_trace.py'''
+        self.engine_ready.set()
+
+    def _submit_tasks(self, task_ids):
+        # submit tasks that have been prepared by the agent, with upstream
+        # tasks submitted before their downstream tasks
+        self._check_timing_run()
+        journaled = []
         try:
-            for task_id in task_ids:
-                if not self._prepare_script(task_id):
-                    return False
-            return True
+            with self._timer.batch(task_ids) as record:
+                pending = self._resume_submission(task_ids)
+                # tasks stay in the journal if sos is terminated during the submission
+                self._job_ids.begin_submission(pending, self.alias)
+                journaled = pending
+                if len(pending) > 1 and (self.order_tasks or any(x in self._priorities for x in pending)):
+                    pending = self._order_tasks(pending)
+                # no new submission is started after the first failure
+                for group in self._dependency_groups(pending):
+                    try:
+                        if not self._submit_group(group):
+                            break
+                    except Exception as e:
+                        env.logger.error(e)
+                        break
+                failed = [x for x in pending if x not in self._batch_submitted]
+                if failed:
+                    # submitted tasks are kept, and the others are reported failed by query_tasks
+                    env.logger.warning(f'{len(failed)} of {len(task_ids)} tasks failed to be submitted to {self.alias}')
+                    self._job_ids.fail_submission(failed)
+                return len(failed) < len(task_ids)
         except Exception as e:
             env.logger.error(e)
             return False
+        finally:
+            if journaled:
+                self._job_ids.end_submission(journaled)
+            self._batch_submitted.clear()
+            for task_id in task_ids:
+                self._depends.pop(task_id, None)
+                self._priorities.pop(task_id, None)
+                self._batch_priority.pop(task_id, None)
+                self._task_runtimes.pop(task_id, None)
+                self._task_steps.pop(task_id, None)
+                self._rightsized.pop(task_id, None)
+            env.logger.debug(f'Timing of submission of {len(task_ids)} tasks to {self.alias}: {json.dumps(record)}')
+            if self.timing_file and time.time() - self._timer_save_time > self.status_check_interval:
+                self._save_timing()
 
-    def _prepare_script(self, task_id):
-        # read the task file and look for runtime info
-        #
-        params = TaskFile(task_id).params
-        sos_dict = params.sos_dict
+    def _resume_submission(self, task_ids):
+        # tasks of an interrupted submission to this queue are not submitted again
+        # if their jobs are still queued or running, or if jobs named after tasks that
+        # were being submitted are found by find_job_cmd. Returns tasks to be submitted
+        journal = {x: y for x, y in self._job_ids.get_journal(task_ids).items() if y['queue'] == self.alias}
+        if not journal:
+            return task_ids
+        found = {}
+        for task_id in [x for x, y in journal.items() if y['state'] == 'submitting']:
+            job_id = self._find_job(task_id) if self.find_job_cmd else None
+            if job_id:
+                found[task_id] = {'job_id': job_id}
+        unknown = [x for x, y in journal.items() if y['state'] == 'submitting' and x not in found]
+        if unknown:
+            env.logger.warning(f'Submitting {len(unknown)} tasks that might have been submitted to {self.alias} '
+                f'by an interrupted submission: {", ".join(unknown)}')
+        submitted = [x for x, y in journal.items() if y['state'] == 'submitted']
+        alive = set(submitted) - set(self._dead_tasks(submitted))
+        if not alive and not found:
+            return task_ids
+        job_ids = self._get_job_ids(list(alive))
+        # tasks are taken as submitted by sos if their .sh and .job_id files are newer
+        # than their .task files, which have been written again by prepare_task, and
+        # by _submitted_tasks if their jobs are submitted after the .task files
+        for task_id in alive:
+            job_ids[task_id]['submit_time'] = time.time()
+        self._job_ids.set_many({x: job_ids[x] for x in alive}, self.alias)
+        for task_id, job_id in found.items():
+            self._write_job_id(task_id, job_id)
+            job_ids[task_id] = job_id
+        task_files = []
+        for task_id in [x for x in task_ids if x in job_ids]:
+            self._known_jobs[task_id] = job_ids[task_id]['job_id']
+            env.logger.info(f'{task_id} ``already submitted`` to {self.alias} with job id {job_ids[task_id]["job_id"]}')
+            job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.sh')
+            if os.path.isfile(job_file):
+                os.utime(job_file)
+                task_files.append(job_file)
+            task_files.append(self._job_ids.export_file(task_id))
+        # job id files might not have been sent before the interruption, and job
+        # scripts are sent again so that they are newer than the task files
+        self._send_task_files(task_files)
+        self._job_ids.end_submission(list(job_ids))
+        return [x for x in task_ids if x not in job_ids]
+
+    def _get_steps(self, task_ids):
+        # return task_id -> step of tasks, which is the step name of the task with the
+        # workflow file that is being executed, so that steps of different workflows
+        # with the same name are not mixed
+        for task_id in task_ids:
+            if task_id not in self._task_steps:
+                try:
+                    self._load_params([task_id])
+                except Exception as e:
+                    env.logger.debug(f'Failed to get step of task {task_id}: {e}')
+                    self._task_steps[task_id] = None
+        return {x: self._task_steps[x] for x in task_ids if self._task_steps[x]}
+
+    def _submit_group(self, task_ids):
+        if self.pilots:
+            return self._enqueue_tasks(task_ids)
+        if self.array_submit_cmd and len(task_ids) > 1:
+            return self._prepare_arrays(task_ids)
+        if self.bundle_job_template and len(task_ids) > 1:
+            return self._prepare_bundles(task_ids)
+        if len(task_ids) > 1:
+            return self._prepare_scripts(task_ids)
+        for task_id in task_ids:
+            if not self._prepare_script(task_id):
+                return False
+        return True
+
+    def _timing_file(self):
+        return os.path.expanduser(self.timing_file.format(alias=re.sub(r'[^\w.-]', '_', self.alias),
+            run_id=self._timer_run_id))
+
+    def _trace_file(self):
+        trace_file = self.trace_file
+        if '{pid}' not in trace_file:
+            trace_file = '{}_{{pid}}{}'.format(*os.path.splitext(trace_file))
+        return os.path.expanduser(trace_file.format(alias=re.sub(r'[^\w.-]', '_', self.alias), pid=os.getpid()))
+
+    def _check_timing_run(self):
+        # timing of each workflow run is saved to a separate file
+        run_id = env.config.get('master_id', None) or str(os.getpid())
+        if run_id != self._timer_run_id:
+            if self._timer_run_id is not None and self.timing_file:
+                self._save_timing()
+                self._timer.reset()
+            self._timer_run_id = run_id
 
+    def _save_timing(self):
+        if not self._timer.phases:
+            return
+        try:
+            self._timer.save(self._timing_file())
+            self._timer_save_time = time.time()
+        except Exception as e:
+            env.logger.warning(f'Failed to save timing of task submission to {self._timing_file()}: {e}')
+
+    def _load_params(self, task_ids):
+        # load the params of tasks and keep both their runtime info and their step,
+        # so that the params are loaded only once during the submission of tasks.
+        # sos does not return the params that the agent loads in prepare_task
+        script = env.config.get('script', None)
+        script = os.path.abspath(os.path.expanduser(script)) if script else ''
+        with self._timer.tasks(task_ids), self._timer.phase('load_params'):
+            for task_id in task_ids:
+                sos_dict = TaskFile(task_id).params.sos_dict
+                self._task_runtimes[task_id] = sos_dict['_runtime']
+                step_name = sos_dict.get('step_name', None)
+                self._task_steps[task_id] = f'{script}:{step_name}' if step_name else None
+
+    def _read_runtimes(self, task_ids):
+        # runtime info of tasks from their params
+        missing = [x for x in task_ids if x not in self._task_runtimes]
+        if missing:
+            self._load_params(missing)
+        return [self._task_runtimes[x] for x in task_ids]
+
+    def _get_runtimes(self, task_ids):
+        return [self._make_runtime(x, y) for x, y in zip(task_ids, self._rightsize(task_ids, self._read_runtimes(task_ids)))]
+
+    def _make_runtime(self, task_id, task_runtime):
         # for this task, we will need walltime, nodes, cores, mem
         # however, these could be fixed in the job template and we do not need to have them all in the runtime
-        runtime = self.config
+        runtime = dict(self.config)
         # we also use saved verbosity and sig_mode because the current sig_mode might have been changed
         # (e.g. in Jupyter) after the job is saved.
-        runtime.update({x:sos_dict['_runtime'][x] for x in ('nodes', 'cores', 'mem', 'walltime', 'cur_dir', 'home_dir', 'verbosity', 'sig_mode', 'run_mode') if x in sos_dict['_runtime']})
-        if 'name' in sos_dict['_runtime']:
+        runtime.update({x:task_runtime[x] for x in self.runtime_keys if x in task_runtime})
+        if 'name' in task_runtime:
             env.logger.warning("Runtime option name is deprecated. Please use tags to keep track of task names.")
         runtime['task'] = task_id
         # this is also deprecated
@@ -77,183 +650,819 @@ class PBS_TaskEngine(TaskEngine):
             runtime['cores'] = 1
         # for backward compatibility
         runtime['job_file'] = f'~/.sos/tasks/{task_id}.sh'
+        runtime['depend'] = self._depend_option([task_id]) if task_id in self._depends else ''
+        runtime['priority'] = self._batch_priority.get(task_id, self.default_priority)
+        return runtime
 
-        # let us first prepare a task file
+    def _submit_job(self, cmd, job_name, name='submit_cmd_output', num_jobs=1):
+        # submit num_jobs jobs (more than one for a job array) named job_name with cmd, and
+        # return the job id and other variables extracted from the output of cmd with parser
+        # name. Submission waits if there are too many jobs in the queue, and is retried with
+        # exponential backoff on transient errors
+        if self.events_cmd and self._events_cursor is None:
+            # events of jobs are queried from the first submission if there is no saved cursor
+            self._events_cursor = self._job_ids.get_cursor(self.alias)
+            if self._events_cursor is None:
+                self._events_cursor = time.time()
+                self._job_ids.set_cursor(self.alias, self._events_cursor)
+        # stderr of cmd is added to its output if it fails, so that errors can be classified,
+        # and its exit code is changed to 1 so that it is not taken for a failure of ssh
+        err_file = f'~/.sos/tasks/{job_name}.submit_err'
+        submit_cmd = f'if ({cmd}) 2>{err_file}; then rm -f {err_file}; else cat {err_file}; rm -f {err_file}; exit 1; fi'
+        interval = self.submit_retry_interval
+        lost = False
+        for attempt in range(self.submit_retries + 1):
+            if lost and self.find_job_cmd:
+                job_id = self._find_job(job_name)
+                if job_id:
+                    env.logger.info(f'Job {job_id} named {job_name} was submitted to {self.alias} before the connection was lost')
+                    return {'job_id': job_id}
+            self._reserve_slots(num_jobs)
+            try:
+                self._timer.count('submit_cmd')
+                with self._timer.phase('submit'):
+                    output = self.agent.check_output(submit_cmd).strip()
+            except Exception as e:
+                self._release_slots(num_jobs)
+                error = self._submit_error(e)
+                if isinstance(e, subprocess.CalledProcessError) and e.output:
+                    e = f'{e} {e.output.decode(errors="replace").strip()}'
+                if error is None or attempt == self.submit_retries:
+                    raise RuntimeError(e)
+                lost = error == 'connection'
+                env.logger.warning(f'Failed to submit job with command "{cmd}", retry in {interval} seconds: {e}')
+                time.sleep(interval)
+                interval *= 2
+                # the failure might be caused by a limit on the number of queued jobs
+                self._queued_count_time = None
+                continue
+            if not output:
+                raise RuntimeError(f'No output returned by command {cmd}')
+            return self._extract_job_id(output, name)
+
+    def _submit_error(self, e):
+        # return "connection" if a submission failed because the connection to the remote
+        # host was lost, in which case the job might have been submitted, "transient" for
+        # other errors that are worth retrying, and None for errors of the submission
+        if isinstance(e, subprocess.TimeoutExpired):
+            return 'connection'
+        if not isinstance(e, subprocess.CalledProcessError):
+            return None
+        if e.returncode == 255 and not self._local_agent:
+            return 'connection'
+        if e.output and self._transient_error.search(e.output.decode(errors='replace')):
+            return 'transient'
+        return None
+
+    def _find_job(self, job_name):
+        # return the id of a queued or running job named job_name, or None
+        cmd = self._templates['find_job_cmd'].render({'job_name': job_name})
         try:
-            job_text = cfg_interpolate(self.job_template, runtime)
+            output = self.agent.check_output(cmd)
         except Exception as e:
-            raise ValueError(f'Failed to generate job file for task {task_id}: {e}')
+            env.logger.debug(f'Failed to find job {job_name} on {self.alias} with command "{cmd}": {e}')
+            return None
+        job_ids = output.split()
+        return job_ids[-1] if job_ids else None
 
-        # now we need to write a job file
-        job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.sh')
-        # do not translate newline under windows because the script will be executed
-        # under linux/mac
-        with open(job_file, 'w', newline='') as job:
-            job.write(job_text)
+    def _extract_job_id(self, cmd_output, name='submit_cmd_output'):
+        # extract job_id and other variables from the output of submit command
+        parser = self._parsers[name]
+        with self._timer.phase('extract_job_id'):
+            res = parser.parse(cmd_output.strip())
+        if not res or res.get('job_id', None) is None:
+            raise RuntimeError(f'Failed to extract job_id from "{cmd_output.strip()}" using pattern "{parser.text}"')
+        return res
 
-        # then copy the job file to remote host if necessary
-        self.agent.send_task_file(job_file)
+    def _write_job_id(self, task_id, job_id):
+        # save job id to the job id store, and export it to a job_id file, which
+        # will be sent to the remote host for tools that read these files
+        if self.cluster:
+            job_id['cluster'] = self.cluster
+        # resources requested by tasks that are reduced for the job
+        if task_id in self._rightsized:
+            job_id.update(self._rightsized[task_id])
+            self._reduced_tasks.add(task_id)
+        # step of the task, with which its resource usage is saved once it completes
+        job_id.update({'step': x for x in self._get_steps([task_id]).values()})
+        job_id['submit_time'] = time.time()
+        self._job_ids.set(task_id, job_id, self.alias)
+        self._known_jobs[task_id] = job_id['job_id']
+        self._batch_submitted.add(task_id)
+        return self._job_ids.export_file(task_id)
 
+    def _send_task_files(self, task_files):
+        # send multiple files under ~/.sos/tasks to the remote host in one transfer
+        if not task_files:
+            return
+        with self._timer.phase('send_task_file'):
+            self._timer.count('bytes_sent', sum(os.path.getsize(x) for x in task_files))
+            self._send_files(task_files)
+
+    def _send_files(self, task_files):
+        task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        if self._local_agent:
+            # on the same file system, this is just a copy, and files in
+            # sub-directories of ~/.sos/tasks are already in place
+            for task_file in task_files:
+                if os.path.dirname(task_file) == task_dir:
+                    self._timer.count('send_task_file')
+                    self.agent.send_task_file(task_file)
+            return
+        if len(task_files) == 1 and os.path.dirname(task_files[0]) == task_dir:
+            self._timer.count('send_task_file')
+            self.agent.send_task_file(task_files[0])
+            return
+        with tempfile.NamedTemporaryFile('w', prefix='sos_pbs_', suffix='.files', delete=False) as file_list:
+            file_list.write('\n'.join(os.path.relpath(x, task_dir) for x in task_files) + '\n')
+        try:
+            send_cmd = self._templates['send_task_files_cmd'].render({'address': self.agent.address,
+                'port': self.agent.port, 'task_dir': task_dir, 'file_list': file_list.name})
+            env.logger.debug(f'Sending {len(task_files)} task files to {self.alias}: {send_cmd}')
+            self._timer.count('send_task_files_cmd')
+            try:
+                self._run_local(send_cmd)
+            except subprocess.CalledProcessError as e:
+                raise RuntimeError(f'Failed to copy {len(task_files)} task files to {self.alias} using command {send_cmd}: {e}')
+        finally:
+            os.remove(file_list.name)
+
+    def _run_local(self, cmd):
+        if self._trace:
+            self._trace.check_call(cmd, self._local_cmd)
+        else:
+            self._local_cmd(cmd)
+
+    def _write_job_scripts(self, task_ids):
+        runtimes = self._get_runtimes(task_ids)
+        if self.shared_job_script:
+            job_files = self._write_shared_job_scripts(task_ids, runtimes)
+            if job_files is not None:
+                return runtimes, job_files
+
+        # let us first prepare the job files of all tasks in one pass
+        try:
+            with self._timer.tasks(task_ids), self._timer.phase('interpolate'):
+                job_texts = self._templates['job_template'].render_many(runtimes)
+        except Exception as e:
+            raise ValueError(f'Failed to generate job file: {e}')
+
+        job_files = []
+        for task_id, job_text in zip(task_ids, job_texts):
+            # now we need to write a job file
+            job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.sh')
+            # do not translate newline under windows because the script will be executed
+            # under linux/mac
+            with self._timer.tasks([task_id]), self._timer.phase('write_job_file'):
+                with open(job_file, 'w', newline='') as job:
+                    job.write(job_text)
+            job_files.append(job_file)
+        return runtimes, job_files
+
+    def _write_shared_job_scripts(self, task_ids, runtimes):
+        # render job_template once for tasks with the same runtime options, and return
+        # scripts that have not been written and sent by the engine, or None if the
+        # template uses variables of tasks in directives
+        job_texts = {}
+        keys = []
+        for task_id, runtime in zip(task_ids, runtimes):
+            # braces of ${SOS_TASK} would be interpolated again, so a placeholder is used
+            shared = dict(runtime, task='__SOS_TASK__', job_name='__SOS_TASK__', job_file='__SOS_JOB_FILE__')
+            key = repr(sorted(shared.items()))
+            keys.append(key)
+            if key in job_texts:
+                continue
+            try:
+                with self._timer.tasks([task_id]), self._timer.phase('interpolate'):
+                    job_text = self._templates['job_template'].render(shared)
+            except Exception as e:
+                raise ValueError(f'Failed to generate job file: {e}')
+            if any(line.startswith('#') and not line.startswith('#!') and ('__SOS_TASK__' in line or '__SOS_JOB_FILE__' in line)
+                    for line in job_text.split('\n')):
+                env.logger.warning(f'Tasks of {self.alias} are submitted with their own job scripts because directives of job_template use task, job_name or job_file')
+                self.shared_job_script = False
+                return None
+            job_texts[key] = job_text.replace('__SOS_TASK__', '${SOS_TASK}').replace('__SOS_JOB_FILE__', '$0')
+        job_files = []
+        for task_id, runtime, key in zip(task_ids, runtimes, keys):
+            name = 'job_' + hashlib.md5(job_texts[key].encode()).hexdigest()[:16]
+            runtime['job_file'] = f'~/.sos/tasks/{name}.sh'
+            if name in self._shared_scripts:
+                continue
+            job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', name + '.sh')
+            with self._timer.tasks([task_id]), self._timer.phase('write_job_file'):
+                with open(job_file, 'w', newline='') as job:
+                    job.write(job_texts[key])
+            self._shared_scripts.add(name)
+            job_files.append(job_file)
+        return job_files
+
+    def _submit_job_script(self, task_id, runtime):
+        # submit a job script that has been sent to the remote host and return
+        # the job_id file, which should be sent to the remote host afterwards
+        with self._timer.tasks([task_id]):
+            return self._submit_task_script(task_id, runtime)
+
+    def _submit_task_script(self, task_id, runtime):
         if runtime['run_mode'] == 'dryrun':
             try:
-                cmd = f'bash ~/.sos/tasks/{task_id}.sh'
+                if self.shared_job_script:
+                    cmd = f'SOS_TASK={task_id} bash {runtime["job_file"]}'
+                else:
+                    cmd = f'bash ~/.sos/tasks/{task_id}.sh'
                 print(self.agent.check_output(cmd))
             except Exception as e:
                 raise RuntimeError(f'Failed to submit task {task_id}: {e}')
-        else:
-            #
-            # now we need to figure out a command to submit the task
+            return None
+        #
+        # now we need to figure out a command to submit the task
+        try:
+            with self._timer.phase('interpolate'):
+                cmd = self._templates['submit_cmd'].render(runtime)
+        except Exception as e:
+            raise ValueError(f'Failed to generate job submission command from template "{self.submit_cmd}": {e}')
+        env.logger.debug(f'submit {task_id}: {cmd}')
+        try:
+            job_id = self._submit_job(cmd, runtime['job_name'])
+            job_id_file = self._write_job_id(task_id, job_id)
+            # output job id to stdout
+            env.logger.info(f'{task_id} ``submitted`` to {self.alias} with job id {job_id["job_id"]}')
+            return job_id_file
+        except Exception as e:
+            raise RuntimeError(f'Failed to submit task {task_id}: {e}')
+
+    def _prepare_script(self, task_id):
+        (runtime,), job_files = self._write_job_scripts([task_id])
+
+        # then copy the job file to remote host if necessary
+        with self._timer.tasks([task_id]):
+            self._send_task_files(job_files)
+
+        job_id_file = self._submit_job_script(task_id, runtime)
+        if job_id_file is None:
+            return
+        # Send job id files to remote host so that
+        # 1. the job could be properly killed (with job_id) on remote host (not remotely)
+        # 2. the job status could be perperly probed in case the job was not properly submitted (#911)
+        with self._timer.tasks([task_id]):
+            self._send_task_files([job_id_file])
+        return True
+
+    def _prepare_scripts(self, task_ids):
+        # write job scripts of all tasks and send them to the remote host in one transfer
+        runtimes, job_files = self._write_job_scripts(task_ids)
+        runtimes = dict(zip(task_ids, runtimes))
+        self._send_task_files(job_files)
+
+        # submit tasks with at most submit_workers tasks in flight,
+        # and stop submitting new tasks after the first failure
+        failed = []
+        job_id_files = []
+        remaining = iter(task_ids)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.submit_workers) as executor:
+                submitting = {}
+                while True:
+                    while not failed and len(submitting) < self.submit_workers:
+                        task_id = next(remaining, None)
+                        if task_id is None:
+                            break
+                        submitting[executor.submit(self._submit_job_script, task_id, runtimes[task_id])] = task_id
+                    if not submitting:
+                        break
+                    done, _ = concurrent.futures.wait(submitting, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        task_id = submitting.pop(future)
+                        try:
+                            job_id_file = future.result()
+                            if job_id_file is None:
+                                failed.append(task_id)
+                            else:
+                                job_id_files.append(job_id_file)
+                        except Exception as e:
+                            env.logger.error(e)
+                            failed.append(task_id)
+        finally:
+            # send job id files of submitted tasks, even if some tasks failed to be submitted,
+            # so that they could be properly killed and probed on the remote host (#911)
+            self._send_task_files(job_id_files)
+        if failed:
+            skipped = list(remaining)
+            if skipped:
+                env.logger.warning(f'{len(skipped)} tasks are not submitted after failed submission of task {failed[0]}')
+            return False
+        return True
+
+    def _get_job_id(self, task_id):
+        return self._job_ids.get(task_id)
+
+    def _get_job_ids(self, task_ids):
+        return self._job_ids.get_many(task_ids)
+
+    def _bulk_commands(self, name, items, key='job_ids', runtime={}):
+        # yield chunks of items (e.g. job ids) and commands generated from template name,
+        # with each command no longer than max_cmd_length. Items are separated by spaces
+        # in variable key, and by commas in variable key_csv
+        template = self._templates[name]
+
+        def render(chunk):
+            return template.render(dict(runtime, **{key: ' '.join(chunk), key + '_csv': ','.join(chunk)}))
+
+        if key not in template.text:
+            yield items, render([])
+            return
+        try:
+            cmd_length = len(render([]))
+        except Exception as e:
+            raise ValueError(f'Failed to generate command from template "{template.text}": {e}')
+        # items could be used more than once in the template
+        repeat = template.text.count(key)
+        chunk = []
+        length = cmd_length
+        for item in items:
+            if chunk and length + (len(item) + 1) * repeat > self.max_cmd_length:
+                yield chunk, render(chunk)
+                chunk = []
+                length = cmd_length
+            chunk.append(item)
+            length += (len(item) + 1) * repeat
+        if chunk:
+            yield chunk, render(chunk)
+
+    def _bulk_kill_jobs(self, job_ids):
+        # kill jobs of tasks (task_id -> job_id) with bulk_kill_cmd and return
+        # the output of the command that mentions the job of each task
+        tasks = {job_id['job_id']: task_id for task_id, job_id in job_ids.items()}
+        res = {}
+        for chunk, cmd in self._bulk_commands('bulk_kill_cmd', list(tasks.keys())):
+            env.logger.debug(f'Running {cmd}')
+            self._timer.count('bulk_kill_cmd')
             try:
-                cmd = cfg_interpolate(self.submit_cmd, runtime)
+                output = self.agent.check_output(cmd)
+            except subprocess.CalledProcessError as e:
+                # commands such as qdel exit with an error if any of the jobs cannot be
+                # killed, so the output is still checked for the jobs of each task
+                env.logger.debug(
+                    f'Failed to kill some of {len(chunk)} jobs from template "{self.bulk_kill_cmd}": {e}')
+                if not e.output:
+                    continue
+                output = e.output.decode(errors='replace') if isinstance(e.output, bytes) else e.output
             except Exception as e:
-                raise ValueError(f'Failed to generate job submission command from template "{self.submit_cmd}": {e}')
-            env.logger.debug(f'submit {task_id}: {cmd}')
+                env.logger.debug(
+                    f'Failed to kill {len(chunk)} jobs from template "{self.bulk_kill_cmd}": {e}')
+                continue
+            for job_id in chunk:
+                pattern = re.compile(r'(?<![\w\[])' + re.escape(job_id) + r'(?![\w\[])')
+                res[tasks[job_id]] = ' '.join(x.strip() for x in output.splitlines() if pattern.search(x))
+        return res
+
+    def _get_job_status(self, task_ids):
+        # return a dictionary of job_id -> status for all jobs known to the engine
+        # using a single bulk_status_cmd call, cached for status_cache_ttl seconds
+        for task_id, job_id in self._get_job_ids([x for x in task_ids if x not in self._known_jobs]).items():
+            self._known_jobs[task_id] = job_id['job_id']
+        if self.events_cmd:
+            return self._get_job_events(task_ids)
+        # jobs submitted after the last query are not in the cache
+        if self._job_status_time is not None and time.time() - self._job_status_time < self.status_cache_ttl \
+            and all(self._known_jobs[x] in self._queried_jobs for x in task_ids if x in self._known_jobs):
+            return self._job_status
+        if not self._known_jobs:
+            return self._job_status
+        job_ids = sorted(set(self._known_jobs.values()))
+        if self._status_cache:
+            # status might have been queried by another process
+            self._job_status_time, self._job_status = self._status_cache.lookup('bulk_status_cmd',
+                job_ids, self._query_bulk_status)
+        else:
+            self._job_status_time, self._job_status = time.time(), self._query_bulk_status(job_ids)
+        self._queried_jobs = set(job_ids)
+        return self._job_status
+
+    def _query_bulk_status(self, job_ids):
+        lines = []
+        for chunk, cmd in self._bulk_commands('bulk_status_cmd', job_ids):
+            env.logger.debug(f'Query status of {len(chunk)} jobs: {cmd}')
+            self._timer.count('bulk_status_cmd')
             try:
-                try:
-                    cmd_output = self.agent.check_output(cmd).strip()
-                except Exception as e:
-                    raise RuntimeError(f'Failed to submit task {task_id}: {e}')
+                output = self.agent.check_output(cmd)
+            except subprocess.CalledProcessError as e:
+                # commands such as qstat exit with an error if any of the jobs is unknown,
+                # but still list the other jobs, so the output is still checked for the
+                # status of jobs, unless the command fails without output
+                if not e.output:
+                    raise
+                output = e.output.decode(errors='replace') if isinstance(e.output, bytes) else e.output
+            # normalize white spaces so that columns can be matched by bulk_status_cmd_output,
+            # skipping messages about unknown jobs if stderr is redirected to stdout
+            lines.extend(' '.join(line.split()) for line in output.splitlines()
+                if line.strip() and not self._unknown_job.search(line))
+        res = self._parsers['bulk_status_cmd_output'].extract(lines)
+        return self._array_status({job_id: status for job_id, status in zip(res['job_id'], res['status'])
+            if job_id is not None}, job_ids)
+
+    def _query_job_status(self, job_id, task_id):
+        if self.events_cmd:
+            job_status = self._get_job_status([task_id])
+            # a job without any status change since its submission is still queued
+            status = job_status.get(job_id['job_id'], 'queued')
+            if status in self.finished_status:
+                raise RuntimeError(f'Job {job_id["job_id"]} has finished with status {status}')
+            return f'{job_id["job_id"]}\t{status}\n'
+        if self.bulk_status_cmd:
+            job_status = self._get_job_status([task_id])
+            if job_id['job_id'] not in job_status:
+                raise RuntimeError(f'Job {job_id["job_id"]} is not known to {self.alias}')
+            status = job_status[job_id['job_id']]
+            # finished jobs are listed by some schedulers for a while
+            if status in self.finished_status:
+                raise RuntimeError(f'Job {job_id["job_id"]} has finished with status {status}')
+            return f'{job_id["job_id"]}\t{status}\n'
+        # without a bulk status command, we query the job individually but
+        # still cache the result for status_cache_ttl seconds
+        if task_id in self._status_output and time.time() - self._status_output[task_id][0] < self.status_cache_ttl:
+            return self._status_output[task_id][1]
+        job_id.update({'task': task_id, 'verbosity': 1})
+        # stderr is kept so that unknown jobs can be told from failed queries
+        cmd = f'({self._templates["status_cmd"].render(job_id)}) 2>&1'
+
+        def query(job_ids):
+            self._timer.count('status_cmd')
+            return {job_id['job_id']: self.agent.check_output(cmd)}
+
+        if self._status_cache:
+            query_time, output = self._status_cache.lookup('status_cmd', [job_id['job_id']], query)
+        else:
+            query_time, output = time.time(), query([job_id['job_id']])
+        self._status_output[task_id] = (query_time, output[job_id['job_id']])
+        return self._status_output[task_id][1]
+
+    def last_job_status(self, job_ids):
+        '''Return job_id -> status of jobs from the last status query, with None
+        for jobs that have finished, which are no longer listed by bulk_status_cmd
+        or are forgotten after their tasks have finished. Jobs that have not been
+        queried are not returned'''
+        known = set(self._known_jobs.values())
+        res = {}
+        for job_id in job_ids:
+            if job_id in self._job_status:
+                res[job_id] = self._job_status[job_id]
+            elif job_id not in known or (not self.events_cmd and job_id in self._queried_jobs):
+                res[job_id] = None
+        return res
+
+    def _forget_jobs(self, task_ids):
+        # jobs of tasks that have finished are no longer queried, unless they are
+        # shared with other tasks, such as jobs of bundles
+        job_ids = set(self._known_jobs.pop(x) for x in task_ids if x in self._known_jobs)
+        for task_id in task_ids:
+            self._status_output.pop(task_id, None)
+        if not job_ids:
+            return
+        job_ids -= set(self._known_jobs.values())
+        self._queried_jobs -= job_ids
+        if self.events_cmd:
+            # status of jobs from events is kept until their tasks finish
+            for job_id in job_ids:
+                self._job_status.pop(job_id, None)
+
+    def _check_submitted_jobs(self, task_ids):
+        # query all submitted jobs in one call so that subsequent status
+        # checks are answered from the cache
+        if not (self.bulk_status_cmd or self.events_cmd) or not task_ids:
+            return
+        try:
+            self._get_job_status(task_ids)
+        except Exception as e:
+            env.logger.debug(f'Failed to query status of jobs on {self.alias}: {e}')
 
-                if not cmd_output:
-                    raise RuntimeError(f'Failed to submit task {task_id} with command {cmd}. No output returned.')
+    def _check_status(self, status):
+        # return task_id -> status for tasks with status (task_id -> status reported by
+        # sos) that is changed by the status of their submissions and jobs
+        pending = [x for x, y in status.items() if y == 'pending']
+        res = {x: 'failed' for x in self._failed_submissions(pending)}
+        res.update({x: 'submitted' for x in self._submitted_tasks([x for x in pending if x not in res])})
+        if self.bulk_status_cmd or self.events_cmd or self.poll_status_cmd:
+            res.update(self._reconcile_tasks(self._dead_tasks([x for x, y in status.items() if y == 'submitted' or
+                res.get(x, None) == 'submitted'])))
+        return res
 
-                if 'submit_cmd_output' not in self.config:
-                    submit_cmd_output = '{job_id}'
+    def _submitted_tasks(self, task_ids):
+        # sos only reports tasks with ~/.sos/tasks/<task>.sh and .job_id files as submitted,
+        # so tasks of array jobs, bundles and shared job scripts stay pending after their
+        # submission. They are taken as submitted if their jobs are submitted after the
+        # task files are written
+        if not task_ids:
+            return []
+        job_ids = self._get_job_ids(task_ids)
+        task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        res = []
+        for task_id in task_ids:
+            if task_id not in job_ids or 'submit_time' not in job_ids[task_id]:
+                continue
+            try:
+                if float(job_ids[task_id]['submit_time']) >= os.path.getmtime(os.path.join(task_dir, task_id + '.task')):
+                    res.append(task_id)
+            except OSError:
+                continue
+        return res
+
+    def _failed_submissions(self, task_ids):
+        # tasks that failed to be submitted to this queue
+        if not task_ids:
+            return []
+        journal = self._job_ids.get_journal(task_ids)
+        return [x for x in task_ids if x in journal and journal[x]['queue'] == self.alias and journal[x]['state'] == 'failed']
+
+    def _dead_tasks(self, task_ids):
+        # return tasks marked submitted by sos with jobs that are no longer queued or
+        # running. Jobs are only taken as dead if the scheduler is queried successfully
+        # and does not list them, so that tasks are checked again later if the scheduler
+        # or the remote host cannot be reached
+        if not task_ids:
+            return []
+        job_ids = self._get_job_ids(task_ids)
+        dead = [x for x in task_ids if x not in job_ids]
+        if self.bulk_status_cmd or self.events_cmd:
+            try:
+                job_status = self._get_job_status(task_ids)
+            except Exception as e:
+                env.logger.debug(f'Failed to query status of jobs on {self.alias}: {e}')
+                return dead
+            for task_id in task_ids:
+                if task_id not in job_ids:
+                    continue
+                # a job without any event since its submission is still queued
+                status = job_status.get(job_ids[task_id]['job_id'], 'queued' if self.events_cmd else None)
+                if status is None or status in self.finished_status:
+                    dead.append(task_id)
+            return [x for x in task_ids if x in dead]
+        for task_id in task_ids:
+            if task_id not in job_ids:
+                continue
+            try:
+                self._query_job_status(job_ids[task_id], task_id)
+            except subprocess.CalledProcessError as e:
+                if e.output and self._unknown_job.search(e.output.decode(errors='replace')):
+                    dead.append(task_id)
                 else:
-                    submit_cmd_output = self.config['submit_cmd_output']
-                #
-                if not '{job_id}' in submit_cmd_output:
-                    raise ValueError(
-                        f'Option submit_cmd_output should have at least a pattern for job_id, "{submit_cmd_output}" specified.')
-                #
-                # try to extract job_id from command output
-                # let us write an job_id file so that we can check status of tasks more easily
-                job_id_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.job_id')
-                with open(job_id_file, 'w') as job:
-                    res = extract_pattern(submit_cmd_output, [cmd_output.strip()])
-                    if 'job_id' not in res or len(res['job_id']) != 1 or res['job_id'][0] is None:
-                       raise RuntimeError(f'Failed to extract job_id from "{cmd_output.strip()}" using pattern "{submit_cmd_output}"')
-                    else:
-                        job_id = res['job_id'][0]
-                        # other variables
-                        for k,v in res.items():
-                            job.write(f'{k}: {v[0]}\n')
-                # Send job id files to remote host so that
-                # 1. the job could be properly killed (with job_id) on remote host (not remotely)
-                # 2. the job status could be perperly probed in case the job was not properly submitted (#911)
-                self.agent.send_task_file(job_id_file)
-                # output job id to stdout
-                env.logger.info(f'{task_id} ``submitted`` to {self.alias} with job id {job_id}')
-                return True
+                    env.logger.debug(f'Failed to query status of task {task_id}, which will be checked again: {e}')
             except Exception as e:
-                raise RuntimeError(f'Failed to submit task {task_id}: {e}')
+                env.logger.debug(f'Failed to query status of task {task_id}, which will be checked again: {e}')
+        return [x for x in task_ids if x in dead]
 
-    def _get_job_id(self, task_id):
-        job_id_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', task_id + '.job_id')
-        if not os.path.isfile(job_id_file):
+    def _reconcile_tasks(self, task_ids):
+        # tasks with dead jobs are checked again because they might have been started
+        # after the status check of sos, and are marked failed if they are still not
+        # started, that is, still submitted or pending. Returns task_id -> status of the tasks
+        if not task_ids:
             return {}
-        with open(job_id_file) as job:
-            result = {}
-            for line in job:
-                k, v = line.split(':', 1)
-                result[k.strip()] = v.strip()
-            return result
-
-#     def _query_job_status(self, job_id, task_id):
-#         job_id.update({'task': task_id, 'verbosity': 1})
-#         cmd = cfg_interpolate(self.status_cmd, job_id)
-#         return self.agent.check_output(cmd)
-# 
-#     def query_tasks(self, tasks=None, verbosity=1, html=False, **kwargs):
-#         if verbosity <= 3:
-#             status_lines = super(PBS_TaskEngine, self).query_tasks(tasks, verbosity, html, **kwargs)
-#             # there is a change that a job is submitted, but failed before the sos command is executed
-#             # so we will have to ask the task engine about the submitted jobs #608
-#             if not html:
-#                 res = ''
-#                 for line in status_lines.split('\n'):
-#                     if not line.strip():
-#                         continue
-#                     fields = line.split('\t')
-#                     if len(fields) < verbosity:
-#                         env.logger.error(fields)
-#                         env.logger.warning(f'Suspicious status line {line}')
-#                         continue
-#                     task_id = fields[0]
-#                     if fields[verbosity] == 'submitted':
-#                         try:
-#                             job_id = self._get_job_id(task_id)
-#                             if not job_id:
-#                                 raise RuntimeError(f'failed to obtain job id for task {task_id}')
-#                             self._query_job_status(job_id, task_id)
-#                         except Exception as e:
-#                             env.logger.trace(f'Failed to query status for task {task_id}: {e}')
-#                             fields[verbosity] = 'failed'
-#                     res += '\t'.join(fields) + '\n'
-#                 return res
-#             else:
-#                 # ID line: <tr><th align="right"  width="30%">ID</th><td align="left">5173b80bf85d3d03153b96f9a5b4d6cc</td></tr>
-#                 task_id = status_lines.split('>ID<', 1)[-1].split('</td',1)[0].split('>')[-1]
-#                 status = status_lines.split('>Status<', 1)[-1].split('</td',1)[0].split('>')[-1]
-#                 if status == 'submitted':
-#                     try:
-#                         job_id = self._get_job_id(task_id)
-#                         if not job_id:
-#                             raise RuntimeError(f'failed to obtain job id for task {task_id}')
-#                         self._query_job_status(job_id, task_id)
-#                     except Exception as e:
-#                         env.logger.trace(f'Failed to query status for task {task_id}: {e}')
-#                         status_lines = status_lines.replace('submitted', 'failed', 1)
-#                 return status_lines
-# 
-#         # for more verbose case, we will call pbs's status_cmd to get more accurate information
-#         status_lines = super(PBS_TaskEngine, self).query_tasks(tasks, 1)
-#         res = ''
-#         for line in status_lines.split('\n'):
-#             if not line.strip():
-#                 continue
-#             task_id, status = line.split('\t')
-#             # call query_tasks again for more verbose output
-#             res += super(PBS_TaskEngine, self).query_tasks([task_id], verbosity, html) + '\n'
-#             #
-#             try:
-#                 job_id = self._get_job_id(task_id)
-#                 if not job_id:
-#                     # no job id file
-#                     raise RuntimeError(f'failed to obtain job id for task {task_id}')
-#                 res += self._query_job_status(job_id, task_id)
-#             except Exception as e:
-#                 env.logger.debug(
-#                     f'Failed to get status of task {task_id} (job_id: {job_id}) from template "{self.status_cmd}": {e}')
-#         return res
+        status = self._sos_status(task_ids)
+        failed = [x for x in task_ids if status.get(x, 'submitted') in ('submitted', 'pending')]
+        if failed:
+            self._record_failed_jobs(failed)
+        status.update({x: 'failed' for x in failed})
+        return {x: status[x] for x in task_ids}
+
+    def _sos_status(self, task_ids):
+        # return task_id -> status of tasks reported by sos
+        output = super(PBS_TaskEngine, self).query_tasks(tasks=task_ids, verbosity=1)
+        status = {}
+        for line in output.split('\n'):
+            fields = line.split('\t')
+            if len(fields) >= 2:
+                status[fields[0]] = fields[-1].strip()
+        return status
+
+    def _record_failed_jobs(self, task_ids):
+        # save the status, exit code and stderr of jobs of failed tasks with their
+        # job ids, and report them once
+        job_ids = {x: y for x, y in self._get_job_ids(task_ids).items() if 'job_status' not in y}
+        if not job_ids:
+            return
+        exit_status = {}
+        if self.exit_status_cmd:
+            try:
+                exit_status = self._query_exit_status(sorted(set(x['job_id'] for x in job_ids.values())))
+            except Exception as e:
+                env.logger.debug(f'Failed to query exit status of jobs on {self.alias}: {e}')
+        for task_id, job_id in job_ids.items():
+            job_id['job_status'] = self._job_status.get(job_id['job_id'], 'unknown')
+            job_id.update(exit_status.get(job_id['job_id'], {}))
+            self._job_ids.set(task_id, job_id, self.alias)
+            self._job_ids.export_file(task_id)
+            env.logger.warning(self._failure_message(task_id, job_id))
+
+    def _kill_dependents(self, status):
+        # kill downstream tasks of failed tasks, with status being task_id -> status,
+        # and their jobs, which would otherwise be held in the queue forever
+        task_ids = self._failed_dependents(status)
+        if not task_ids:
+            return
+        env.logger.warning(f'Killing {len(task_ids)} tasks on {self.alias} that depend on failed tasks: {", ".join(task_ids)}')
+        try:
+            self._kill_jobs(super(PBS_TaskEngine, self).kill_tasks(task_ids))
+        except Exception as e:
+            env.logger.warning(f'Failed to kill tasks {", ".join(task_ids)} on {self.alias}: {e}')
+
+    def _query_exit_status(self, job_ids):
+        # return job_id -> variables such as exit_code and stderr extracted by exit_status_cmd_output
+        lines = []
+        for chunk, cmd in self._bulk_commands('exit_status_cmd', job_ids):
+            env.logger.debug(f'Query exit status of {len(chunk)} jobs: {cmd}')
+            self._timer.count('exit_status_cmd')
+            output = self.agent.check_output(cmd)
+            lines.extend(' '.join(line.split()) for line in output.splitlines() if line.strip())
+        res = {}
+        for line in lines:
+            match = self._parsers['exit_status_cmd_output'].parse(line)
+            if match and match.get('job_id', None) in job_ids:
+                res[match['job_id']] = {x: y for x, y in match.items() if x != 'job_id' and y}
+        return res
+
+    def _failure_message(self, task_id, job_id):
+        if job_id['job_status'] == 'unknown':
+            msg = f'Task {task_id} failed because job {job_id["job_id"]} is no longer known to {self.alias}'
+        else:
+            msg = f'Task {task_id} failed because job {job_id["job_id"]} finished with status {job_id["job_status"]}'
+        msg += ' before the task was started'
+        if 'exit_code' in job_id:
+            msg += f', with exit code {job_id["exit_code"]}'
+        if 'stderr' in job_id:
+            msg += f'. Check {job_id["stderr"]} for errors of the job'
+        return msg
+
+    def query_tasks(self, tasks=None, verbosity=1, html=False, **kwargs):
+        if self._trace:
+            self._trace.record_call('query_tasks', tasks=tasks, verbosity=verbosity, html=html, **kwargs)
+        if verbosity == 0:
+            # status without task id cannot be checked against job status
+            return super(PBS_TaskEngine, self).query_tasks(tasks=tasks, verbosity=verbosity, html=html, **kwargs)
+        if verbosity <= 3:
+            status_lines = super(PBS_TaskEngine, self).query_tasks(tasks=tasks, verbosity=verbosity, html=html, **kwargs)
+            # there is a change that a job is submitted, but failed before the sos command is executed
+            # so we will have to ask the task engine about the submitted jobs #608
+            if not html:
+                lines = [line.split('\t') for line in status_lines.split('\n') if line.strip()]
+                status = self._check_status({fields[0]: fields[-1].strip() for fields in lines if len(fields) >= 2})
+                if self._pilot_tasks:
+                    # only the engine that has queued the tasks starts new pilots for them
+                    self._check_pilots({fields[0]: status.get(fields[0], fields[-1].strip()) for fields in lines if len(fields) >= 2})
+                if self._reduced_tasks or self._requested_resources:
+                    # only the engine that has submitted tasks with reduced resources submits them again
+                    status.update(self._retry_rightsized({fields[0]: status.get(fields[0], fields[-1].strip())
+                        for fields in lines if len(fields) >= 2}))
+                self._forget_jobs([fields[0] for fields in lines if len(fields) >= 2 and
+                    status.get(fields[0], fields[-1].strip()) in ('completed', 'failed', 'aborted')])
+                if self._downstream:
+                    self._kill_dependents({fields[0]: status.get(fields[0], fields[-1].strip())
+                        for fields in lines if len(fields) >= 2})
+                res = ''
+                for fields in lines:
+                    if len(fields) < 2:
+                        env.logger.warning(f'Suspicious status line {fields}')
+                        continue
+                    if fields[0] in status:
+                        fields[-1] = status[fields[0]]
+                    res += '\t'.join(fields) + '\n'
+                if verbosity >= 2 and kwargs.get('numeric_times', False):
+                    self._save_history(lines)
+                return res
+            else:
+                # ID line: <tr><th align="right"  width="30%">ID</th><td align="left">5173b80bf85d3d03153b96f9a5b4d6cc</td></tr>
+                task_id = status_lines.split('>ID<', 1)[-1].split('</td',1)[0].split('>')[-1]
+                status = status_lines.split('>Status<', 1)[-1].split('</td',1)[0].split('>')[-1]
+                checked = self._check_status({task_id: status}).get(task_id, status)
+                if checked != status:
+                    status_lines = status_lines.replace(f'>{status}<', f'>{checked}<', 1)
+                return status_lines
+
+        # for more verbose case, we will call pbs's status_cmd to get more accurate information
+        status_lines = super(PBS_TaskEngine, self).query_tasks(tasks=tasks, verbosity=1)
+        lines = [line.split('\t') for line in status_lines.split('\n') if line.strip()]
+        self._check_submitted_jobs([x[0] for x in lines])
+        res = ''
+        for task_id, status in lines:
+            # call query_tasks again for more verbose output
+            res += super(PBS_TaskEngine, self).query_tasks(tasks=[task_id], verbosity=verbosity, html=html) + '\n'
+            #
+            job_id = None
+            try:
+                job_id = self._get_job_id(task_id)
+                if not job_id:
+                    # no job id file
+                    raise RuntimeError(f'failed to obtain job id for task {task_id}')
+                res += self._query_job_status(job_id, task_id)
+            except Exception as e:
+                env.logger.debug(
+                    f'Failed to get status of task {task_id} (job_id: {job_id}) from template "{self.bulk_status_cmd or self.status_cmd}": {e}')
+                if job_id and 'job_status' in job_id:
+                    res += self._failure_message(task_id, job_id) + '\n'
+        return res
+
+    def tail_tasks(self, task_ids, streams=('stdout', 'stderr')):
+        '''Return a dictionary of task_id -> {stream: text} with the output that jobs
+        of tasks have written to stdout_file and stderr_file since the last call,
+        with at most max_tail_bytes of each file at a time. Files of all tasks are
+        read with one command on the remote host (or more if the command would be
+        longer than max_cmd_length), which runs a script sent to ~/.sos/tasks.'''
+        if self._trace:
+            self._trace.record_call('tail_tasks', task_ids, streams=list(streams))
+        job_ids = self._get_job_ids(task_ids)
+        files = {}
+        for task_id in task_ids:
+            for stream in streams:
+                files[(task_id, stream)] = self._templates[f'{stream}_file'].render(
+                    dict(job_ids.get(task_id, {}), task=task_id))
+        res = {x: {} for x in task_ids}
+        if self._local_agent:
+            output = self._output_tail.read(files)
+        else:
+            if not self._tail_script_sent:
+                # the script that reads the files is sent once
+                self._send_task_files([self._output_tail.write_script(os.path.join(os.path.expanduser('~'), '.sos', 'tasks'))])
+                self._tail_script_sent = True
+            output = {}
+            for keys, cmd in self._output_tail.commands(files, self.max_cmd_length):
+                self._timer.count('tail_cmd')
+                try:
+                    output.update(self._output_tail.parse(keys, self.agent.check_output(cmd)))
+                except Exception as e:
+                    env.logger.debug(f'Failed to read output of {len(keys)} files of tasks: {e}')
+        for (task_id, stream), text in output.items():
+            if text:
+                res[task_id][stream] = text
+        return res
 
     def kill_tasks(self, tasks, **kwargs):
+        if self._trace:
+            self._trace.record_call('kill_tasks', tasks, **kwargs)
         # remove the task from SoS task queue, this would also give us a list of
         # tasks on the remote server
         output = super(PBS_TaskEngine, self).kill_tasks(tasks, **kwargs)
         env.logger.trace(f'Output of local kill: {output}')
-        # then we call the real PBS commands to kill tasks
+        return self._kill_jobs(output)
+
+    def kill_jobs(self, output):
+        '''Kill jobs of tasks that are killed or aborted in the output of "sos kill",
+        and return the output with the output of the kill commands of each task'''
+        return self._kill_jobs(output)
+
+    def _kill_jobs(self, output):
+        # kill jobs of tasks listed in the output of "sos kill" with the real
+        # PBS commands, and append the output of these commands to each line
+        lines = [line.split('\t') for line in output.split('\n') if line.strip()]
+        if self.pilots:
+            # tasks that are not taken by pilots should be removed from the queue
+            killed = [task_id for task_id, status in lines if status.strip() in ('killed', 'aborted')]
+            self._dequeue_tasks(killed)
+            for task_id in killed:
+                self._pilot_tasks.pop(task_id, None)
+        # only run kill_cmd on killed or aborted jobs
+        job_ids = self._get_job_ids([task_id for task_id, status in lines if status.strip() in ('killed', 'aborted')])
+        # tasks killed by users are not submitted again with requested resources
+        rightsized = {x: dict(y, killed=True) for x, y in job_ids.items() if any(z.startswith('requested_') for z in y)}
+        if rightsized:
+            self._job_ids.set_many(rightsized, self.alias)
+        # a job with bundled tasks is killed only once, and only if all its tasks are killed
+        bundles = {}
+        for task_id, job_id in job_ids.items():
+            if 'bundle' in job_id:
+                bundles.setdefault(job_id['job_id'], []).append(task_id)
+        killed = {}
+        shared = {}
+        for bundle_job, bundled_tasks in bundles.items():
+            if len(bundled_tasks) < int(job_ids[bundled_tasks[0]]['bundle_size']):
+                for task_id in bundled_tasks:
+                    killed[task_id] = f'job {bundle_job} is kept for other tasks in {job_ids[task_id]["bundle"]}'
+            else:
+                for task_id in bundled_tasks[1:]:
+                    shared[task_id] = bundled_tasks[0]
+        to_kill = {x: y for x, y in job_ids.items() if x not in killed and x not in shared}
+        if self.bulk_kill_cmd:
+            killed.update(self._bulk_kill_jobs(to_kill))
+        else:
+            for task_id, job_id in to_kill.items():
+                try:
+                    job_id.update({'task': task_id})
+                    cmd = self._templates['kill_cmd'].render(job_id)
+                    env.logger.debug(f'Running {cmd}')
+                    self._timer.count('kill_cmd')
+                    killed[task_id] = self.agent.check_output(cmd)
+                except Exception as e:
+                    env.logger.debug(
+                        f'Failed to kill job {task_id} (job_id: {job_id}) from template "{self.kill_cmd}": {e}')
+        for task_id, killed_with in shared.items():
+            if killed_with in killed:
+                killed[task_id] = killed[killed_with]
+
         res = ''
-        for line in output.split('\n'):
-            if not line.strip():
-                continue
-            task_id, status = line.split('\t')
+        for task_id, status in lines:
             res += f'{task_id}\t{status}\t'
-            # only run kill_cmd on killed or aborted jobs
             if status.strip() not in ('killed', 'aborted'):
                 res += '.\n'
                 continue
-
-            job_id = self._get_job_id(task_id)
-            if not job_id:
+            if task_id not in job_ids:
                 env.logger.debug(f'No job_id for task {task_id}')
-                continue
-            try:
-                job_id.update({'task': task_id})
-                cmd = cfg_interpolate(self.kill_cmd, job_id)
-                env.logger.debug(f'Running {cmd}')
-                res += self.agent.check_output(cmd) + '\n'
-            except Exception as e:
-                env.logger.debug(
-                    f'Failed to kill job {task_id} (job_id: {job_id}) from template "{self.kill_cmd}": {e}')
+            res += killed.get(task_id, '') + '\n'
         return res
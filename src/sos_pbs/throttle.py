@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import threading
+import time
+
+from sos.utils import env
+
+
+class ThrottleMixin(object):
+    '''Mixin of PBS_TaskEngine that limits the number of queued jobs to max_queued_jobs'''
+
+    def _init_throttle(self):
+        # submissions are held back if there are max_queued_jobs queued or running jobs,
+        # counted by queued_count_cmd (a command that outputs the number of jobs) or from
+        # the status of jobs submitted by the engine
+        if 'max_queued_jobs' in self.config:
+            self.max_queued_jobs = int(self.config['max_queued_jobs'])
+        else:
+            self.max_queued_jobs = None
+
+        if 'queued_count_cmd' in self.config:
+            self.queued_count_cmd = self.config['queued_count_cmd']
+        else:
+            self.queued_count_cmd = None
+
+        if self.max_queued_jobs and not self.queued_count_cmd and not self.bulk_status_cmd and not self.events_cmd:
+            raise ValueError(f'Option max_queued_jobs requires queued_count_cmd, bulk_status_cmd or events_cmd for queue {self.alias}')
+
+        self._throttle_lock = threading.Lock()
+        self._queued_count = 0
+        self._queued_count_time = None
+
+    def count_queued_jobs(self):
+        '''Return the number of queued and running jobs, which is counted at most once
+        every status_cache_ttl seconds, and the time of the count. If jobs cannot be
+        counted, the last count and None are returned'''
+        count = self._count_queued_jobs()
+        if count is None:
+            return self._queued_count, None
+        return count, self._queued_count_time
+
+    def _count_queued_jobs(self, refresh=False):
+        # number of queued and running jobs, from queued_count_cmd or from the
+        # bulk status of jobs submitted by the engine, or None if jobs cannot be counted
+        if not refresh and self._queued_count_time is not None and \
+            time.time() - self._queued_count_time < self.status_cache_ttl:
+            return self._queued_count
+        if self.queued_count_cmd:
+            try:
+                self._timer.count('queued_count_cmd')
+                output = self.agent.check_output(self._templates['queued_count_cmd'].render({}))
+                self._queued_count = int(output.split()[-1])
+            except Exception as e:
+                env.logger.warning(f'Failed to count queued jobs on {self.alias} with command "{self.queued_count_cmd}": {e}')
+                return None
+        else:
+            try:
+                self._job_status_time = None
+                job_status = self._get_job_status([])
+                if self.events_cmd:
+                    # jobs without any event are still queued
+                    self._queued_count = len([x for x in set(self._known_jobs.values())
+                        if job_status.get(x, None) not in self.finished_status])
+                else:
+                    self._queued_count = len([x for x in set(self._known_jobs.values())
+                        if x in job_status and job_status[x] not in self.finished_status])
+            except Exception as e:
+                env.logger.warning(f'Failed to count queued jobs on {self.alias}: {e}')
+                return None
+        self._queued_count_time = time.time()
+        return self._queued_count
+
+    def _reserve_slots(self, num_jobs=1):
+        # wait until num_jobs jobs can be submitted without exceeding max_queued_jobs
+        if not self.max_queued_jobs:
+            return
+        refresh = False
+        while True:
+            with self._throttle_lock:
+                count = self._count_queued_jobs(refresh)
+                if count is None:
+                    # jobs submitted by the engine are still counted
+                    count = self._queued_count
+                if count == 0 or count + num_jobs <= self.max_queued_jobs:
+                    self._queued_count += num_jobs
+                    return
+            env.logger.debug(f'Waiting for {count} queued jobs on {self.alias} to drain below {self.max_queued_jobs}')
+            time.sleep(self.submit_retry_interval)
+            refresh = True
+
+    def _release_slots(self, num_jobs=1):
+        if self.max_queued_jobs:
+            with self._throttle_lock:
+                self._queued_count = max(self._queued_count - num_jobs, 0)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+
+class PhaseTimer:
+    '''Time phases of task submission, with the time of each phase accumulated
+    per task and in total, and counters such as agent calls and bytes sent.
+
+    Phases are attributed to the tasks set by tasks() in the current thread,
+    and the time of a phase that processes several tasks is split evenly
+    among these tasks. Phases of tasks and batches are only kept with details,
+    and are cleared from memory after they are saved.'''
+
+    def __init__(self, details=True):
+        self.details = details
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.start_time = time.time()
+            # phase -> [count, total, max]
+            self.phases = {}
+            # task_id -> {phase: seconds}
+            self.task_phases = {}
+            self.counters = Counter()
+            self.batches = []
+            # file to which phases of tasks and batches have been saved
+            self._saved_file = None
+
+    @contextlib.contextmanager
+    def tasks(self, task_ids):
+        previous = getattr(self._local, 'task_ids', ())
+        self._local.task_ids = tuple(task_ids)
+        try:
+            yield
+        finally:
+            self._local.task_ids = previous
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        task_ids = getattr(self._local, 'task_ids', ())
+        with self._lock:
+            stat = self.phases.setdefault(name, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+            if not self.details:
+                return
+            for task_id in task_ids:
+                phases = self.task_phases.setdefault(task_id, {})
+                phases[name] = phases.get(name, 0.0) + seconds / len(task_ids)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def totals(self):
+        with self._lock:
+            return {x: y[1] for x, y in self.phases.items()}, dict(self.counters)
+
+    @contextlib.contextmanager
+    def batch(self, task_ids):
+        '''Time a batch of tasks, and fill the yielded dictionary with the time
+        spent in each phase and the change of counters during the batch'''
+        phases, counters = self.totals()
+        start = time.perf_counter()
+        record = {}
+        try:
+            with self.tasks(task_ids):
+                yield record
+        finally:
+            new_phases, new_counters = self.totals()
+            record.update({
+                'time': time.time(),
+                'tasks': len(task_ids),
+                'elapsed': time.perf_counter() - start,
+                'phases': {x: y - phases.get(x, 0.0) for x, y in new_phases.items() if y != phases.get(x, 0.0)},
+                'counters': {x: y - counters.get(x, 0) for x, y in new_counters.items() if y != counters.get(x, 0)},
+            })
+            if self.details:
+                with self._lock:
+                    self.batches.append(record)
+
+    def summary(self, clear=False):
+        with self._lock:
+            res = {
+                'start_time': self.start_time,
+                'end_time': time.time(),
+                'phases': {x: {'count': y[0], 'total': y[1], 'mean': y[1] / y[0], 'max': y[2]}
+                    for x, y in self.phases.items()},
+                'counters': dict(self.counters),
+                'batches': list(self.batches),
+                'tasks': {x: dict(y) for x, y in self.task_phases.items()},
+            }
+            if clear:
+                self.task_phases = {}
+                self.batches = []
+            return res
+
+    def save(self, filename):
+        '''Save the summary to filename, with phases of tasks and batches added to
+        those saved to the same file since the last reset'''
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        summary = self.summary(clear=True)
+        if self._saved_file == filename and os.path.isfile(filename):
+            with open(filename) as saved:
+                saved = json.load(saved)
+            summary['batches'] = saved['batches'] + summary['batches']
+            for task_id, phases in saved['tasks'].items():
+                task_phases = summary['tasks'].setdefault(task_id, {})
+                for name, seconds in phases.items():
+                    task_phases[name] = task_phases.get(name, 0.0) + seconds
+        with open(filename + '.tmp', 'w') as out:
+            json.dump(summary, out, indent=1)
+        os.replace(filename + '.tmp', filename)
+        self._saved_file = filename
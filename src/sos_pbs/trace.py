@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import atexit
+import base64
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+
+from sos.hosts import LocalHost
+from sos.tasks import TaskFile, TaskParams
+
+from ._version import __version__
+
+# options of the queue that are not saved to trace files
+SECRET_OPTIONS = re.compile(r'password|passwd|secret|token|credential', re.IGNORECASE)
+
+
+def _home_dir():
+    return os.path.expanduser('~')
+
+
+class TraceRecorder:
+    '''Wrapper of the agent of a task engine that records calls to the engine
+    and interactions with the remote host (commands with their output and
+    latency, and files sent) to a trace file in JSON lines format, which can be
+    replayed by ReplayAgent. Only the runtime options and step of tasks are
+    recorded unless task_files is True, in which case complete task files,
+    with the commands and variables of tasks, are recorded'''
+
+    def __init__(self, agent, trace_file, config, task_files=False):
+        self._agent = agent
+        self.trace_file = trace_file
+        self.task_files = task_files
+        self._lock = threading.Lock()
+        self._recorded_tasks = set()
+        os.makedirs(os.path.dirname(os.path.abspath(trace_file)), exist_ok=True)
+        self._trace = open(trace_file, 'a', buffering=1)
+        atexit.register(self.close)
+        self._write({'type': 'header', 'version': __version__, 'time': time.time(),
+            'alias': agent.alias, 'address': getattr(agent, 'address', None), 'port': getattr(agent, 'port', None),
+            'local': isinstance(agent, LocalHost), 'home': _home_dir(),
+            'config': {x: y for x, y in config.items() if not SECRET_OPTIONS.search(x)}})
+
+    def __getattr__(self, name):
+        return getattr(self._agent, name)
+
+    def _write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            if not self._trace.closed:
+                self._trace.write(line)
+
+    def close(self):
+        with self._lock:
+            self._trace.close()
+        atexit.unregister(self.close)
+
+    def record_call(self, method, *args, **kwargs):
+        # tasks are saved before the first call that uses them
+        task_ids = args[0] if args and isinstance(args[0], (list, tuple)) else kwargs.get('tasks', None)
+        for task_id in task_ids or []:
+            if task_id in self._recorded_tasks:
+                continue
+            self._recorded_tasks.add(task_id)
+            task_file = TaskFile(task_id)
+            if not task_file.exists():
+                continue
+            if self.task_files:
+                with open(task_file.task_file, 'rb') as content:
+                    self._write({'type': 'task_file', 'task_id': task_id,
+                        'content': base64.b64encode(content.read()).decode()})
+            else:
+                sos_dict = task_file.params.sos_dict
+                self._write({'type': 'task', 'task_id': task_id, 'runtime': sos_dict['_runtime'],
+                    'step_name': sos_dict.get('step_name', None)})
+        self._write({'type': 'call', 'method': method, 'time': time.time(), 'args': list(args), 'kwargs': kwargs})
+
+    def _run(self, method, key, func, *args, **kwargs):
+        record = {'type': 'agent', 'method': method, 'key': key, 'start': time.time()}
+        start = time.perf_counter()
+        try:
+            res = func(*args, **kwargs)
+            record['output'] = res
+            return res
+        except subprocess.CalledProcessError as e:
+            record['returncode'] = e.returncode
+            record['output'] = e.output.decode(errors='replace') if isinstance(e.output, bytes) else e.output
+            raise
+        except Exception as e:
+            record['error'] = str(e)
+            raise
+        finally:
+            record['latency'] = time.perf_counter() - start
+            self._write(record)
+
+    def check_output(self, cmd, *args, **kwargs):
+        return self._run('check_output', cmd, self._agent.check_output, cmd, *args, **kwargs)
+
+    def check_call(self, cmd, run_local):
+        # local command, such as the command to send task files in one transfer,
+        # which is run by run_local
+        return self._run('check_call', cmd, run_local, cmd)
+
+    def prepare_task(self, task_id):
+        return self._run('prepare_task', task_id, self._agent.prepare_task, task_id)
+
+    def send_task_file(self, task_file):
+        return self._run('send_task_file', os.path.basename(task_file), self._agent.send_task_file, task_file)
+
+
+def read_trace(trace_file):
+    '''Read a trace file and return the header, calls to the engine, tasks as
+    task_id -> record (with the content of the task file, or the runtime options
+    and step of the task), and interactions with the agent'''
+    header = None
+    calls = []
+    tasks = {}
+    interactions = []
+    with open(trace_file) as trace:
+        for line in trace:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record['type'] == 'header':
+                # only the first session in the trace file is read
+                if header is not None:
+                    break
+                header = record
+            elif record['type'] == 'call':
+                calls.append(record)
+            elif record['type'] == 'task_file':
+                tasks[record['task_id']] = {'content': base64.b64decode(record['content'])}
+            elif record['type'] == 'task':
+                tasks[record['task_id']] = {'runtime': record['runtime'], 'step_name': record['step_name']}
+            else:
+                interactions.append(record)
+    if header is None:
+        raise ValueError(f'{trace_file} is not a trace file of sos-pbs')
+    return header, calls, tasks, interactions
+
+
+def write_task_file(task_id, task):
+    '''Write the task file of a task read by read_trace to ~/.sos/tasks, with
+    only the runtime options and step of the task if its content is not recorded'''
+    task_file = TaskFile(task_id)
+    if 'content' in task:
+        with open(task_file.task_file, 'wb') as content:
+            content.write(task['content'])
+    else:
+        task_file.save(TaskParams(name=task_id, global_def='', task='',
+            sos_dict={'_runtime': task['runtime'], 'step_name': task['step_name']}, tags=[]))
+
+
+class ReplayAgent:
+    '''Agent that answers commands of a task engine from recorded interactions.
+    Commands are matched after replacing the home directory and names of
+    temporary files, and the last recorded output is reused if a command is
+    called more times than recorded.'''
+
+    def __init__(self, header, interactions, latency=False):
+        self.alias = header['alias']
+        self.address = header['address']
+        self.port = header['port']
+        self.config = header['config']
+        self._home = header['home']
+        self._latency = latency
+        self._lock = threading.Lock()
+        self._replies = {}
+        for record in interactions:
+            self._replies.setdefault((record['method'], self._normalize(record['key'], self._home)), []).append(record)
+        # recorded latency of replayed interactions, and interactions not found in trace
+        self.replayed_latency = 0
+        self.missing = []
+
+    @staticmethod
+    def _normalize(key, home):
+        key = str(key).replace(home, '~')
+        return re.sub(r'\S*sos_pbs_\w+\.files', '{file_list}', key)
+
+    def _reply(self, method, key):
+        normalized = self._normalize(key, _home_dir())
+        with self._lock:
+            replies = self._replies.get((method, normalized), None)
+            if not replies:
+                self.missing.append((method, key))
+                raise RuntimeError(f'No recorded {method} for "{key}"')
+            record = replies.pop(0) if len(replies) > 1 else replies[0]
+            self.replayed_latency += record['latency']
+        if self._latency:
+            time.sleep(record['latency'])
+        if 'returncode' in record:
+            raise subprocess.CalledProcessError(record['returncode'], key, output=record['output'])
+        if 'error' in record:
+            raise RuntimeError(record['error'])
+        return record.get('output', None)
+
+    def check_output(self, cmd, *args, **kwargs):
+        return self._reply('check_output', cmd)
+
+    def check_call(self, cmd):
+        return self._reply('check_call', cmd)
+
+    def prepare_task(self, task_id):
+        return self._reply('prepare_task', task_id)
+
+    def send_task_file(self, task_file):
+        return self._reply('send_task_file', os.path.basename(task_file))
@@ -145,6 +145,9 @@ cat >> ~/docker.yml << 'HERE'
         max_running_jobs: 100
         submit_cmd: tsp -L {task} sh {job_file}
         status_cmd: tsp -s {job_id}
+        bulk_status_cmd: tsp -l
+        bulk_status_cmd_output: '{job_id,[0-9]+} {status,[a-z]+} {output}'
+        finished_status: [finished, skipped]
         kill_cmd: tsp -r {job_id}
     local_ts:
         description: task spooler on the docker machine
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from sos_pbs.cache import StatusCache
+
+
+class TestStatusCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.temp_dir.name, 'status', 'queue.json')
+        self.queries = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def query(self, job_ids):
+        self.queries.append(list(job_ids))
+        time.sleep(0.2)
+        # job 3 is not known to the scheduler
+        return {x: 'R' for x in job_ids if x != '3'}
+
+    def testSharedQuery(self):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            StatusCache(self.cache_file, ttl=10).lookup('bulk', ['1', '2', '3'], self.query)[1])) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(results, [{'1': 'R', '2': 'R'}] * 4)
+        # jobs that are not in the cache are queried
+        cache = StatusCache(self.cache_file, ttl=10)
+        self.assertEqual(cache.lookup('bulk', ['1', '2'], self.query)[1], {'1': 'R', '2': 'R'})
+        self.assertEqual(cache.lookup('bulk', ['1', '4'], self.query)[1], {'1': 'R', '4': 'R'})
+        self.assertEqual(self.queries[1:], [['1', '4']])
+
+    def testStaleWhileRevalidate(self):
+        cache = StatusCache(self.cache_file, ttl=0.1, stale=10)
+        query_time, status = cache.lookup('bulk', ['1'], self.query)
+        time.sleep(0.2)
+        # stale status is returned immediately and refreshed in the background
+        start = time.time()
+        self.assertEqual(cache.lookup('bulk', ['1'], self.query), (query_time, status))
+        self.assertLess(time.time() - start, 0.1)
+        time.sleep(0.5)
+        self.assertEqual(len(self.queries), 2)
+        self.assertGreater(cache.lookup('bulk', ['1'], self.query)[0], query_time)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import subprocess
+import time
+import unittest
+
+from sos_pbs.clusters import MultiPBS_TaskEngine
+
+
+class ShellAgent:
+    def __init__(self, config):
+        self.config = config
+        self.alias = config['alias']
+
+    def check_output(self, cmd):
+        return subprocess.check_output(cmd, shell=True).decode()
+
+
+def clusters_config(**clusters):
+    return {'alias': 'multi', 'timing_file': None, 'job_template': 'sos execute {task}',
+        'submit_cmd': 'qsub {job_file}', 'status_cmd': 'qstat {job_id}', 'kill_cmd': 'qdel {job_id}',
+        'clusters': clusters}
+
+
+class TestClusters(unittest.TestCase):
+    def testAssignClusters(self):
+        engine = MultiPBS_TaskEngine(ShellAgent(clusters_config(
+            a={'queued_count_cmd': 'echo 4'}, b={'queued_count_cmd': 'echo 1', 'submit_cmd': 'ssh b qsub {job_file}'})))
+        self.assertEqual(engine._clusters['b'].submit_cmd, 'ssh b qsub {job_file}')
+        self.assertEqual(engine._clusters['b'].cluster, 'b')
+        # without observed wait, tasks go to the cluster with fewer queued jobs
+        res = engine._assign_clusters(['t1', 't2', 't3', 't4', 't5'])
+        self.assertEqual(res, {'b': [('t1', 1), ('t2', 2), ('t3', 3), ('t5', 4)], 'a': [('t4', 4)]})
+        # and to the cluster that starts jobs faster
+        engine._wait['b'] = 10
+        engine._wait['a'] = 2
+        res = engine._assign_clusters(['t1', 't2'])
+        self.assertEqual(res, {'a': [('t1', 4), ('t2', 5)]})
+        # and to the cluster of their upstream tasks
+        engine._task_clusters['t0'] = 'b'
+        engine.add_dependencies({'t1': ['t0'], 't3': 't1'})
+        res = engine._assign_clusters(['t1', 't2', 't3'])
+        self.assertEqual(res, {'b': [('t1', 1), ('t3', 2)], 'a': [('t2', 4)]})
+
+    def testUnreachableClusters(self):
+        engine = MultiPBS_TaskEngine(ShellAgent(clusters_config(
+            a={'queued_count_cmd': 'echo 4'}, b={'queued_count_cmd': 'exit 255'})))
+        # jobs on cluster b cannot be counted, so tasks are not sent to it
+        self.assertEqual(engine._clusters['b'].count_queued_jobs(), (0, None))
+        self.assertEqual(engine._assign_clusters(['t1', 't2']), {'a': [('t1', 4), ('t2', 5)]})
+        engine._clusters['a'].queued_count_cmd = 'exit 255'
+        engine._clusters['a']._templates['queued_count_cmd'] = engine._clusters['b']._templates['queued_count_cmd']
+        engine._clusters['a']._queued_count_time = None
+        # unless no cluster can be reached
+        self.assertEqual(sum(len(x) for x in engine._assign_clusters(['t1', 't2']).values()), 2)
+
+    def testObserveWaits(self):
+        engine = MultiPBS_TaskEngine(ShellAgent(clusters_config(a={'bulk_status_cmd': 'qstat {job_ids}'})))
+        cluster = engine._clusters['a']
+        engine._waiting['a'] = {'1': (time.time() - 100, 1), '2': (time.time() - 100, 0), '3': (time.time() - 10, 0),
+            '4': (time.time() - 10, 0)}
+        cluster._job_status = {'1': 'R', '2': 'Q'}
+        cluster._known_jobs = {'t1': '1', 't2': '2', 't3': '3', 't4': '4'}
+        cluster._queried_jobs = {'1', '2', '3'}
+        self.assertEqual(cluster.last_job_status(['1', '2', '3', '4']), {'1': 'R', '2': 'Q', '3': None})
+        engine._observe_waits('a')
+        # job 1 waited behind another job, job 3 has finished, and job 4 is not yet queried
+        self.assertEqual(list(engine._waiting['a'].keys()), ['2', '4'])
+        self.assertAlmostEqual(engine._wait['a'], 0.7 * 50 + 0.3 * 10, delta=1)
+
+    def testGroupTasks(self):
+        engine = MultiPBS_TaskEngine(ShellAgent(clusters_config(
+            a={'queued_count_cmd': 'echo 0'}, b={'queued_count_cmd': 'echo 0'})))
+        engine._task_clusters = {'t1': 'b', 't2': 'a', 't3': 'b'}
+        self.assertEqual(engine._group_tasks(['t1', 't2', 't3']), {'b': ['t1', 't3'], 'a': ['t2']})
+
+    def testInvalidClusters(self):
+        self.assertRaises(ValueError, MultiPBS_TaskEngine, ShellAgent(clusters_config()))
+        self.assertRaises(ValueError, MultiPBS_TaskEngine, ShellAgent(clusters_config(a={})))
+        self.assertRaises(ValueError, MultiPBS_TaskEngine, ShellAgent(dict(clusters_config(), clusters=['a'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
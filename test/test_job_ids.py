@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import tempfile
+import unittest
+
+from sos_pbs.jobs import JobIdStore, read_job_id_file, write_job_id_file
+
+
+class TestJobIdStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = JobIdStore(os.path.join(self.temp_dir.name, 'jobs.db'))
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def testLookup(self):
+        self.store.set_many({f'task{i}': {'job_id': f'{i}.server', 'server': 'server'} for i in range(10)}, 'pbs')
+        self.assertEqual(self.store.get('task3'), {'job_id': '3.server', 'server': 'server'})
+        self.assertEqual(self.store.get('task11'), {})
+        self.assertEqual(set(self.store.get_many(['task1', 'task2', 'task11']).keys()), {'task1', 'task2'})
+        self.assertEqual(self.store.task_of('5.server'), 'task5')
+        self.assertEqual(self.store.task_of('15.server'), None)
+        # records are read from the database by a new store
+        store = JobIdStore(self.store.db_file)
+        self.assertEqual(store.get('task7')['job_id'], '7.server')
+        self.assertEqual(store.task_of('8.server'), 'task8')
+        store.close()
+
+    def testRemove(self):
+        self.store.set('task1', {'job_id': '1'})
+        self.store.remove_many(['task1'])
+        self.assertEqual(self.store.get('task1'), {})
+        self.assertEqual(self.store.task_of('1'), None)
+
+    def testStatusCursor(self):
+        self.assertEqual(self.store.get_cursor('pbs'), None)
+        self.store.set_cursor('pbs', 1000.5)
+        self.store.set_status_many({'1.server': 'R', '2.server': 'Q'})
+        self.store.set_status_many({'2.server': 'C'})
+        store = JobIdStore(self.store.db_file)
+        self.assertEqual(store.get_cursor('pbs'), 1000.5)
+        self.assertEqual(store.get_status_many(['1.server', '2.server', '3.server']), {'1.server': 'R', '2.server': 'C'})
+        store.close()
+
+    def testHistory(self):
+        self.store.history_size = 3
+        self.store.add_history_many('pbs', {f'task{i}': ('align', i * 10.0, None) for i in range(5)})
+        self.store.add_history_many('pbs', {'task5': ('align', 50.0, 1000)})
+        self.store.add_history_many('other', {'task6': ('align', 60.0, None)})
+        history = self.store.get_history_many('pbs', ['align', 'call'])
+        # only the latest records of a step are kept
+        self.assertEqual(len(history['align']), 3)
+        self.assertIn((50.0, 1000), history['align'])
+        self.assertNotIn('call', history)
+
+    def testJournal(self):
+        self.store.set('task1', {'job_id': '1'})
+        self.store.begin_submission(['task1', 'task2', 'task3'], 'pbs')
+        self.store.set('task2', {'job_id': '2'})
+        self.store.end_submission(['task3'])
+        # the journal of an interrupted submission is read by another process
+        store = JobIdStore(self.store.db_file)
+        journal = store.get_journal(['task1', 'task2', 'task3'])
+        self.assertEqual({x: (y['queue'], y['state'], y['job_id']) for x, y in journal.items()},
+            {'task1': ('pbs', 'submitting', None), 'task2': ('pbs', 'submitted', '2')})
+        store.close()
+
+    def testJobIdFile(self):
+        job_file = os.path.join(self.temp_dir.name, 'task1.job_id')
+        write_job_id_file(job_file, {'job_id': '1234.server', 'server': 'server'})
+        self.assertEqual(read_job_id_file(job_file), {'job_id': '1234.server', 'server': 'server'})
+        self.assertEqual(self.store.import_file('task1', job_file)['job_id'], '1234.server')
+        self.assertEqual(self.store.task_of('1234.server'), 'task1')
+        exported = os.path.join(self.temp_dir.name, 'exported.job_id')
+        self.store.export_file('task1', exported)
+        self.assertEqual(read_job_id_file(exported), read_job_id_file(job_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import unittest
+
+from sos.pattern import extract_pattern
+
+from sos_pbs.parsers import compile_pattern, scheduler_output
+
+
+class TestParsers(unittest.TestCase):
+    def testOutputPattern(self):
+        lines = ['1234.server R', '1235.server Q', 'Job id Name', 'bad', '12/34.server C']
+        for pattern in ['{job_id}', '{job_id}.{server}', '{job_id,[^ ]+} {status}', '{job_id} {status,[A-Z]}']:
+            self.assertEqual(compile_pattern(pattern).extract(lines), extract_pattern(pattern, lines))
+        self.assertTrue(compile_pattern('{job_id}') is compile_pattern('{job_id}'))
+        self.assertEqual(compile_pattern('{job_id}.{server}').parse('1234.server'), {'job_id': '1234', 'server': 'server'})
+        self.assertEqual(compile_pattern('{job_id} {status}').parse('1234'), None)
+
+    def testSchedulerOutput(self):
+        self.assertEqual(scheduler_output('pbs').parse('1234.server\n')['job_id'], '1234.server')
+        self.assertEqual(scheduler_output('pbs').parse('warning: default queue\n1234.server')['job_id'], '1234.server')
+        self.assertEqual(scheduler_output('slurm').parse('Submitted batch job 5678 on cluster c1')['job_id'], '5678')
+        self.assertEqual(scheduler_output('lsf').parse('Job <91011> is submitted to queue <normal>.'),
+            {'job_id': '91011', 'queue': 'normal'})
+        self.assertEqual(scheduler_output('sge').parse('Your job 1213 ("test") has been submitted')['job_id'], '1213')
+        self.assertEqual(scheduler_output('sge').parse('Your job-array 1214.1-10:1 ("test") has been submitted')['job_id'], '1214')
+        self.assertEqual(scheduler_output('slurm').parse('sbatch: error: invalid partition'), None)
+        self.assertRaises(ValueError, scheduler_output, 'condor')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,829 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import weakref
+
+from sos.eval import cfg_interpolate
+from sos.hosts import RemoteHost
+
+from sos_pbs.bundles import pack_tasks
+from sos_pbs.jobs import JobIdStore
+from sos_pbs.pilots import PILOT_SCRIPT
+from sos_pbs.tasks import PBS_TaskEngine, compile_template
+
+
+class ShellAgent:
+    def __init__(self, config):
+        self.config = config
+        self.alias = config['alias']
+
+    def check_output(self, cmd):
+        return subprocess.check_output(cmd, shell=True).decode()
+
+
+class SSHAgent(ShellAgent):
+    # runs commands as RemoteHost does, with cfg_interpolate and the default execute_cmd,
+    # and with ssh in bin_dir, which runs the command on the local host
+    def __init__(self, config, bin_dir):
+        super(SSHAgent, self).__init__(config)
+        self.bin_dir = bin_dir
+        self.sent = []
+        with open(os.path.join(bin_dir, 'ssh'), 'w') as ssh:
+            ssh.write('#!/bin/sh\nshift 4\nexec sh -c "$1"\n')
+        os.chmod(os.path.join(bin_dir, 'ssh'), 0o755)
+
+    def send_task_file(self, task_file):
+        self.sent.append(os.path.basename(task_file))
+
+    def check_output(self, cmd):
+        cmd = cfg_interpolate(RemoteHost._get_execute_cmd(self), {'host': 'localhost', 'port': 22,
+            'cmd': cmd, 'cur_dir': os.getcwd()})
+        return subprocess.check_output(cmd, shell=True,
+            env=dict(os.environ, PATH=self.bin_dir + os.pathsep + os.environ['PATH'])).decode()
+
+
+# options of the queue of most tests, which are updated with options of each test
+BASE_CONFIG = {'alias': 'pbs', 'job_template': 'sos execute {task}', 'submit_cmd': 'qsub {job_file}',
+    'status_cmd': 'qstat {job_id}', 'kill_cmd': 'qdel {job_id}'}
+
+
+class TestPBSEngine(unittest.TestCase):
+    def setUp(self):
+        # task files, job scripts and the job id store are written to a temporary home directory
+        self.home_dir = tempfile.TemporaryDirectory()
+        self.home = os.environ['HOME']
+        os.environ['HOME'] = self.home_dir.name
+        os.makedirs(os.path.join(self.home_dir.name, '.sos', 'tasks'))
+
+    def tearDown(self):
+        os.environ['HOME'] = self.home
+        self.home_dir.cleanup()
+
+    def testCompileTemplate(self):
+        self.assertRaises(ValueError, compile_template, '#!/bin/bash\ncd {cur_dir\n', 'job_template')
+        template = compile_template('qsub -l nodes={nodes}:ppn={cores} {job_file}', 'submit_cmd')
+        self.assertTrue(template is compile_template('qsub -l nodes={nodes}:ppn={cores} {job_file}', 'submit_cmd'))
+        self.assertEqual(template.render({'nodes': 1, 'cores': 4, 'job_file': 'a.sh'}), 'qsub -l nodes=1:ppn=4 a.sh')
+        self.assertEqual(template.render_many([{'nodes': 1, 'cores': x, 'job_file': 'a.sh'} for x in range(3)]),
+            [f'qsub -l nodes=1:ppn={x} a.sh' for x in range(3)])
+        self.assertRaises(ValueError, template.render, {'nodes': 1})
+
+    def testBulkStatus(self):
+        # status of task spooler jobs as configured by build_test_docker.sh
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, alias='ts', submit_cmd='tsp -L {task} sh {job_file}',
+            status_cmd='tsp -s {job_id}', kill_cmd='tsp -r {job_id}',
+            bulk_status_cmd="printf 'ID   State      Output               E-Level  Times(r/u/s)   Command [run=1/1]\\n"
+                "0    running    /tmp/ts-out.abc                           sh t1.sh\\n"
+                "1    finished   /tmp/ts-out.def      0        0.01/0.00/0.00 sh t2.sh\\n"
+                "2    queued     (file)                                    sh t3.sh\\n'; echo {job_ids}",
+            bulk_status_cmd_output='{job_id,[0-9]+} {status,[a-z]+} {output}')))
+        commands = []
+        check_output = engine.agent.check_output
+
+        def count_output(cmd):
+            commands.append(cmd)
+            return check_output(cmd.split(';')[0])
+
+        engine.agent.check_output = count_output
+        engine._known_jobs = {'t1': '0', 't2': '1', 't3': '2'}
+        self.assertEqual(engine._get_job_status(['t1']), {'0': 'running', '1': 'finished', '2': 'queued'})
+        # all known jobs are queried in one command, and the status is cached
+        self.assertEqual(commands[0].split(';')[1], ' echo 0 1 2')
+        self.assertEqual(engine._query_job_status({'job_id': '2'}, 't3'), '2\tqueued\n')
+        self.assertEqual(len(commands), 1)
+        self.assertRaises(RuntimeError, engine._query_job_status, {'job_id': '3'}, 't4')
+        # jobs of finished tasks are no longer queried
+        engine._forget_jobs(['t2'])
+        self.assertEqual(engine._known_jobs, {'t1': '0', 't3': '2'})
+        engine._job_status_time = None
+        engine._get_job_status(['t1'])
+        self.assertEqual(commands[1].split(';')[1], ' echo 0 2')
+        # job ids are separated by commas in job_ids_csv, as required by squeue and sacct of Slurm
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, alias='slurm', scheduler='slurm',
+            submit_cmd='sbatch {job_file}', status_cmd='squeue -j {job_id}', kill_cmd='scancel {job_id}',
+            bulk_status_cmd="squeue -h -o '%i %T' -j {job_ids_csv}",
+            exit_status_cmd="sacct -X -n -P -d ' ' -o JobID,ExitCode,StdErr -j {job_ids_csv}", max_cmd_length=50)))
+        commands = []
+
+        def squeue(cmd):
+            commands.append(cmd)
+            return ''.join(f'{x} RUNNING\n' for x in cmd.split()[-1].split(','))
+
+        engine.agent.check_output = squeue
+        engine._known_jobs = {f't{x}': str(1230 + x) for x in range(6)}
+        self.assertEqual(engine._get_job_status(['t1']), {str(1230 + x): 'RUNNING' for x in range(6)})
+        self.assertEqual(commands, ["squeue -h -o '%i %T' -j 1230,1231,1232,1233,1234",
+            "squeue -h -o '%i %T' -j 1235"])
+        engine.max_cmd_length = 65536
+        self.assertEqual([x[1] for x in engine._bulk_commands('exit_status_cmd', ['1230', '1231'])],
+            ["sacct -X -n -P -d ' ' -o JobID,ExitCode,StdErr -j 1230,1231"])
+
+    def testBulkKill(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # a fake qdel that kills all jobs but 2.server, and exits with an error because of it
+            with open(os.path.join(tmp_dir, 'qdel'), 'w') as qdel:
+                qdel.write('#!/bin/sh\nfor job in "$@"; do\n  if [ "$job" = 2.server ]; then\n'
+                    '    echo "qdel: Unknown Job Id $job"; status=1\n  fi\ndone\nexit ${status:-0}\n')
+            os.chmod(os.path.join(tmp_dir, 'qdel'), 0o755)
+            engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG,
+                bulk_kill_cmd=os.path.join(tmp_dir, 'qdel') + ' {job_ids} 2>&1')))
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.set_many({'t1': {'job_id': '1.server'}, 't2': {'job_id': '2.server'}, 't3': {'job_id': '3.server'}})
+            # the output of the failed command is mapped to the job of each task
+            self.assertEqual(engine._bulk_kill_jobs(engine._get_job_ids(['t1', 't2', 't3'])),
+                {'t1': '', 't2': 'qdel: Unknown Job Id 2.server', 't3': ''})
+            self.assertEqual(engine._kill_jobs('t1\tkilled\nt2\tkilled\nt4\tcompleted\n'),
+                't1\tkilled\t\nt2\tkilled\tqdel: Unknown Job Id 2.server\nt4\tcompleted\t.\n')
+            # nothing is known about the jobs if the command fails without output
+            failing = PBS_TaskEngine(ShellAgent(dict(engine.config, bulk_kill_cmd='false {job_ids}')))
+            failing._job_ids = engine._job_ids
+            self.assertEqual(failing._bulk_kill_jobs(engine._get_job_ids(['t1', 't2'])), {})
+            engine._job_ids.close()
+
+    def testArrayJobIds(self):
+        config = dict(BASE_CONFIG, array_submit_cmd='qsub {job_file}', array_job_template='sos execute {array_tasks}',
+            bulk_status_cmd='qstat {job_ids}')
+        # job ids of array elements are listed with their status by bulk_status_cmd
+        for scheduler, output, line, base in [('pbs', '1234[].server', '1234[5].server R', 0),
+                ('slurm', 'Submitted batch job 1234', '1234_5 RUNNING', 0),
+                ('lsf', 'Job <1234> is submitted to queue <normal>.', '1234[5] RUN', 1),
+                ('sge', 'Your job-array 1234.1-10:1 ("test") has been submitted', '1234.5 r', 1)]:
+            engine = PBS_TaskEngine(ShellAgent(dict(config, scheduler=scheduler)))
+            self.assertEqual(engine.array_index_base, base)
+            job_id = engine._array_element_id(engine._extract_job_id(output, 'array_submit_cmd_output'), 5)
+            self.assertEqual(engine._parsers['bulk_status_cmd_output'].extract([line])['job_id'], [job_id])
+        # elements take the status of their arrays if only arrays or ranges of elements are listed,
+        # e.g. by qstat of PBS without -t and by squeue of Slurm without -r
+        for scheduler, array_job_id, lines in [('pbs', '1234[].server', '1234[].server B\n'),
+                ('slurm', '1234', '1234_[5-7,9%%2] PENDING\n1234_4 RUNNING\n')]:
+            engine = PBS_TaskEngine(ShellAgent(dict(config, scheduler=scheduler,
+                bulk_status_cmd=f"printf '{lines}'")))
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+                engine._job_ids.set_many({f't{x}': {'job_id': engine._array_element_id({'job_id': array_job_id}, x),
+                    'array_job_id': array_job_id, 'array_index': x} for x in range(4, 11)})
+                dead = ['t8', 't10'] if scheduler == 'slurm' else []
+                self.assertEqual(engine._dead_tasks([f't{x}' for x in range(4, 11)]), dead)
+                engine._job_ids.close()
+        # array_job_id is required without a scheduler
+        engine = PBS_TaskEngine(ShellAgent(dict(config, array_job_id='{array_base}[{index}]{array_suffix}')))
+        self.assertEqual(engine._array_element_id(engine._extract_job_id('1234[]', 'array_submit_cmd_output'), 5), '1234[5]')
+        self.assertRaises(ValueError, PBS_TaskEngine, ShellAgent(config))
+        config.pop('array_job_template')
+        self.assertRaises(ValueError, PBS_TaskEngine, ShellAgent(dict(config, scheduler='pbs')))
+
+    def testSubmitWorkers(self):
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, submit_workers=3)))
+        task_ids = [f'task{i}' for i in range(10)]
+        sent = []
+        lock = threading.Lock()
+        in_flight = [0, 0]
+        task5_started = threading.Event()
+
+        def submit_job_script(task_id, runtime):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            if task_id == 'task5':
+                task5_started.set()
+            if task_id == 'task4':
+                # submission of task4 fails while task3 and task5 are being submitted
+                task5_started.wait(5)
+            else:
+                time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return None if task_id == 'task4' else f'{task_id}.job_id'
+
+        engine._write_job_scripts = lambda task_ids: ([{} for x in task_ids], [f'{x}.sh' for x in task_ids])
+        engine._send_task_files = lambda task_files: sent.append(list(task_files))
+        engine._submit_job_script = submit_job_script
+        self.assertFalse(engine._prepare_scripts(task_ids))
+        # at most submit_workers tasks are submitted at a time
+        self.assertEqual(in_flight, [0, 3])
+        # no task is submitted after the failure, and the job id files of
+        # tasks submitted before the failure are sent to the remote host
+        self.assertEqual(sent[0], [f'task{i}.sh' for i in range(10)])
+        self.assertEqual(sorted(sent[1]), [f'task{i}.job_id' for i in range(6) if i != 4])
+
+    def testSendFiles(self):
+        task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        task_files = [os.path.join(task_dir, 'send_files_test1.sh'), os.path.join(task_dir, 'send_files_test', 'test2.sh')]
+        os.makedirs(os.path.dirname(task_files[1]), exist_ok=True)
+        for task_file in task_files:
+            with open(task_file, 'w') as script:
+                script.write(os.path.basename(task_file))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            remote_dir = os.path.join(tmp_dir, 'remote')
+            # a fake rsync that copies files listed by --files-from to remote_dir
+            with open(os.path.join(tmp_dir, 'rsync'), 'w') as rsync:
+                rsync.write(f'#!{sys.executable}\nimport os, shutil, sys\n'
+                    f'open({os.path.join(tmp_dir, "rsync.args")!r}, "w").write(repr(sys.argv[1:]))\n'
+                    'file_list = [x.split("=", 1)[1] for x in sys.argv if x.startswith("--files-from=")][0]\n'
+                    'for name in open(file_list).read().split():\n'
+                    f'    os.makedirs(os.path.dirname(os.path.join({remote_dir!r}, name)), exist_ok=True)\n'
+                    f'    shutil.copy(os.path.join(sys.argv[-2], name), os.path.join({remote_dir!r}, name))\n'
+                    'sys.exit(1 if "fail" in sys.argv[-1] else 0)\n')
+            os.chmod(os.path.join(tmp_dir, 'rsync'), 0o755)
+            agent = SSHAgent(dict(BASE_CONFIG), tmp_dir)
+            agent.address, agent.port = 'localhost', 22
+            engine = PBS_TaskEngine(agent)
+            path = os.environ['PATH']
+            os.environ['PATH'] = tmp_dir + os.pathsep + path
+            try:
+                # task files, including files in sub-directories of ~/.sos/tasks, are sent in one transfer
+                engine._send_files(task_files)
+                with open(os.path.join(tmp_dir, 'rsync.args')) as args:
+                    self.assertIn('localhost:.sos/tasks/', args.read())
+                for task_file in task_files:
+                    with open(os.path.join(remote_dir, os.path.relpath(task_file, task_dir))) as script:
+                        self.assertEqual(script.read(), os.path.basename(task_file))
+                self.assertEqual(agent.sent, [])
+                # a single task file is sent by the agent
+                engine._send_files(task_files[:1])
+                self.assertEqual(agent.sent, ['send_files_test1.sh'])
+                # and so are task files on a host that shares the file system, without
+                # files in sub-directories of ~/.sos/tasks, which are already in place
+                engine._local_agent = True
+                engine._send_files(task_files)
+                self.assertEqual(agent.sent, ['send_files_test1.sh', 'send_files_test1.sh'])
+                engine._local_agent = False
+                agent.address = 'fail'
+                self.assertRaises(RuntimeError, engine._send_files, task_files)
+            finally:
+                os.environ['PATH'] = path
+                shutil.rmtree(os.path.dirname(task_files[1]))
+                os.remove(task_files[0])
+
+    def testTimingFile(self):
+        config = dict(BASE_CONFIG)
+        # timing is only saved on request
+        self.assertIsNone(PBS_TaskEngine(ShellAgent(config)).timing_file)
+        engine = PBS_TaskEngine(ShellAgent(dict(config, timing_file=True)))
+        engine._timer_run_id = 'run1'
+        self.assertEqual(engine._timing_file(), os.path.join(os.path.expanduser('~'), '.sos', 'pbs_timing', 'pbs_run1.json'))
+        # engines are not kept alive by the exit handler that saves their timing
+        engine_ref = weakref.ref(engine)
+        del engine
+        gc.collect()
+        self.assertIsNone(engine_ref())
+
+    def testTraceFile(self):
+        config = dict(BASE_CONFIG)
+        # each process writes its own trace file
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for trace_file, expected in [('trace.jsonl', f'trace_{os.getpid()}.jsonl'),
+                    ('{alias}-{pid}.jsonl', f'pbs-{os.getpid()}.jsonl')]:
+                engine = PBS_TaskEngine(ShellAgent(dict(config, trace_file=os.path.join(temp_dir, trace_file))))
+                engine._trace.close()
+                self.assertEqual(engine._trace.trace_file, os.path.join(temp_dir, expected))
+                self.assertTrue(os.path.isfile(os.path.join(temp_dir, expected)))
+
+    def testStatusCacheFile(self):
+        config = dict(BASE_CONFIG, bulk_status_cmd='printf "1 R\\n2 Q\\n"', bulk_status_cmd_output='{job_id} {status}')
+        # status is only shared between processes on request
+        self.assertIsNone(PBS_TaskEngine(ShellAgent(config))._status_cache)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            commands = []
+            engines = [PBS_TaskEngine(ShellAgent(dict(config,
+                status_cache_file=os.path.join(temp_dir, '{alias}.json')))) for i in range(2)]
+            for engine in engines:
+                check_output = engine.agent.check_output
+                engine.agent.check_output = lambda cmd, check_output=check_output: commands.append(cmd) or check_output(cmd)
+                engine._known_jobs = {'t1': '1', 't2': '2'}
+                self.assertEqual(engine._get_job_status(['t1']), {'1': 'R', '2': 'Q'})
+            # the second engine uses the status queried by the first one
+            self.assertEqual(len(commands), 1)
+            self.assertTrue(os.path.isfile(os.path.join(temp_dir, 'pbs.json')))
+
+    def testPackTasks(self):
+        resources = {f'task{i}': (2, 1000, 600) for i in range(10)}
+        resources['big'] = (16, 1000, 600)
+        resources['long'] = (1, 1000, 36000)
+        bundles, single_tasks = pack_tasks(resources, 8, 4000, 7200)
+        self.assertEqual(sorted(single_tasks), ['big', 'long'])
+        self.assertEqual(sorted(len(x) for x in bundles), [2, 4, 4])
+        self.assertEqual(sorted(sum(bundles, [])), sorted(f'task{i}' for i in range(10)))
+        # limited by memory
+        bundles, single_tasks = pack_tasks(resources, 8, 2000)
+        self.assertEqual(max(len(x) for x in bundles), 2)
+        self.assertEqual(single_tasks, ['big'])
+
+    def testBundles(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, submit_cmd='echo 100.server',
+                kill_cmd='echo killed {job_id}', bulk_status_cmd=f'cat {tmp_dir}/status',
+                bundle_job_template='#PBS -l ncpus={cores}\n{commands}\n', bundle_task_cmd='sos execute {task}',
+                bundle_cores=4)))
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.export_file = lambda task_id: task_id + '.job_id'
+            engine._send_task_files = lambda files: None
+            engine._get_runtimes = lambda task_ids: [{'task': x, 'job_name': x, 'run_mode': 'run', 'nodes': 1,
+                'cores': 2 if x == 't3' else 1, 'walltime': '00:10:00', 'depend': ''} for x in task_ids]
+            commands = []
+            check_output = engine.agent.check_output
+            engine.agent.check_output = lambda cmd: commands.append(cmd) or check_output(cmd)
+            job_file = None
+            try:
+                # tasks are submitted in one job that executes them in parallel
+                self.assertTrue(engine._prepare_bundles(['t1', 't2', 't3']))
+                self.assertEqual(len(commands), 1)
+                job_ids = engine._get_job_ids(['t1', 't2', 't3'])
+                bundle = job_ids['t1']['bundle']
+                job_file = os.path.join(os.path.expanduser('~'), '.sos', 'tasks', bundle + '.sh')
+                with open(job_file) as job:
+                    self.assertEqual(job.read(), '#PBS -l ncpus=4\n(sos execute t3) &\n(sos execute t1) &\n'
+                        '(sos execute t2) &\nwait\n')
+                # and the job id of the bundle is the job id of each task
+                self.assertEqual({x: (y['job_id'], y['bundle'], y['bundle_size']) for x, y in job_ids.items()},
+                    {x: ('100.server', bundle, 3) for x in ('t1', 't2', 't3')})
+                with open(os.path.join(tmp_dir, 'status'), 'w') as status:
+                    status.write('100.server R\n')
+                self.assertEqual(engine._dead_tasks(['t1', 't2', 't3']), [])
+                # the job is kept until all its tasks are killed, and is then killed once
+                self.assertEqual(engine._kill_jobs('t1\tkilled\nt2\tkilled\n'),
+                    f't1\tkilled\tjob 100.server is kept for other tasks in {bundle}\n'
+                    f't2\tkilled\tjob 100.server is kept for other tasks in {bundle}\n')
+                del commands[:]
+                self.assertEqual(engine._kill_jobs('t1\tkilled\nt2\tkilled\nt3\tkilled\n'),
+                    't1\tkilled\tkilled 100.server\n\nt2\tkilled\tkilled 100.server\n\nt3\tkilled\tkilled 100.server\n\n')
+                self.assertEqual(commands, ['echo killed 100.server'])
+            finally:
+                engine._job_ids.close()
+                if job_file and os.path.isfile(job_file):
+                    os.remove(job_file)
+
+    def testDeadJobs(self):
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, bulk_status_cmd="printf '1 R\\n2 C\\n'",
+            exit_status_cmd="printf '2 1 /tmp/job 2.err\\n3 271 /tmp/job3.err\\n'")))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.set_many({f't{x}': {'job_id': str(x)} for x in range(1, 4)})
+            # job 2 has finished and job 3 is no longer listed
+            self.assertEqual(engine._dead_tasks(['t1', 't2', 't3']), ['t2', 't3'])
+            self.assertEqual(engine._query_exit_status(['2', '3']), {'2': {'exit_code': '1', 'stderr': '/tmp/job 2.err'},
+                '3': {'exit_code': '271', 'stderr': '/tmp/job3.err'}})
+            self.assertEqual(engine._failure_message('t2', {'job_id': '2', 'job_status': 'C', 'exit_code': '1'}),
+                'Task t2 failed because job 2 finished with status C before the task was started, with exit code 1')
+            # tasks of array jobs are pending in sos until they are started, and are taken as
+            # submitted if their jobs are submitted after their task files are written
+            task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+            os.makedirs(task_dir, exist_ok=True)
+            array_tasks = ['pbs_array_t1', 'pbs_array_t2']
+            try:
+                for task_id in array_tasks:
+                    with open(os.path.join(task_dir, task_id + '.task'), 'w'):
+                        pass
+                engine._job_ids.set_many({'pbs_array_t1': {'job_id': '4[1]', 'submit_time': time.time() + 1},
+                    'pbs_array_t2': {'job_id': '4[2]', 'submit_time': time.time() - 100}})
+                self.assertEqual(engine._submitted_tasks(array_tasks + ['t1']), ['pbs_array_t1'])
+                # and their jobs are dead if they are not listed
+                self.assertEqual(engine._dead_tasks(['pbs_array_t1']), ['pbs_array_t1'])
+            finally:
+                for task_id in array_tasks:
+                    os.remove(os.path.join(task_dir, task_id + '.task'))
+            # jobs listed by bulk_status_cmd are alive even if it fails because of unknown jobs,
+            # but no job is taken as dead if it fails without output
+            for cmd, dead in [("printf '1 R\\n'; echo qstat: Unknown Job Id 3; exit 153", ['t2', 't3']),
+                    ("echo qstat: cannot connect to server >&2; exit 1", [])]:
+                failing = PBS_TaskEngine(ShellAgent(dict(engine.config, bulk_status_cmd=cmd)))
+                failing._job_ids = engine._job_ids
+                self.assertEqual(failing._dead_tasks(['t1', 't2', 't3']), dead)
+            engine._job_ids.close()
+        # without bulk_status_cmd, jobs are dead only if status_cmd reports them as unknown
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG,
+            status_cmd='case {job_id} in 1) echo 1 R;; 2) echo qstat: Unknown Job Id 2 >&2; exit 153;; '
+                '*) echo qstat: cannot connect to server >&2; exit 1;; esac')))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.set_many({f't{x}': {'job_id': str(x)} for x in range(1, 4)})
+            self.assertEqual(engine._dead_tasks(['t1', 't2', 't3', 't4']), ['t2', 't4'])
+            # which are not run for every status check unless poll_status_cmd is set
+            engine._sos_status = lambda task_ids: {x: 'submitted' for x in task_ids}
+            engine._record_failed_jobs = lambda task_ids: None
+            self.assertEqual(engine._check_status({'t2': 'submitted'}), {})
+            engine.poll_status_cmd = True
+            self.assertEqual(engine._check_status({'t2': 'submitted'}), {'t2': 'failed'})
+            engine._job_ids.close()
+
+    def testTaskSpoolerStatus(self):
+        # status of task spooler jobs as configured by build_test_docker.sh
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, alias='ts', submit_cmd='tsp -L {task} sh {job_file}',
+            status_cmd='tsp -s {job_id}', kill_cmd='tsp -r {job_id}', status_cache_ttl=0,
+            bulk_status_cmd="printf 'ID   State      Output               E-Level  Times(r/u/s)   Command [run=1/1]\\n"
+                "0    running    /tmp/ts-out.abc                           sh t1.sh\\n"
+                "1    finished   /tmp/ts-out.def      0        0.01/0.00/0.00 sh t2.sh\\n"
+                "2    queued     (file)                                    sh t3.sh\\n'",
+            bulk_status_cmd_output='{job_id,[0-9]+} {status,[a-z]+} {output}', finished_status=['finished', 'skipped'])))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.set_many({f't{x}': {'job_id': str(x - 1)} for x in range(1, 5)})
+            self.assertEqual(engine._get_job_status(['t1']), {'0': 'running', '1': 'finished', '2': 'queued'})
+            self.assertEqual(engine._dead_tasks(['t1', 't2', 't3', 't4']), ['t2', 't4'])
+            # jobs of finished tasks are no longer queried
+            engine._forget_jobs(['t2', 't4'])
+            self.assertEqual(engine._known_jobs, {'t1': '0', 't3': '2'})
+            engine._job_ids.close()
+
+    def testSharedJobScripts(self):
+        config = dict(BASE_CONFIG, shared_job_script=True,
+            job_template='#!/bin/bash\n#PBS -l walltime={walltime}\nsos execute {task} -v {verbosity}\n',
+            submit_cmd='qsub -v SOS_TASK={task} -N {job_name} {job_file}')
+        runtimes = [{'task': x, 'job_name': x, 'job_file': f'~/.sos/tasks/{x}.sh', 'walltime': '01:00:00',
+            'verbosity': 1} for x in ('t1', 't2')]
+        engine = PBS_TaskEngine(ShellAgent(config))
+        job_files = engine._write_shared_job_scripts(['t1', 't2'], runtimes)
+        try:
+            self.assertEqual(len(job_files), 1)
+            self.assertEqual(runtimes[0]['job_file'], runtimes[1]['job_file'])
+            with open(job_files[0]) as job:
+                self.assertEqual(job.read(), '#!/bin/bash\n#PBS -l walltime=01:00:00\nsos execute ${SOS_TASK} -v 1\n')
+        finally:
+            os.remove(job_files[0])
+        # variables are not expanded in directives, so tasks are submitted with their own scripts
+        engine = PBS_TaskEngine(ShellAgent(dict(config, job_template='#!/bin/bash\n#PBS -N {job_name}\nsos execute {task}\n')))
+        runtimes = [{'task': x, 'job_name': x, 'job_file': f'~/.sos/tasks/{x}.sh'} for x in ('t1', 't2')]
+        self.assertIsNone(engine._write_shared_job_scripts(['t1', 't2'], runtimes))
+        self.assertFalse(engine.shared_job_script)
+        self.assertEqual(runtimes[0]['job_file'], '~/.sos/tasks/t1.sh')
+
+    def testPilotScript(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            queue = os.path.join(tmp_dir, 'queue')
+            os.makedirs(queue)
+            with open(os.path.join(queue, 'pilot.sh'), 'w') as script:
+                script.write(PILOT_SCRIPT)
+            with open(os.path.join(tmp_dir, 'sos'), 'w') as sos:
+                sos.write(f'#!/bin/sh\necho $2 >> {tmp_dir}/executed\n')
+            os.chmod(os.path.join(tmp_dir, 'sos'), 0o755)
+            for task_id, walltime, cores, mem in [('small', 60, 1, 0), ('wide', 60, 4, 0), ('long', 7200, 1, 0),
+                    ('large', 60, 1, 2 ** 32), ('medium', 600, 2, 2 ** 30)]:
+                with open(os.path.join(queue, task_id + '.run'), 'w') as run:
+                    run.write(f'cur_dir={tmp_dir}\nverbosity=1\nsig_mode=default\n'
+                        f'walltime={walltime}\ncores={cores}\nmem={mem}\n')
+            # a pilot with 2 cores, 4G of memory and 1 hour of walltime takes the tasks that fit
+            # in its resources, and quits when there is no such task for idle_time seconds
+            subprocess.check_call(f'bash {queue}/pilot.sh 3600 0 p1 2 {2 ** 32}', shell=True,
+                env=dict(os.environ, PATH=tmp_dir + os.pathsep + os.environ['PATH']))
+            with open(os.path.join(tmp_dir, 'executed')) as executed:
+                self.assertEqual(sorted(executed.read().split()), ['large', 'medium', 'small'])
+            self.assertEqual(sorted(os.listdir(queue)), ['long.run', 'pilot.sh', 'running', 'wide.run'])
+            self.assertEqual(os.listdir(os.path.join(queue, 'running')), [])
+
+    def testPilots(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, alias='pbs_test_pilots', status_cache_ttl=0,
+                submit_cmd='echo {job_name}', bulk_status_cmd=f'cat {tmp_dir}/status', pilots=2,
+                pilot_walltime='01:00:00', pilot_job_template='#PBS -l ncpus={cores}\n{pilot_cmd}\n')))
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.export_file = lambda task_id: task_id + '.job_id'
+            engine._send_task_files = lambda files: None
+            self.assertEqual(engine._pilot_task_walltime(), 3540)
+            pilots = []
+            try:
+                # pilots are large enough for the largest task in the queue
+                engine._pilot_tasks = {'t1': (1, 0), 't2': (4, 0)}
+                engine._start_pilots()
+                self.assertEqual(list(engine._pilot_jobs.values()), [(4, 0), (4, 0)])
+                pilots.extend(engine._pilot_jobs)
+                with open(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', pilots[0] + '.sh')) as job:
+                    self.assertEqual(job.read().split('\n')[0], '#PBS -l ncpus=4')
+                # the second pilot has quit, and is replaced while t2 is still in the queue
+                with open(os.path.join(tmp_dir, 'status'), 'w') as status:
+                    status.write(f'{pilots[0]} R\n{pilots[1]} C\n')
+                engine._check_pilots({'t1': 'completed', 't2': 'pending'})
+                self.assertEqual(list(engine._pilot_tasks), ['t2'])
+                self.assertEqual(len(engine._pilot_jobs), 2)
+                self.assertTrue(pilots[0] in engine._pilot_jobs and pilots[1] not in engine._pilot_jobs)
+                pilots.extend(engine._pilot_jobs)
+                # no pilot is started after all tasks are started
+                with open(os.path.join(tmp_dir, 'status'), 'w') as status:
+                    status.write('')
+                engine._check_pilots({'t2': 'running'})
+                self.assertEqual(engine._pilot_tasks, {})
+                self.assertEqual(len(engine._pilot_jobs), 2)
+            finally:
+                engine._job_ids.close()
+                shutil.rmtree(engine._pilot_dir())
+                for pilot_id in set(pilots):
+                    os.remove(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', pilot_id + '.sh'))
+
+    def testSubmitRetries(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # a fake qsub that records jobs as "job_id,job_name" in jobs, and fails as specified by its first argument
+            with open(os.path.join(tmp_dir, 'qsub'), 'w') as qsub:
+                qsub.write(f'#!/bin/sh\nn=$(( $(cat {tmp_dir}/counter 2>/dev/null || echo 0) + 1 ))\necho $n > {tmp_dir}/counter\n'
+                    f'case $1 in\n'
+                    f'busy) [ $n -lt 3 ] && echo "qsub: would exceed queue limit of jobs" >&2 && exit 38 ;;\n'
+                    f'bad) echo "qsub: Job rejected by all possible destinations" >&2; exit 1 ;;\n'
+                    f'esac\necho $n.server,$2 >> {tmp_dir}/jobs\necho $n.server\n')
+            os.chmod(os.path.join(tmp_dir, 'qsub'), 0o755)
+            engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, submit_retry_interval=0,
+                find_job_cmd=f'grep ,{{job_name}} {tmp_dir}/jobs | cut -d, -f1')))
+
+            def submit(mode):
+                for name in ('counter', 'jobs'):
+                    if os.path.isfile(os.path.join(tmp_dir, name)):
+                        os.remove(os.path.join(tmp_dir, name))
+                return engine._submit_job(f'{tmp_dir}/qsub {mode} job_{mode}', f'job_{mode}')
+
+            def num_calls():
+                with open(os.path.join(tmp_dir, 'counter')) as counter:
+                    return int(counter.read())
+            # transient errors of the scheduler are retried
+            self.assertEqual(submit('busy'), {'job_id': '3.server'})
+            self.assertEqual(num_calls(), 3)
+            # other errors are not retried, and are reported with stderr of the command
+            with self.assertRaisesRegex(RuntimeError, 'Job rejected by all possible destinations'):
+                submit('bad')
+            self.assertEqual(num_calls(), 1)
+            # a job submitted before the connection was lost is not submitted again
+            check_output = engine.agent.check_output
+
+            def lose_connection(cmd):
+                engine.agent.check_output = check_output
+                check_output(cmd)
+                raise subprocess.CalledProcessError(255, 'ssh')
+            engine.agent.check_output = lose_connection
+            self.assertEqual(submit('lost'), {'job_id': '1.server'})
+            self.assertEqual(num_calls(), 1)
+            self.assertFalse(os.path.exists(os.path.join(os.path.expanduser('~'), '.sos', 'tasks', 'job_busy.submit_err')))
+
+    def testThrottle(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            count_file = os.path.join(tmp_dir, 'count')
+            with open(count_file, 'w') as count:
+                count.write('3\n')
+            engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, submit_retry_interval=0, max_queued_jobs=4,
+                queued_count_cmd=f'cat {count_file}')))
+            engine.submit_retry_interval = 0.1
+            # an array of 2 jobs waits until there are 2 free slots
+            reserved = threading.Thread(target=engine._reserve_slots, args=(2,))
+            reserved.start()
+            reserved.join(1)
+            self.assertTrue(reserved.is_alive())
+            with open(count_file, 'w') as count:
+                count.write('2\n')
+            reserved.join(5)
+            self.assertFalse(reserved.is_alive())
+            self.assertEqual(engine._queued_count, 4)
+        # finished jobs are not counted from the bulk status of jobs
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, max_queued_jobs=4,
+            bulk_status_cmd="printf '1 R\\n2 C\\n3 Q\\n'")))
+        engine._known_jobs = {'t1': '1', 't2': '2', 't3': '3', 't4': '4'}
+        self.assertEqual(engine._count_queued_jobs(), 2)
+
+    def testJobEvents(self):
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, submit_cmd='sbatch {job_file}',
+            status_cmd='squeue -j {job_id}', kill_cmd='scancel {job_id}', status_cache_ttl=0,
+            events_cmd='sacct -S {since_time}')))
+        commands = []
+
+        def check_output(cmd):
+            # the host is an hour ahead of the local host, in UTC
+            commands.append(cmd)
+            if cmd.startswith('date'):
+                return f'{int(time.time()) + 3600}_+0000\n'
+            return '1 RUNNING\n'
+
+        engine.agent.check_output = check_output
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.set_many({'t1': {'job_id': '1'}})
+            # 2023-11-14T22:13:20 UTC
+            engine._events_cursor = 1700000000
+            self.assertEqual(engine._get_job_status(['t1']), {'1': 'RUNNING'})
+            self.assertEqual(commands, ['date +%s_%z', 'sacct -S 2023-11-14T22:13:20'])
+            # the next query starts from the time of the host
+            self.assertAlmostEqual(engine._events_cursor, time.time() + 3600, delta=2)
+            engine._get_job_status(['t1'])
+            self.assertEqual(len(commands), 3)
+            # status of jobs of finished tasks is forgotten
+            engine._forget_jobs(['t1'])
+            self.assertEqual((engine._known_jobs, engine._job_status), ({}, {}))
+            engine._job_ids.close()
+
+    def testResumeSubmission(self):
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, bulk_status_cmd="printf '1 R\\n2 C\\n'",
+            find_job_cmd='case {job_name} in t3) echo 3;; esac')))
+        task_dir = os.path.join(os.path.expanduser('~'), '.sos', 'tasks')
+        os.makedirs(task_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            sent = []
+            engine._send_task_files = lambda files: sent.extend(files)
+            engine._job_ids.export_file = lambda task_id: task_id + '.job_id'
+            # submission of t1, t2 and t3 was interrupted after t1 and t2 were submitted
+            engine._job_ids.begin_submission(['t1', 't2', 't3'], 'pbs')
+            engine._job_ids.set_many({'t1': {'job_id': '1', 'submit_time': 0}, 't2': {'job_id': '2'}})
+            engine._job_ids.begin_submission(['t4'], 'other')
+            # job script of t1 is older than its task file, which is written again by prepare_task
+            job_file = os.path.join(task_dir, 'pbs_resume_t1.sh')
+            try:
+                with open(job_file, 'w'):
+                    pass
+                os.utime(job_file, (0, 0))
+                engine._job_ids.begin_submission(['pbs_resume_t1'], 'pbs')
+                engine._job_ids.set_many({'pbs_resume_t1': {'job_id': '1'}})
+                # job 1 is still running and a job named t3 was submitted before the interruption,
+                # so t1 and t3 are not submitted again
+                self.assertEqual(engine._resume_submission(['t1', 't2', 't3', 't4', 't5', 'pbs_resume_t1']),
+                    ['t2', 't4', 't5'])
+                self.assertEqual(list(engine._job_ids.get_journal(['t1', 't2', 't3']).keys()), ['t2'])
+                self.assertEqual({x: engine._known_jobs[x] for x in ('t1', 't3', 'pbs_resume_t1')},
+                    {'t1': '1', 't3': '3', 'pbs_resume_t1': '1'})
+                # and are taken as submitted by sos and by _submitted_tasks
+                self.assertEqual(sent, ['t1.job_id', 't3.job_id', job_file, 'pbs_resume_t1.job_id'])
+                self.assertAlmostEqual(os.path.getmtime(job_file), time.time(), delta=5)
+                self.assertAlmostEqual(engine._job_ids.get('t1')['submit_time'], time.time(), delta=5)
+            finally:
+                os.remove(job_file)
+            engine._job_ids.close()
+
+    def testFailedSubmissions(self):
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG)))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.export_file = lambda task_id: task_id + '.job_id'
+
+            def submit_group(task_ids):
+                engine._write_job_id('t1', {'job_id': '1'})
+                raise RuntimeError('Failed to submit task t2')
+            engine._submit_group = submit_group
+            # t1 is kept as submitted, and the tasks that are not submitted are reported failed
+            self.assertTrue(engine._submit_tasks(['t1', 't2', 't3']))
+            self.assertEqual(engine._failed_submissions(['t1', 't2', 't3']), ['t2', 't3'])
+            self.assertEqual(engine._check_status({'t2': 'pending', 't3': 'running'}), {'t2': 'failed'})
+            # a batch with no submitted task fails as a whole
+            engine._submit_group = lambda task_ids: False
+            self.assertFalse(engine._submit_tasks(['t4']))
+            # the failed submission is cleared when the task is submitted again
+            engine._submit_group = lambda task_ids: [engine._write_job_id(x, {'job_id': x}) for x in task_ids]
+            self.assertTrue(engine._submit_tasks(['t2']))
+            self.assertEqual(engine._failed_submissions(['t2', 't3', 't4']), ['t3', 't4'])
+            engine._job_ids.close()
+
+    def testOrderTasks(self):
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, scheduler='slurm',
+            submit_cmd='sbatch --nice={priority} {job_file}', status_cmd='squeue -j {job_id}',
+            kill_cmd='scancel {job_id}')))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            # tasks are only ordered on request
+            self.assertFalse(engine.order_tasks)
+            engine._task_runtimes = {'short': {'walltime': '00:10:00', 'cores': 1}, 'long': {'walltime': '02:00:00', 'cores': 1},
+                'wide': {'walltime': '00:10:00', 'cores': 8}, 'before_long': {'walltime': '01:00:00', 'cores': 1},
+                'after': {'walltime': '02:00:00', 'cores': 1}, 'urgent': {'cores': 1}}
+            engine.add_dependencies({'after': 'before_long'})
+            engine.set_priorities({'urgent': 1})
+            # tasks with the longest path through their downstream tasks go first
+            self.assertEqual(engine._order_tasks(['short', 'long', 'wide', 'before_long', 'after', 'urgent']),
+                ['urgent', 'before_long', 'long', 'after', 'wide', 'short'])
+            # and their jobs are given lower nice values
+            self.assertEqual(engine._batch_priority, {'urgent': 0, 'before_long': 20, 'long': 40, 'after': 60, 'wide': 80, 'short': 100})
+            # jobs of tasks that are not ordered are given the priority in the middle of the range
+            self.assertEqual(engine._make_runtime('other', {})['priority'], 50)
+            self.assertEqual(engine._make_runtime('short', {})['priority'], 100)
+            # runtime of completed tasks of a step, which is saved with their job ids
+            engine._job_ids.set_many({'t1': {'job_id': '1', 'step': '/tmp/wf.sos:align'}, 't2': {'job_id': '2'},
+                't3': {'job_id': '3', 'step': '/tmp/wf.sos:align'}})
+            engine._save_history([['t1', 'align wf1', '100.5', '200.0', '300.0', 'completed'], ['t2', 'align wf1', '100.5', '200.0', '300.0', 'completed'],
+                ['t3', 'align wf1', '', 'running']])
+            self.assertEqual(engine._job_ids.get_history_many('pbs', ['/tmp/wf.sos:align', 'align']), {'/tmp/wf.sos:align': [(300.0, None)]})
+            # tasks that have been saved, for example by another engine, keep their records and time
+            saved_time = engine._job_ids.conn.execute("SELECT time FROM history WHERE task_id='t1'").fetchone()[0]
+            engine._history_tasks.clear()
+            engine._peak_mem = lambda *args: self.fail('peak memory of saved task is read')
+            engine._save_history([['t1', 'align wf1', '100.5', '200.0', '500.0', 'completed']])
+            self.assertEqual(engine._job_ids.get_history_many('pbs', ['/tmp/wf.sos:align']), {'/tmp/wf.sos:align': [(300.0, None)]})
+            self.assertEqual(engine._job_ids.conn.execute("SELECT time FROM history WHERE task_id='t1'").fetchone()[0], saved_time)
+            # except that their peak memory is filled in once known
+            engine._job_ids.add_history_many('pbs', {'t1': ('/tmp/wf.sos:align', 500.0, 1e9)})
+            self.assertEqual(engine._job_ids.get_history_many('pbs', ['/tmp/wf.sos:align']), {'/tmp/wf.sos:align': [(300.0, 1e9)]})
+            engine._job_ids.close()
+
+    def testRightsize(self):
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, rightsize=True, rightsize_percentile=90,
+            rightsize_min_tasks=3)))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.add_history_many('pbs', {f'a{i}': ('align', 100.0 * i, 1e9) for i in range(1, 11)})
+            engine._job_ids.add_history_many('pbs', {'c1': ('call', 100.0, 1e9)})
+            engine._task_steps = {'t1': 'align', 't2': 'call', 't3': 'align'}
+            runtimes = engine._rightsize(['t1', 't2', 't3'], [{'walltime': '10:00:00', 'mem': 4000000000},
+                {'walltime': '10:00:00', 'mem': 4000000000}, {'walltime': '00:10:00'}])
+            # 90th percentile of runtime and peak memory of align, plus 25%
+            self.assertEqual(runtimes[0], {'walltime': '00:20:51', 'mem': 1250000001})
+            # without enough history, or if more resources would be needed
+            self.assertEqual(runtimes[1:], [{'walltime': '10:00:00', 'mem': 4000000000}, {'walltime': '00:10:00'}])
+            self.assertEqual(engine._rightsized, {'t1': {'walltime': '00:20:51', 'mem': 1250000001,
+                'requested_walltime': '10:00:00', 'requested_mem': 4000000000}})
+            engine._job_ids.close()
+
+    def testRetryRightsized(self):
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, rightsize=True,
+            exit_status_cmd="printf '1 271 1.err\\n2 1 2.err\\n3 -29 3.err\\n'")))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            reduced = {'walltime': '00:10:00', 'requested_walltime': '10:00:00'}
+            engine._job_ids.set_many({'t1': dict(reduced, job_id='1'), 't2': dict(reduced, job_id='2'),
+                't3': dict(reduced, job_id='3', killed=True), 't4': dict(reduced, job_id='4')})
+            submitted = []
+            engine._submit_tasks = lambda task_ids: submitted.extend(task_ids) or True
+            engine._dead_tasks = lambda task_ids: []
+            status = {'t1': 'failed', 't2': 'failed', 't3': 'aborted', 't4': 'completed'}
+            # tasks are not submitted again by an engine that has not submitted them
+            self.assertEqual(engine._retry_rightsized(status), {})
+            # only the task killed for exceeding its walltime is submitted again
+            engine._reduced_tasks.update(['t1', 't2', 't3', 't4'])
+            self.assertEqual(engine._retry_rightsized(status), {'t1': 'submitted'})
+            self.assertEqual(submitted, ['t1'])
+            self.assertEqual(engine._reduced_tasks, set())
+            # and is reported as submitted until its new job starts or dies
+            self.assertEqual(engine._retry_rightsized(status), {'t1': 'submitted'})
+            engine._dead_tasks = lambda task_ids: task_ids
+            self.assertEqual(engine._retry_rightsized(status), {})
+            self.assertEqual(submitted, ['t1'])
+            self.assertEqual(engine._requested_resources, set())
+            engine._job_ids.close()
+
+    def testDependencies(self):
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, scheduler='slurm', submit_cmd='sbatch {depend} {job_file}',
+            status_cmd='squeue -j {job_id}', kill_cmd='scancel {job_id}')))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.set_many({'t1': {'job_id': '11'}, 't2': {'job_id': '12'}})
+            engine.add_dependencies({'t3': ['t1', 't2'], 't4': 't3', 't5': []})
+            # upstream tasks are submitted before their downstream tasks
+            self.assertEqual(engine._dependency_groups(['t4', 't3', 't5']), [['t3', 't5'], ['t4']])
+            self.assertEqual(engine._depend_option(['t3']), '--kill-on-invalid-dep=yes --dependency=afterok:11:12')
+            self.assertEqual(engine._depend_option(['t5']), '')
+            self.assertRaises(RuntimeError, engine._depend_option, ['t4'])
+            # downstream tasks of failed tasks are killed, as are their downstream tasks
+            engine._job_ids.set_many({'t3': {'job_id': '13'}})
+            self.assertEqual(engine._depend_option(['t4']), '--kill-on-invalid-dep=yes --dependency=afterok:13')
+            self.assertEqual(engine._failed_dependents({'t1': 'completed', 't2': 'running'}), [])
+            commands = []
+            engine.agent.check_output = lambda cmd: commands.append(cmd) or 't3\tkilled\nt4\tkilled\n'
+            engine.mark_ready()
+            engine._kill_dependents({'t2': 'failed'})
+            self.assertEqual([x.strip() for x in commands], ['sos kill t3 t4', 'scancel 13'])
+            self.assertEqual(engine._downstream, {})
+            engine.add_dependencies({'t1': 't4'})
+            self.assertRaises(ValueError, engine._dependency_groups, ['t1', 't3', 't4'])
+            engine._job_ids.close()
+        # upstream jobs that have left the queue are dropped only if their tasks have completed
+        engine = PBS_TaskEngine(ShellAgent(dict(BASE_CONFIG, scheduler='slurm', submit_cmd='sbatch {depend} {job_file}',
+            status_cmd='squeue -j {job_id}', kill_cmd='scancel {job_id}', status_cache_ttl=0,
+            bulk_status_cmd="printf '11 RUNNING\\n'")))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.set_many({'t1': {'job_id': '11'}, 't2': {'job_id': '12'}})
+            engine.add_dependencies({'t3': ['t1', 't2']})
+            engine._sos_status = lambda task_ids: {'t2': 'completed'}
+            self.assertEqual(engine._depend_option(['t3']), '--kill-on-invalid-dep=yes --dependency=afterok:11')
+            for status in ({'t2': 'failed'}, {}):
+                engine._sos_status = lambda task_ids: status
+                self.assertRaises(RuntimeError, engine._depend_option, ['t3'])
+            engine._job_ids.close()
+
+    def testTailTasks(self):
+        os.makedirs(os.path.join(os.path.expanduser('~'), '.sos', 'tasks'), exist_ok=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            agent = SSHAgent(dict(BASE_CONFIG, max_tail_bytes=4,
+                stdout_file=os.path.join(tmp_dir, "{task} {job_id}'s.out"),
+                stderr_file=os.path.join(tmp_dir, '{task}.err')), tmp_dir)
+            engine = PBS_TaskEngine(agent)
+            engine._job_ids = JobIdStore(os.path.join(tmp_dir, 'jobs.db'))
+            engine._job_ids.set_many({'t1': {'job_id': '1'}, 't2': {'job_id': '2'}})
+            with open(os.path.join(tmp_dir, "t1 1's.out"), 'wb') as out:
+                out.write('héllo'.encode())
+            # files that do not exist yet are skipped
+            self.assertEqual(engine.tail_tasks(['t1', 't2']), {'t1': {'stdout': 'hél'}, 't2': {}})
+            self.assertEqual(engine.tail_tasks(['t1', 't2']), {'t1': {'stdout': 'lo'}, 't2': {}})
+            with open(os.path.join(tmp_dir, 't2.err'), 'w') as err:
+                err.write('error')
+            self.assertEqual(engine.tail_tasks(['t1', 't2'], streams=['stderr']), {'t1': {}, 't2': {'stderr': 'erro'}})
+            # truncated files are read from the start
+            with open(os.path.join(tmp_dir, "t1 1's.out"), 'w') as out:
+                out.write('hi')
+            self.assertEqual(engine.tail_tasks(['t1']), {'t1': {'stdout': 'hi'}})
+            self.assertEqual(engine.tail_tasks(['t2']), {'t2': {'stderr': 'r'}})
+            # the script that reads the files is sent once
+            self.assertEqual(agent.sent, [engine._output_tail.script_name])
+            engine._job_ids.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import json
+import os
+import tempfile
+import unittest
+
+from sos_pbs.timing import PhaseTimer
+
+
+class TestPhaseTimer(unittest.TestCase):
+    def testPhases(self):
+        timer = PhaseTimer()
+        with timer.batch(['task1', 'task2']) as record:
+            with timer.tasks(['task1']), timer.phase('load_params'):
+                pass
+            # time of a phase of several tasks is split among the tasks
+            timer.add('submit', 1.0)
+            timer.count('bytes_sent', 100)
+        self.assertEqual(record['tasks'], 2)
+        self.assertEqual(set(record['phases'].keys()), {'load_params', 'submit'})
+        self.assertEqual(record['counters'], {'bytes_sent': 100})
+        self.assertEqual(timer.task_phases['task2'], {'submit': 0.5})
+        self.assertEqual(set(timer.task_phases['task1'].keys()), {'load_params', 'submit'})
+        # phases outside of a batch are counted but not attributed to tasks
+        timer.add('submit', 2.0)
+        summary = timer.summary()
+        self.assertEqual(summary['phases']['submit']['count'], 2)
+        self.assertEqual(summary['phases']['submit']['max'], 2.0)
+        self.assertEqual(len(summary['batches']), 1)
+
+    def testSave(self):
+        timer = PhaseTimer()
+        timer.add('submit', 1.0)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'timing', 'summary.json')
+            timer.save(filename)
+            with open(filename) as summary:
+                self.assertEqual(json.load(summary)['phases']['submit']['total'], 1.0)
+            # phases of tasks and batches are cleared after they are saved, and are
+            # added to those saved before
+            for task_id in ('task1', 'task2'):
+                with timer.batch([task_id]):
+                    timer.add('submit', 1.0)
+                timer.save(filename)
+                self.assertEqual((timer.task_phases, timer.batches), ({}, []))
+            with timer.tasks(['task1']):
+                timer.add('submit', 1.0)
+            timer.save(filename)
+            with open(filename) as summary:
+                summary = json.load(summary)
+            self.assertEqual(summary['phases']['submit']['total'], 4.0)
+            self.assertEqual(len(summary['batches']), 2)
+            self.assertEqual(summary['tasks'], {'task1': {'submit': 2.0}, 'task2': {'submit': 1.0}})
+        timer.reset()
+        self.assertEqual(timer.summary()['phases'], {})
+
+    def testDetails(self):
+        # only the total time of phases is kept without details
+        timer = PhaseTimer(details=False)
+        with timer.batch(['task1']) as record:
+            timer.add('submit', 1.0)
+        self.assertEqual(record['phases'], {'submit': 1.0})
+        summary = timer.summary()
+        self.assertEqual((summary['phases']['submit']['total'], summary['tasks'], summary['batches']), (1.0, {}, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
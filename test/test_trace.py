@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) Bo Peng and the University of Texas MD Anderson Cancer Center
+# Distributed under the terms of the 3-clause BSD License.
+
+import os
+import subprocess
+import tempfile
+import unittest
+
+from sos.tasks import TaskFile, TaskParams
+
+from sos_pbs.trace import ReplayAgent, TraceRecorder, read_trace, write_task_file
+
+
+class EchoAgent:
+    alias = 'echo'
+    address = 'localhost'
+    port = 22
+
+    def check_output(self, cmd):
+        return subprocess.check_output(cmd, shell=True).decode()
+
+    def send_task_file(self, task_file):
+        pass
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.trace_file = os.path.join(self.temp_dir.name, 'trace.jsonl')
+        # task files are written to ~/.sos/tasks of a temporary home directory
+        self.home = os.environ['HOME']
+        os.environ['HOME'] = self.temp_dir.name
+        os.makedirs(os.path.join(self.temp_dir.name, '.sos', 'tasks'))
+
+    def tearDown(self):
+        os.environ['HOME'] = self.home
+        self.temp_dir.cleanup()
+
+    def testRecordReplay(self):
+        recorder = TraceRecorder(EchoAgent(), self.trace_file, {'submit_cmd': 'qsub {job_file}', 'password': 'pass'})
+        recorder.record_call('kill_tasks', ['task1'])
+        self.assertEqual(recorder.check_output('echo 1'), '1\n')
+        self.assertEqual(recorder.check_output('echo 1'), '1\n')
+        self.assertRaises(subprocess.CalledProcessError, recorder.check_output, 'echo 2; exit 3')
+        recorder.send_task_file(os.path.join(self.temp_dir.name, 'task1.sh'))
+        recorder.close()
+
+        # options that might be secrets are not recorded
+        header, calls, tasks, interactions = read_trace(self.trace_file)
+        self.assertEqual(header['config'], {'submit_cmd': 'qsub {job_file}'})
+        self.assertEqual([(x['method'], x['args']) for x in calls], [('kill_tasks', [['task1']])])
+        self.assertEqual(tasks, {})
+        self.assertEqual(len(interactions), 4)
+
+        agent = ReplayAgent(header, interactions)
+        # outputs are replayed in order, and the last output is reused
+        for i in range(3):
+            self.assertEqual(agent.check_output('echo 1'), '1\n')
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            agent.check_output('echo 2; exit 3')
+        self.assertEqual(cm.exception.returncode, 3)
+        self.assertEqual(cm.exception.output, '2\n')
+        agent.send_task_file('/some/other/dir/task1.sh')
+        self.assertRaises(RuntimeError, agent.check_output, 'echo 3')
+        self.assertEqual(agent.missing, [('check_output', 'echo 3')])
+
+    def testRecordTasks(self):
+        TaskFile('task1').save(TaskParams(name='task1', global_def='', task='echo secret',
+            sos_dict={'_runtime': {'cores': 2}, 'step_name': 'step_1', 'token': 'secret'}, tags=[]))
+        for task_files in (False, True):
+            trace_file = os.path.join(self.temp_dir.name, f'trace_{task_files}.jsonl')
+            recorder = TraceRecorder(EchoAgent(), trace_file, {}, task_files=task_files)
+            recorder.record_call('execute_tasks', ['task1', 'task2'])
+            recorder.close()
+            header, calls, tasks, interactions = read_trace(trace_file)
+            self.assertEqual(list(tasks.keys()), ['task1'])
+            self.assertEqual('content' in tasks['task1'], task_files)
+            # without task files, tasks are written with the recorded runtime options and step
+            if not task_files:
+                self.assertEqual(tasks['task1'], {'runtime': {'cores': 2}, 'step_name': 'step_1'})
+                os.remove(TaskFile('task1').task_file)
+                write_task_file('task1', tasks['task1'])
+                self.assertEqual(TaskFile('task1').params.sos_dict, {'_runtime': {'cores': 2}, 'step_name': 'step_1'})
+
+
+if __name__ == '__main__':
+    unittest.main()